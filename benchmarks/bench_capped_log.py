@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    Capped log appends/s, round trips and commands sent: LPUSH + LTRIM
+    per event, the same pipelined per batch and CappedLog.append_many()
+    with one LPUSH + LTRIM per entity of a batch.
+    Needs running Redis from config_files/dev.yml 'redis1' section.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_capped_log.py [num_events]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from exp3_list_type_cmd.capped_log import CappedLog
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, serialize_json
+
+DEFAULT_NUM_EVENTS = 20000
+NUM_ENTITIES = 100
+BATCH_SIZE = 500
+MAX_LEN = 100
+
+
+async def per_event(log, events):
+    for entity, event in events:
+        await log.rd.lpush(log.key(entity), serialize_json(event))
+        await log.rd.ltrim(log.key(entity), 0, log.max_len - 1)
+    log.round_trips += 2 * len(events)
+    log.commands += 2 * len(events)
+
+
+async def per_event_pipelined(log, events):
+    for i in range(0, len(events), BATCH_SIZE):
+        pipe = log.rd.pipeline()
+        for entity, event in events[i:i + BATCH_SIZE]:
+            pipe.lpush(log.key(entity), serialize_json(event))
+            pipe.ltrim(log.key(entity), 0, log.max_len - 1)
+        await pipe.execute()
+        log.round_trips += 1
+    log.commands += 2 * len(events)
+
+
+async def batched(log, events):
+    for i in range(0, len(events), BATCH_SIZE):
+        await log.append_many(events[i:i + BATCH_SIZE])
+
+
+async def bench(rd, num_events):
+    events = [('entity%d' % random.randrange(NUM_ENTITIES), {'seq': i, 'payload': 'x' * 32})
+              for i in range(num_events)]
+    entities = ['entity%d' % i for i in range(NUM_ENTITIES)]
+    expected = None
+    for mode, append in (('LPUSH+LTRIM per event', per_event),
+                         ('pipelined per event', per_event_pipelined),
+                         ('append_many', batched)):
+        log = CappedLog(rd, 'bench_capped_log', MAX_LEN)
+        await log.delete(entities)
+        start = time.perf_counter()
+        await append(log, events)
+        elapsed = time.perf_counter() - start
+        logger.info('CAPPED_LOG (%s): %.0f events/s, %s round trips, %s commands (%.2f per event)',
+                    mode, num_events / elapsed, log.round_trips, log.commands,
+                    log.commands / num_events)
+        # All modes must leave the same logs
+        latest = await log.read_many(entities, MAX_LEN)
+        assert expected is None or latest == expected, mode
+        expected = latest
+        await log.delete(entities)
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_EVENTS
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(bench(rd_conn.rd, num_events))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
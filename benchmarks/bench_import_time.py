@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+    Import-time benchmark for the example entry points.
+    Runs a fresh interpreter with `-X importtime` for every module
+    and fails if the cumulative import time exceeds the budget.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_import_time.py [budget_ms]
+"""
+import os
+import subprocess
+import sys
+import time
+
+from settings import BASE_DIR, logger
+from utils import load_config
+
+MODULES = (
+    'settings', 'utils', 'custom_errors', 'redis_client',
+    # One entry point per examples directory
+    'exp1_str_type_cmd.async_str_key_exp',
+    'exp2_generic_type_cmd.async_generic_cmd_exp',
+    'exp3_list_type_cmd.async_list_cmd_exp',
+    'exp4_hash_type_cmd.async_hash_cmd_exp',
+    'exp5_set_type_cmd.async_set_cmd_exp',
+    'exp6_hyperloglog_cmd.async_hyperloglog_cmd',
+    'exp7_transaction_cmd.async_transaction_cmd',
+    'exp8_sorted_set_cmd.async_sorted_set_cmd',
+    'exp9_scripting_cmd.async_scripting_cmd',
+    'exp10_pubsub_cmd.async_pubsub_cmd',
+    'exp11_server_cmd.async_server_cmd',
+    'exp12_cluster_cmd.async_cluster_cmd',
+    'exp13_geo_cmd.async_geo_cmd',
+    'exp14_sentinel_cmd.async_sentinel_cmd',
+)
+DEFAULT_BUDGET_MS = 150  # redis_client and entry points import aioredis
+RUNS = 5
+
+
+def import_time_us(module):
+    """
+    Returns cumulative import time of the module in a fresh interpreter.
+
+    :param str module: module name
+
+    :return: cumulative import time (us)
+    :rtype: int
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative)
+    raise RuntimeError('No importtime record for module: %s' % module)
+
+
+def bench_load_config(file_name, runs=100):
+    """
+    Compares yaml parsing with the cached config snapshot.
+
+    :param str file_name: absolute path to config file
+    :param int runs: number of loads
+
+    :return: (parse time, cached time) per load (us)
+    :rtype: tuple
+    """
+    load_config(file_name)  # warm up the cache
+
+    res = []
+    for use_cache in (False, True):
+        start = time.perf_counter()
+        for _ in range(runs):
+            load_config(file_name, use_cache=use_cache)
+        res.append((time.perf_counter() - start) / runs * 1e6)
+    return tuple(res)
+
+
+def main():
+    budget_us = int(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BUDGET_MS) * 1000
+    failed = []
+    for module in MODULES:
+        best = min(import_time_us(module) for _ in range(RUNS))
+        logger.info('IMPORT_TIME: MODULE - %s, CUMULATIVE - %s us', module, best)
+        if best > budget_us:
+            failed.append(module)
+
+    parse_us, cached_us = bench_load_config(os.path.join(BASE_DIR, 'config_files/dev.yml'))
+    logger.info('LOAD_CONFIG: YAML - %.1f us, CACHED - %.1f us', parse_us, cached_us)
+
+    if failed:
+        logger.error('Import time budget %s us exceeded: %s', budget_us, ', '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
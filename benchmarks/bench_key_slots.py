@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    Client side hash slot computation benchmark.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_key_slots.py [num_keys]
+"""
+import random
+import sys
+import time
+
+from redis_slots import group_by_slot, key_slot, key_slots
+from settings import logger
+
+DEFAULT_NUM_KEYS = 1000000
+
+# Known CLUSTER KEYSLOT replies
+KNOWN_SLOTS = {
+    '123456789': 12739,
+    'foo': 12182,
+    'bar': 5061,
+    '{user1000}.following': 3443,
+    '{user1000}.followers': 3443,
+    'foo{}{bar}': 8363,
+    'foo{{bar}}zap': 4015,
+    'foo{bar}{zap}': 5061,
+}
+
+
+def make_keys(num_keys):
+    templates = ('user:%d:profile', 'session:%d', '{cart:%d}.items', 'counter:%d:hits')
+    return [random.choice(templates) % i for i in range(num_keys)]
+
+
+def bench(name, func, keys):
+    start = time.perf_counter()
+    func(keys)
+    elapsed = time.perf_counter() - start
+    logger.info('%s: %.0f keys/s', name, len(keys) / elapsed)
+
+
+def main():
+    for key, slot in KNOWN_SLOTS.items():
+        assert key_slot(key) == slot, (key, key_slot(key), slot)
+    assert list(key_slots(list(KNOWN_SLOTS))) == list(KNOWN_SLOTS.values())
+
+    keys = make_keys(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_KEYS)
+    bench('KEY_SLOT (per key)', lambda ks: [key_slot(k) for k in ks], keys)
+    bench('KEY_SLOTS (batch)', key_slots, keys)
+    bench('KEY_SLOTS (batch, bytes)', key_slots, [k.encode() for k in keys])
+    bench('GROUP_BY_SLOT', group_by_slot, keys)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    Packed BITFIELD counters vs one key per counter (INCRBY):
+    memory (INFO used_memory delta) and increments/s, both pipelined.
+    Needs running Redis from config_files/dev.yml 'redis1' section.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_packed_counters.py [num_counters] [num_increments]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from exp1_str_type_cmd.packed_counters import PackedCounters
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, parse_info
+
+DEFAULT_NUM_COUNTERS = 100000
+DEFAULT_NUM_INCREMENTS = 200000
+PIPELINE_SIZE = 1000
+KEY_PREFIX = 'bench_counter:'
+
+
+async def used_memory(rd):
+    info = await rd.execute(b'INFO', b'memory', encoding='utf-8')
+    return int(parse_info(info)['used_memory'])
+
+
+async def bench_per_key(rd, ids):
+    for i in range(0, len(ids), PIPELINE_SIZE):
+        pipe = rd.pipeline()
+        for index in ids[i:i + PIPELINE_SIZE]:
+            pipe.incrby(KEY_PREFIX + str(index), 1)
+        await pipe.execute()
+
+
+async def cleanup_per_key(rd, num_counters):
+    keys = [KEY_PREFIX + str(index) for index in range(num_counters)]
+    for i in range(0, len(keys), PIPELINE_SIZE):
+        await rd.delete(*keys[i:i + PIPELINE_SIZE])
+
+
+async def bench(rd, num_counters, num_increments):
+    ids = [random.randrange(num_counters) for _ in range(num_increments)]
+    # every counter exists, so memory of all num_counters is compared
+    ids[:num_counters] = range(num_counters)
+    counters = PackedCounters(rd, 'bench_counter_array', width=32, overflow='SAT')
+    await counters.reset()
+    await cleanup_per_key(rd, num_counters)
+
+    results = {}
+    for name, run in (('INCRBY per key', lambda: bench_per_key(rd, ids)),
+                      ('BITFIELD u32', lambda: counters.incr_many([(i, 1) for i in ids]))):
+        before = await used_memory(rd)
+        start = time.perf_counter()
+        await run()
+        elapsed = time.perf_counter() - start
+        results[name] = (num_increments / elapsed, await used_memory(rd) - before)
+
+    expected = [0] * num_counters
+    for index in ids:
+        expected[index] += 1
+    assert list(await counters.read_all(num_counters)) == expected
+    await counters.reset()
+    await cleanup_per_key(rd, num_counters)
+
+    for name, (rate, memory) in results.items():
+        logger.info('%s: %s counters, %.0f incr/s, %s bytes (%.1f bytes/counter)',
+                    name, num_counters, rate, memory, memory / num_counters)
+
+
+def main():
+    num_counters = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_COUNTERS
+    num_increments = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NUM_INCREMENTS
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(bench(rd_conn.rd, num_counters, max(num_increments, num_counters)))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
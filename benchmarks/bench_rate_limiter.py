@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Rate limiters throughput: checks/s and round trips of one check
+    per call, batched checks and batched checks with local leases.
+    Needs running Redis from config_files/dev.yml 'redis1' section.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_rate_limiter.py [num_checks]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from redis_client import rd_client_factory
+from redis_ratelimit import FixedWindowLimiter, SlidingLogLimiter, TokenBucketLimiter
+from settings import BASE_DIR, logger
+from utils import load_config
+
+DEFAULT_NUM_CHECKS = 20000
+NUM_KEYS = 100
+BATCH_SIZE = 100
+LIMIT = 1000
+WINDOW = 1  # sec
+
+
+async def bench(rd, num_checks):
+    keys = ['user%d' % random.randrange(NUM_KEYS) for _ in range(num_checks)]
+    for limiter_cls in (FixedWindowLimiter, SlidingLogLimiter, TokenBucketLimiter):
+        for mode, batch_size, local_fraction in (('single', 1, 0), ('batch', BATCH_SIZE, 0),
+                                                 ('batch+local 10%', BATCH_SIZE, 0.1)):
+            limiter = limiter_cls(rd, LIMIT, WINDOW, local_fraction, prefix='bench_ratelimit')
+            for key in set(keys):
+                await limiter.reset(key)
+            allowed = 0
+            start = time.perf_counter()
+            for i in range(0, num_checks, batch_size):
+                results = await limiter.check_many(keys[i:i + batch_size])
+                allowed += sum(1 for ok, _, _ in results if ok)
+            elapsed = time.perf_counter() - start
+            logger.info('%s (%s): %.0f checks/s, %s round trips, %s local, %s/%s allowed',
+                        limiter_cls.__name__, mode, num_checks / elapsed,
+                        limiter.round_trips, limiter.local_hits, allowed, num_checks)
+            for key in set(keys):
+                await limiter.reset(key)
+
+
+def main():
+    num_checks = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_CHECKS
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(bench(rd_conn.rd, num_checks))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    Reliable queue throughput (jobs/s) and latency (enqueue to
+    handler start, p50/p99) for different consumers concurrency.
+    Needs running Redis from config_files/dev.yml 'redis1' section.
+
+    Usage: PYTHONPATH=. python benchmarks/bench_reliable_queue.py [num_jobs]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from exp3_list_type_cmd.reliable_queue import QueueConsumers, ReliableQueue
+from redis_blocking import BlockingPool
+from redis_client import rd_client_factory
+from redis_config import validate_pool_config
+from settings import BASE_DIR, logger
+from utils import load_config
+
+DEFAULT_NUM_JOBS = 20000
+CONCURRENCY = (1, 4, 16)
+PRODUCER_BATCH = 100
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+async def bench(rd, blocking, num_jobs):
+    for concurrency in CONCURRENCY:
+        queue = ReliableQueue(rd, 'bench_jobs', blocking=blocking)
+        await rd.delete(queue.queue_key)
+        latencies = []
+
+        async def handler(body):
+            latencies.append(time.time() - body)
+
+        consumers = QueueConsumers(queue, handler, concurrency, reaper_interval=None)
+        consumers.start()
+        start = time.perf_counter()
+        for i in range(0, num_jobs, PRODUCER_BATCH):
+            await queue.put_many([time.time()] * min(PRODUCER_BATCH, num_jobs - i))
+        while len(latencies) < num_jobs:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await consumers.stop()
+        logger.info('RELIABLE_QUEUE (%s consumers): %.0f jobs/s, latency p50 %.1f ms, p99 %.1f ms',
+                    concurrency, num_jobs / elapsed,
+                    percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000)
+    await rd.delete(queue.queue_key, queue.workers_key)
+
+
+def main():
+    num_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_JOBS
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    # Blocked consumers wait on their own pool, acks and producers use rd_conn pool
+    blocking = BlockingPool(loop, validate_pool_config(
+        dict(conf['redis1'], blocking_maxsize=max(CONCURRENCY)), 'redis1'))
+    try:
+        loop.run_until_complete(bench(rd_conn.rd, blocking, num_jobs))
+    finally:
+        loop.run_until_complete(blocking.close())
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,3 +6,6 @@ class RedisConnectionLost(Exception):
     def __init__(self, *args, **kwargs):
         pass
 
+
+class RedisConfigError(Exception):
+    """ Error caused with invalid Redis configuration """
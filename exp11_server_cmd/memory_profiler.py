@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+    Keyspace memory profiler: keys are scanned by SCAN, all or a sampled
+    part of them is described by pipelined TYPE, OBJECT ENCODING,
+    MEMORY USAGE (DEBUG OBJECT serializedlength before Redis 4), PTTL
+    and OBJECT IDLETIME. Results are grouped by key prefix and reported:
+      - biggest prefixes by memory,
+      - keys in big encodings (hashes, sets and sorted sets which left
+        listpack/ziplist/intset, lists which left listpack - quicklist
+        since Redis 7.2, linkedlist before 3.2),
+      - cold keys which were not accessed for cold_idle seconds.
+    Numbers of a sampled profile are estimates scaled by 1 / sample_rate.
+    For commands details see: http://redis.io/commands/memory-usage
+
+    Usage: PYTHONPATH=. python exp11_server_cmd/memory_profiler.py [sample_rate] [pattern]
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+from collections import Counter
+
+import aioredis
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, parse_info, pipeline_command
+
+# type: (big encodings, length command, compact encoding limits in CONFIG, listpack names first)
+BIG_ENCODINGS = {
+    'hash': (('hashtable',), 'hlen', ('hash-max-listpack-entries', 'hash-max-ziplist-entries')),
+    'zset': (('skiplist',), 'zcard', ('zset-max-listpack-entries', 'zset-max-ziplist-entries')),
+    'set': (('hashtable',), 'scard', ('set-max-listpack-entries', 'set-max-intset-entries')),
+    'list': (('quicklist', 'linkedlist'), 'llen',
+             ('list-max-listpack-size', 'list-max-ziplist-size', 'list-max-ziplist-entries')),
+}
+# Small lists are listpacks since Redis 7.2, before it every list is a quicklist (3.2+)
+LIST_LISTPACK_VERSION = (7, 2)
+SERIALIZED_LENGTH_RE = re.compile(r'serializedlength:(\d+)')
+
+
+def key_prefix(key, depth=1, separator=':'):
+    """
+    Returns prefix pattern of the key: first depth parts and '*'.
+
+    :param str key: key name
+    :param int depth: number of key parts in prefix
+    :param str separator: key parts separator
+
+    :return: prefix pattern, e.g. 'user:*' for 'user:1000:profile'
+    :rtype: str
+    """
+    parts = key.split(separator, depth)
+    if len(parts) <= depth:
+        return key
+    return separator.join(parts[:depth] + ['*'])
+
+
+def as_text(reply):
+    """ Status reply is bytes unless the pool has encoding """
+    return reply.decode() if isinstance(reply, bytes) else reply
+
+
+class PrefixStats:
+    """ Aggregated stats of keys with the same prefix """
+
+    def __init__(self):
+        self.keys = 0
+        self.memory = 0
+        self.types = Counter()
+        self.no_ttl = 0
+        self.cold_keys = 0
+        self.cold_memory = 0
+        self.big_encodings = {}  # (type, encoding): [keys, memory, max length, examples]
+
+
+class KeyspaceProfiler:
+    """ Collects per key memory info and groups it by prefix """
+
+    def __init__(self, rd, pattern='*', sample_rate=1.0, batch_size=500,
+                 prefix_depth=1, separator=':', cold_idle=7 * 24 * 3600):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str pattern: keys pattern
+        :param float sample_rate: part of scanned keys to profile, 0..1
+        :param int batch_size: SCAN COUNT and keys in one pipeline
+        :param int prefix_depth: key parts in prefix
+        :param str separator: key parts separator
+        :param int cold_idle: idle time of cold keys (sec)
+
+        :return: None
+        """
+        self.rd = rd
+        self.pattern = pattern
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.prefix_depth = prefix_depth
+        self.separator = separator
+        self.cold_idle = cold_idle
+        self.prefixes = {}
+        self.scanned = 0
+        self.profiled = 0
+        self.thresholds = {}
+        self.big_encodings = {type_: encodings for type_, (encodings, _, _) in BIG_ENCODINGS.items()}
+        self._memory_usage = True
+
+    async def _load_thresholds(self):
+        info = parse_info(await self.rd.execute(b'INFO', b'server', encoding='utf-8'))
+        version = tuple(int(part) for part in info['redis_version'].split('.')[:2])
+        if version < LIST_LISTPACK_VERSION:
+            self.big_encodings['list'] = ('linkedlist',)
+        try:
+            # *-max-* also matches list-max-listpack-size / list-max-ziplist-size
+            reply = await self.rd.execute(b'CONFIG', b'GET', '*-max-*', encoding='utf-8')
+        except aioredis.errors.ReplyError as e:
+            logger.warning('Encoding thresholds are not available: %s', e)
+            return
+        config = dict(zip(reply[::2], reply[1::2]))
+        for type_, (_, _, names) in BIG_ENCODINGS.items():
+            for name in names:
+                if name in config:
+                    self.thresholds[type_] = int(config[name])
+                    break
+
+    async def _memory(self, keys, replies):
+        """
+        Returns MEMORY USAGE of keys, DEBUG OBJECT serializedlength
+          if MEMORY command is unknown (Redis before 4.0).
+
+        :param list keys: keys
+        :param list replies: MEMORY USAGE replies or errors
+
+        :return: memory of keys (bytes)
+        :rtype: list
+        """
+        if self._memory_usage and not all(isinstance(r, aioredis.errors.ReplyError) for r in replies):
+            return [0 if isinstance(r, Exception) or r is None else r for r in replies]
+        self._memory_usage = False
+        pipe = self.rd.pipeline()
+        for key in keys:
+            pipeline_command(pipe, b'DEBUG', b'OBJECT', key, encoding='utf-8')
+        debug = await pipe.execute(return_exceptions=True)
+        memory = []
+        for reply in debug:
+            match = None if isinstance(reply, Exception) else SERIALIZED_LENGTH_RE.search(reply)
+            memory.append(int(match.group(1)) if match else 0)
+        return memory
+
+    async def profile_batch(self, keys):
+        """
+        Describes keys by pipelined commands and adds them to prefixes stats.
+
+        :param list keys: keys (bytes)
+
+        :return: None
+        """
+        pipe = self.rd.pipeline()
+        for key in keys:
+            pipe.type(key)
+            pipe.object_encoding(key)
+            if self._memory_usage:
+                pipeline_command(pipe, b'MEMORY', b'USAGE', key)
+            pipe.pttl(key)
+            # Fails with LFU maxmemory-policy, idle time is unknown then
+            pipe.object_idletime(key)
+        replies = await pipe.execute(return_exceptions=True)
+        step = 5 if self._memory_usage else 4
+        types = [as_text(reply) for reply in replies[0::step]]
+        encodings = [as_text(reply) for reply in replies[1::step]]
+        memory = await self._memory(keys, replies[2::step] if self._memory_usage else [])
+        ttls, idles = replies[step - 2::step], replies[step - 1::step]
+
+        # Lengths of keys in big encodings
+        big = [i for i, (type_, encoding) in enumerate(zip(types, encodings))
+               if encoding in self.big_encodings.get(type_, ())]
+        lengths = {}
+        if big:
+            pipe = self.rd.pipeline()
+            for i in big:
+                getattr(pipe, BIG_ENCODINGS[types[i]][1])(keys[i])
+            lengths = dict(zip(big, await pipe.execute(return_exceptions=True)))
+
+        for i, key in enumerate(keys):
+            if types[i] == 'none' or isinstance(types[i], Exception):
+                # Deleted or expired after SCAN
+                continue
+            # Key names are binary safe, not decodable bytes are only shown replaced
+            key = key.decode(errors='replace')
+            stats = self.prefixes.setdefault(
+                key_prefix(key, self.prefix_depth, self.separator), PrefixStats())
+            stats.keys += 1
+            stats.memory += memory[i]
+            stats.types[types[i]] += 1
+            if ttls[i] == -1:
+                stats.no_ttl += 1
+            if not isinstance(idles[i], Exception) and idles[i] >= self.cold_idle:
+                stats.cold_keys += 1
+                stats.cold_memory += memory[i]
+            if i in lengths:
+                entry = stats.big_encodings.setdefault((types[i], encodings[i]), [0, 0, 0, []])
+                entry[0] += 1
+                entry[1] += memory[i]
+                if not isinstance(lengths[i], Exception):
+                    entry[2] = max(entry[2], lengths[i])
+                if len(entry[3]) < 3:
+                    entry[3].append(key)
+            self.profiled += 1
+
+    async def profile(self):
+        """
+        Scans the keyspace and profiles all or sampled keys.
+
+        :return: prefix: PrefixStats
+        :rtype: dict
+        """
+        await self._load_thresholds()
+        cursor = b'0'
+        while True:
+            # Raw bytes: keys are sent back to Redis as they are
+            cursor, keys = await self.rd.execute(
+                b'SCAN', cursor, b'MATCH', self.pattern, b'COUNT', self.batch_size, encoding=None)
+            self.scanned += len(keys)
+            if self.sample_rate < 1:
+                keys = [key for key in keys if random.random() < self.sample_rate]
+            if keys:
+                await self.profile_batch(keys)
+            if cursor == b'0':
+                return self.prefixes
+
+    def report(self, top=10):
+        """
+        Builds report, numbers are scaled by 1 / sample_rate.
+
+        :param int top: number of entries in every list
+
+        :return: {'biggest': [...], 'big_encodings': [...], 'cold': [...]}
+        :rtype: dict
+        """
+        scale = 1 / self.sample_rate if self.sample_rate else 0
+        total = sum(stats.memory for stats in self.prefixes.values()) or 1
+
+        biggest = sorted(self.prefixes.items(), key=lambda item: item[1].memory, reverse=True)
+        big_encodings = sorted(
+            ((prefix, type_, encoding, keys, memory, max_len, self.thresholds.get(type_), examples)
+             for prefix, stats in self.prefixes.items()
+             for (type_, encoding), (keys, memory, max_len, examples) in stats.big_encodings.items()),
+            key=lambda entry: entry[4], reverse=True)
+        cold = sorted(((prefix, stats) for prefix, stats in self.prefixes.items() if stats.cold_keys),
+                      key=lambda item: item[1].cold_memory, reverse=True)
+        return {
+            'biggest': [{
+                'prefix': prefix, 'keys': int(stats.keys * scale), 'memory': int(stats.memory * scale),
+                'share': round(stats.memory / total, 4), 'types': dict(stats.types),
+                'no_ttl': int(stats.no_ttl * scale)} for prefix, stats in biggest[:top]],
+            'big_encodings': [{
+                'prefix': prefix, 'type': type_, 'encoding': encoding, 'keys': int(keys * scale),
+                'memory': int(memory * scale), 'max_length': max_len, 'compact_limit': limit,
+                'examples': examples}
+                for prefix, type_, encoding, keys, memory, max_len, limit, examples in big_encodings[:top]],
+            'cold': [{
+                'prefix': prefix, 'keys': int(stats.cold_keys * scale),
+                'memory': int(stats.cold_memory * scale)} for prefix, stats in cold[:top]],
+        }
+
+    def log_report(self, top=10):
+        report = self.report(top)
+        logger.info('MEMORY_PROFILE: SCANNED - %s, PROFILED - %s, SAMPLE_RATE - %s',
+                    self.scanned, self.profiled, self.sample_rate)
+        for entry in report['biggest']:
+            logger.info('BIGGEST_PREFIX: %s', entry)
+        for entry in report['big_encodings']:
+            logger.info('BIG_ENCODING: %s', entry)
+        for entry in report['cold']:
+            logger.info('COLD_KEYS: %s', entry)
+
+
+def main():
+    sample_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    pattern = sys.argv[2] if len(sys.argv) > 2 else '*'
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    profiler = KeyspaceProfiler(rd_conn.rd, pattern, sample_rate)
+    try:
+        loop.run_until_complete(profiler.profile())
+        profiler.log_report()
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
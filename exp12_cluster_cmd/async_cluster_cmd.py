@@ -5,8 +5,10 @@
 """
 import asyncio
 import os
+import random
 
 from redis_client import rd_client_factory
+from redis_slots import key_slots
 from settings import BASE_DIR, logger
 from utils import load_config
 
@@ -25,6 +27,7 @@ class RedisClusterCommands:
         await self.cluster_cluster_forget_cmd()
         await self.cluster_cluster_get_keys_in_slots_cmd()
         await self.cluster_cluster_keyslot_cmd()
+        await self.cluster_keyslot_crosscheck_cmd()
         await self.cluster_cluster_meet_cmd()
         await self.cluster_cluster_replicate_cmd()
         await self.cluster_cluster_reset_cmd()
@@ -188,6 +191,30 @@ class RedisClusterCommands:
         frm = "CLUSTER_CMD - 'CLUSTER_KEYSLOT': RES - {0}\n"
         logger.debug(frm.format(res1))
 
+    async def cluster_keyslot_crosscheck_cmd(self):
+        """
+        Cross-checks client side batched hash slot computation
+          (redis_slots.key_slots) with server CLUSTER KEYSLOT
+          replies for random keys, including {hashtag} keys.
+
+        :return: None
+        """
+        templates = ('key_%s', '{user%s}.following', 'foo{}{bar%s}', 'foo{{bar}}%s', '{%s}')
+        keys = [random.choice(templates) % i for i in range(1000)]
+        try:
+            with await self.rd1 as conn:
+                pipe = conn.pipeline()
+                futures = [pipe.cluster_keyslot(key) for key in keys]
+                await pipe.execute()
+            server_slots = [f.result() for f in futures]
+            mismatch = [key for key, local, server in zip(keys, key_slots(keys), server_slots)
+                        if local != server]
+            res1 = 'MISMATCH: %s' % mismatch[:10] if mismatch else 'OK'
+        except Exception as e:
+            res1 = 'HANDLE ERROR: %s' % e
+        frm = "CLUSTER_CMD - 'CLUSTER_KEYSLOT_CROSSCHECK': KEYS - {0}, RES - {1}\n"
+        logger.debug(frm.format(len(keys), res1))
+
     async def cluster_cluster_meet_cmd(self):
         """
         CLUSTER MEET is used in order to connect
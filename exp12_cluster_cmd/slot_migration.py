@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+    Online hash slots migration between Redis Cluster nodes.
+    Every slot is moved as described in CLUSTER SETSLOT docs:
+      1. target: CLUSTER SETSLOT <slot> IMPORTING <source-id>
+      2. source: CLUSTER SETSLOT <slot> MIGRATING <target-id>
+      3. source: CLUSTER GETKEYSINSLOT + MIGRATE ... KEYS until slot is empty
+      4. all masters: CLUSTER SETSLOT <slot> NODE <target-id>
+    For commands details see: http://redis.io/commands/cluster-setslot
+
+    Usage: PYTHONPATH=. python exp12_cluster_cmd/slot_migration.py <first slot> <last slot>
+"""
+import asyncio
+import os
+import sys
+import time
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import deserialize_json, load_config, pipeline_command, serialize_json
+
+
+async def cluster_node_id(rd):
+    """
+    Returns id of the node from CLUSTER NODES 'myself' line.
+
+    :param rd: node connection pool
+    :type rd: aioredis.Redis
+
+    :return: node id
+    :rtype: str
+    """
+    nodes = await rd.execute(b'CLUSTER', b'NODES', encoding='utf-8')
+    for line in nodes.splitlines():
+        node_id, _, flags = line.split()[:3]
+        if 'myself' in flags.split(','):
+            return node_id
+    raise RuntimeError('CLUSTER NODES reply has no myself node')
+
+
+class SlotMigration:
+    """
+    Moves hash slots from source node to target node. Slots are
+      migrated in parallel, keys rate is capped, finished slots are
+      saved to checkpoint file, so interrupted migration is resumed
+      from the slots which were not finished.
+    """
+    def __init__(self, source, target, target_address, others=(), batch_size=100,
+                 pipeline_depth=4, parallel=4, max_keys_per_sec=None,
+                 timeout_ms=5000, replace=False, checkpoint_file=None):
+        """
+        :param source: source node connection pool
+        :type source: aioredis.Redis
+        :param target: target node connection pool
+        :type target: aioredis.Redis
+        :param tuple target_address: (host, port) of target as seen by source
+        :param list others: connection pools of other masters,
+          they are notified about new slot owner
+        :param int batch_size: keys in one MIGRATE command
+        :param int pipeline_depth: MIGRATE commands in one pipeline
+        :param int parallel: slots migrated at once
+        :param int max_keys_per_sec: keys rate cap, None - no cap
+        :param int timeout_ms: MIGRATE timeout
+        :param bool replace: if True - replace existing keys on target
+        :param str checkpoint_file: path to file with finished slots
+
+        :return: None
+        """
+        self.source = source
+        self.target = target
+        self.target_address = target_address
+        self.others = list(others)
+        self.batch_size = batch_size
+        self.pipeline_depth = pipeline_depth
+        self.parallel = parallel
+        self.max_keys_per_sec = max_keys_per_sec
+        self.timeout_ms = timeout_ms
+        self.replace = replace
+        self.checkpoint_file = checkpoint_file
+
+        self.done = set()
+        self.keys_moved = 0
+        self._started = None
+        self._rate_lock = asyncio.Lock()
+        self._checkpoint_lock = asyncio.Lock()
+
+    def _load_checkpoint(self):
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'rt') as f:
+                self.done = set(deserialize_json(f.read())['done'])
+            logger.info('Slot migration resumed: %s slots already done', len(self.done))
+
+    async def _save_checkpoint(self):
+        if not self.checkpoint_file:
+            return
+        async with self._checkpoint_lock:
+            tmp_file = self.checkpoint_file + '.tmp'
+            with open(tmp_file, 'wt') as f:
+                f.write(serialize_json({'done': sorted(self.done)}))
+            os.replace(tmp_file, self.checkpoint_file)
+
+    async def _throttle(self, keys):
+        """
+        Sleeps so the total keys rate does not exceed max_keys_per_sec.
+
+        :param int keys: number of keys just moved
+
+        :return: None
+        """
+        async with self._rate_lock:
+            self.keys_moved += keys
+            if self.max_keys_per_sec:
+                ahead = self.keys_moved / self.max_keys_per_sec - (time.monotonic() - self._started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+    async def _migrate_keys(self, slot):
+        """
+        Moves keys of the slot by pipelined MIGRATE ... KEYS batches
+          until CLUSTER GETKEYSINSLOT returns no keys.
+
+        :param int slot: hash slot
+
+        :return: number of moved keys
+        :rtype: int
+        """
+        host, port = self.target_address
+        options = (b'REPLACE',) if self.replace else ()
+        moved = 0
+        while True:
+            keys = await self.source.execute(
+                b'CLUSTER', b'GETKEYSINSLOT', slot, self.batch_size * self.pipeline_depth)
+            if not keys:
+                return moved
+
+            pipe = self.source.pipeline()
+            for i in range(0, len(keys), self.batch_size):
+                pipeline_command(pipe, b'MIGRATE', host, port, b'', 0, self.timeout_ms, *options,
+                                 b'KEYS', *keys[i:i + self.batch_size])
+            await pipe.execute()
+            moved += len(keys)
+            await self._throttle(len(keys))
+
+    async def migrate_slot(self, slot, source_id, target_id):
+        """
+        Moves one slot from source to target node.
+
+        :param int slot: hash slot
+        :param str source_id: source node id
+        :param str target_id: target node id
+
+        :return: None
+        """
+        await self.target.execute(b'CLUSTER', b'SETSLOT', slot, b'IMPORTING', source_id)
+        await self.source.execute(b'CLUSTER', b'SETSLOT', slot, b'MIGRATING', target_id)
+        moved = await self._migrate_keys(slot)
+
+        # Target first: it must own the slot before source redirects clients to it
+        for rd in [self.target, self.source] + self.others:
+            await rd.execute(b'CLUSTER', b'SETSLOT', slot, b'NODE', target_id)
+
+        self.done.add(slot)
+        await self._save_checkpoint()
+        logger.debug('Slot %s migrated: %s keys', slot, moved)
+
+    async def _report(self, total, interval):
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - self._started
+            logger.info('Slot migration: %s/%s slots, %s keys, %.0f keys/s',
+                        len(self.done), total, self.keys_moved, self.keys_moved / elapsed)
+
+    async def migrate(self, slots, report_interval=5):
+        """
+        Moves slots in parallel, slots from checkpoint are skipped.
+
+        :param list slots: hash slots to move
+        :param float report_interval: progress report interval (sec)
+
+        :return: number of moved keys
+        :rtype: int
+        """
+        self._load_checkpoint()
+        source_id = await cluster_node_id(self.source)
+        target_id = await cluster_node_id(self.target)
+        pending = [slot for slot in slots if slot not in self.done]
+        semaphore = asyncio.Semaphore(self.parallel)
+
+        async def run(slot):
+            async with semaphore:
+                await self.migrate_slot(slot, source_id, target_id)
+
+        self._started = time.monotonic()
+        reporter = asyncio.ensure_future(self._report(len(slots), report_interval))
+        try:
+            await asyncio.gather(*(run(slot) for slot in pending))
+        finally:
+            reporter.cancel()
+        elapsed = time.monotonic() - self._started
+        logger.info('Slot migration finished: %s slots, %s keys in %.1f s',
+                    len(pending), self.keys_moved, elapsed)
+        return self.keys_moved
+
+
+def main():
+    first, last = int(sys.argv[1]), int(sys.argv[2])
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    source = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    target = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis2']))
+    migration = SlotMigration(
+        source.rd, target.rd, (conf['redis2']['host'], conf['redis2']['port']),
+        max_keys_per_sec=10000,
+        checkpoint_file=os.path.join(BASE_DIR, 'slot_migration_%s_%s.json' % (first, last)))
+    try:
+        loop.run_until_complete(migration.migrate(range(first, last + 1)))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(source.close_connection())
+        loop.run_until_complete(target.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
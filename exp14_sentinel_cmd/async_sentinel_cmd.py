@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+    Simple example of Redis Sentinel failover using async lib - aioredis
+    For commands details see: https://redis.io/topics/sentinel
+
+    The example starts local stand-in setup: master, replica and sentinel
+    processes (redis-server and redis-sentinel must be in PATH), then
+    kills the master and measures how fast RedisClient writes again.
+"""
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+from redis_client import RedisClient
+from settings import logger
+
+SERVICE = 'exp_master'
+MASTER_PORT, REPLICA_PORT, SENTINEL_PORT = 6390, 6391, 26390
+
+SENTINEL_CONF = """port {port}
+sentinel monitor {service} 127.0.0.1 {master_port} 1
+sentinel down-after-milliseconds {service} 1000
+sentinel failover-timeout {service} 5000
+"""
+
+
+class SentinelStandIn:
+    """ Local master + replica + sentinel processes """
+
+    def __init__(self):
+        self.work_dir = tempfile.mkdtemp(prefix='redis_sentinel_')
+        self.procs = {}
+
+    def _spawn(self, name, *args):
+        self.procs[name] = subprocess.Popen(
+            args, cwd=self.work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def start(self):
+        self._spawn('master', 'redis-server', '--port', str(MASTER_PORT), '--save', '')
+        self._spawn('replica', 'redis-server', '--port', str(REPLICA_PORT), '--save', '',
+                    '--slaveof', '127.0.0.1', str(MASTER_PORT))
+        conf_path = os.path.join(self.work_dir, 'sentinel.conf')
+        with open(conf_path, 'w') as f:
+            f.write(SENTINEL_CONF.format(port=SENTINEL_PORT, service=SERVICE,
+                                         master_port=MASTER_PORT))
+        self._spawn('sentinel', 'redis-sentinel', conf_path)
+
+    def kill(self, name):
+        self.procs[name].send_signal(signal.SIGKILL)
+        self.procs[name].wait()
+
+    def stop(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class RedisSentinelCommands:
+    def __init__(self, rd, stand_in):
+        self.rd = rd
+        self.stand_in = stand_in
+
+    async def run_sentinel_cmd(self):
+        await self.sentinel_get_master_addr_cmd()
+        await self.sentinel_failover_cmd()
+
+    async def sentinel_get_master_addr_cmd(self):
+        """
+        SENTINEL get-master-addr-by-name <master name>
+          Return the ip and port number of the master with that name.
+          If a failover is in progress or terminated successfully
+          for this master it returns the address and port of
+          the promoted replica.
+
+        :return: None
+        """
+        master, replicas = await self.rd.sentinel.discover()
+        frm = "SENTINEL_CMD - 'GET-MASTER-ADDR-BY-NAME': MASTER - {0}, REPLICAS - {1}\n"
+        logger.debug(frm.format(master, replicas))
+
+    async def sentinel_failover_cmd(self, timeout=60):
+        """
+        Kills master process and writes key until the write succeeds
+          on the promoted replica. Client learns the new master from
+          +switch-master event or re-resolves it on connection error.
+
+        :param int timeout: max failover time (sec)
+
+        :return: None
+        """
+        key = 'sentinel_failover_cmd'
+        old_master = self.rd.conf['host'], self.rd.conf['port']
+        await self.rd.setv(key, 'before')
+
+        self.stand_in.kill('master')
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            try:
+                await asyncio.wait_for(self.rd.setv(key, 'after'), 1)
+                if (self.rd.conf['host'], self.rd.conf['port']) != old_master:
+                    break
+            except Exception as e:
+                logger.debug('Write failed during failover: %s', e)
+            await asyncio.sleep(0.05)
+        res = await self.rd.getv(key)
+        frm = "SENTINEL_CMD - 'FAILOVER': OLD_MASTER - {0}, NEW_MASTER - {1}," \
+              " VALUE - {2}, WRITE_DOWNTIME - {3:.3f} s\n"
+        logger.debug(frm.format(old_master, (self.rd.conf['host'], self.rd.conf['port']),
+                                res, time.monotonic() - start))
+
+
+def main():
+    conf = {
+        'host': '127.0.0.1',
+        'port': MASTER_PORT,
+        'retry_delay': 0.1,
+        'sentinels': [{'host': '127.0.0.1', 'port': SENTINEL_PORT}],
+        'service_name': SERVICE,
+    }
+    stand_in = SentinelStandIn()
+    stand_in.start()
+    # create event loop
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(asyncio.sleep(2))  # wait replica sync
+        rd = loop.run_until_complete(RedisClient.connect(loop=loop, conf=conf))
+        rsc = RedisSentinelCommands(rd, stand_in)
+        try:
+            loop.run_until_complete(rsc.run_sentinel_cmd())
+        except KeyboardInterrupt as e:
+            logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+        finally:
+            loop.run_until_complete(rd.close_connection())
+    finally:
+        stand_in.stop()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+    Bitmap analytics on top of SETBIT/BITFIELD/BITOP/BITCOUNT,
+    e.g. daily active users tracking: bit N of the day bitmap is set
+    if user N was active. Bitmaps are range-partitioned by user id,
+    so every string stays small: partition P of day D is key
+    '<prefix>:<D>:<P>' and holds ids P * partition_size ... (P + 1) * partition_size - 1.
+    For commands details see: http://redis.io/commands/#string
+"""
+import asyncio
+import datetime as dt
+import os
+import random
+import uuid
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, pipeline_command
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, pure python path is used
+    np = None
+
+PARTITION_SIZE = 1 << 23  # bits, 1 MB string
+BITFIELD_BATCH = 1000  # SET subcommands in one BITFIELD
+TMP_TTL = 60  # sec
+BITOPS = ('AND', 'OR', 'XOR', 'NOT')
+
+
+def popcount(bitmap):
+    """
+    Counts set bits of the bitmap, same as BITCOUNT.
+
+    :param bytes bitmap: bitmap value
+
+    :return: number of set bits
+    :rtype: int
+    """
+    if np is not None:
+        return int(np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8)).sum())
+    return bin(int.from_bytes(bitmap, 'big')).count('1')
+
+
+def bit_positions(bitmap, base=0):
+    """
+    Returns positions of set bits. Redis numbers bits from the
+      most significant bit of the first byte.
+
+    :param bytes bitmap: bitmap value
+    :param int base: position of the first bit
+
+    :return: positions of set bits
+    :rtype: list
+    """
+    if np is not None:
+        bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))
+        return (np.flatnonzero(bits) + base).tolist()
+    return [base + i * 8 + bit for i, byte in enumerate(bitmap) if byte
+            for bit in range(8) if byte & (0x80 >> bit)]
+
+
+class BitmapAnalytics:
+    """ Partitioned per-day bitmaps of ids """
+
+    def __init__(self, rd, prefix='dau', partition_size=PARTITION_SIZE):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str prefix: keys prefix
+        :param int partition_size: ids in one bitmap partition
+
+        :return: None
+        """
+        self.rd = rd
+        self.prefix = prefix
+        self.partition_size = partition_size
+
+    def key(self, day, partition):
+        return '%s:%s:%s' % (self.prefix, day, partition)
+
+    def partitions_key(self, day):
+        # Set of not empty partitions of the day
+        return '%s:%s:partitions' % (self.prefix, day)
+
+    @staticmethod
+    def days(start, end):
+        """
+        Returns ISO dates of the range, both ends included.
+
+        :param datetime.date start: first day
+        :param datetime.date end: last day
+
+        :return: list of dates
+        :rtype: list
+        """
+        return [(start + dt.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+    async def partitions(self, *days):
+        """
+        Returns partitions which are not empty in any of the days.
+
+        :param days: ISO dates
+
+        :return: sorted partition numbers
+        :rtype: list
+        """
+        members = await self.rd.sunion(*(self.partitions_key(day) for day in days))
+        return sorted(int(p) for p in members)
+
+    async def mark(self, day, ids, use_bitfield=True):
+        """
+        Sets bits of ids in day bitmaps in one pipeline: one
+          BITFIELD with up to BITFIELD_BATCH 'SET u1 <offset> 1'
+          per partition or SETBIT per id.
+
+        :param str day: ISO date
+        :param list ids: non-negative int ids
+        :param bool use_bitfield: if False - use SETBIT per id
+
+        :return: None
+        """
+        by_partition = {}
+        for user_id in ids:
+            by_partition.setdefault(user_id // self.partition_size, []).append(
+                user_id % self.partition_size)
+
+        pipe = self.rd.pipeline()
+        for partition, offsets in by_partition.items():
+            key = self.key(day, partition)
+            if not use_bitfield:
+                for offset in offsets:
+                    pipe.setbit(key, offset, 1)
+                continue
+            for i in range(0, len(offsets), BITFIELD_BATCH):
+                args = []
+                for offset in offsets[i:i + BITFIELD_BATCH]:
+                    args.extend((b'SET', b'u1', offset, 1))
+                pipeline_command(pipe, b'BITFIELD', key, *args)
+        if by_partition:
+            pipe.sadd(self.partitions_key(day), *by_partition)
+        await pipe.execute()
+
+    async def count(self, day):
+        """
+        Returns number of ids in the day: BITCOUNT summed over partitions.
+
+        :param str day: ISO date
+
+        :return: number of ids
+        :rtype: int
+        """
+        partitions = await self.partitions(day)
+        pipe = self.rd.pipeline()
+        futures = [pipe.bitcount(self.key(day, partition)) for partition in partitions]
+        await pipe.execute()
+        return sum(f.result() for f in futures)
+
+    async def combine(self, op, days, ttl=TMP_TTL):
+        """
+        Combines day bitmaps by server side BITOP per partition into
+          temporary keys, e.g. AND - ids active every day (cohort
+          retention), OR - ids active in any day of the range.
+
+        :param str op: 'AND', 'OR', 'XOR' or 'NOT' (of one day)
+        :param list days: ISO dates
+        :param int ttl: time to live of temporary keys
+
+        :return: (temporary keys prefix, partitions)
+        :rtype: tuple
+        """
+        if op not in BITOPS or (op == 'NOT' and len(days) != 1):
+            raise ValueError('Unsupported BITOP %s of %s days' % (op, len(days)))
+        tmp_prefix = '%s:tmp:%s' % (self.prefix, uuid.uuid4().hex)
+        partitions = await self.partitions(*days)
+        pipe = self.rd.pipeline()
+        bitop = getattr(pipe, 'bitop_' + op.lower())
+        for partition in partitions:
+            dest = '%s:%s' % (tmp_prefix, partition)
+            bitop(dest, *(self.key(day, partition) for day in days))
+            pipe.expire(dest, ttl)
+        await pipe.execute()
+        return tmp_prefix, partitions
+
+    async def combine_count(self, op, days):
+        """
+        Returns number of ids in BITOP of day bitmaps.
+
+        :param str op: 'AND', 'OR', 'XOR' or 'NOT' (of one day)
+        :param list days: ISO dates
+
+        :return: number of ids
+        :rtype: int
+        """
+        tmp_prefix, partitions = await self.combine(op, days)
+        keys = ['%s:%s' % (tmp_prefix, partition) for partition in partitions]
+        pipe = self.rd.pipeline()
+        futures = [pipe.bitcount(key) for key in keys]
+        if keys:
+            pipe.delete(*keys)
+        await pipe.execute()
+        return sum(f.result() for f in futures)
+
+    async def intersect_count(self, days):
+        return await self.combine_count('AND', days)
+
+    async def union_count(self, days):
+        return await self.combine_count('OR', days)
+
+    async def fetch_ids(self, day):
+        """
+        Fetches day bitmaps and decodes ids locally.
+
+        :param str day: ISO date
+
+        :return: sorted ids
+        :rtype: list
+        """
+        partitions = await self.partitions(day)
+        pipe = self.rd.pipeline()
+        futures = [pipe.get(self.key(day, partition), encoding=None) for partition in partitions]
+        await pipe.execute()
+        ids = []
+        for partition, future in zip(partitions, futures):
+            ids.extend(bit_positions(future.result() or b'', base=partition * self.partition_size))
+        return ids
+
+    async def fetch_count(self, day):
+        """
+        Fetches day bitmaps and counts ids locally.
+
+        :param str day: ISO date
+
+        :return: number of ids
+        :rtype: int
+        """
+        partitions = await self.partitions(day)
+        pipe = self.rd.pipeline()
+        futures = [pipe.get(self.key(day, partition), encoding=None) for partition in partitions]
+        await pipe.execute()
+        return sum(popcount(f.result() or b'') for f in futures)
+
+    async def delete(self, days):
+        """
+        Deletes day bitmaps.
+
+        :param list days: ISO dates
+
+        :return: None
+        """
+        keys = []
+        for day in days:
+            keys.extend(self.key(day, p) for p in await self.partitions(day))
+            keys.append(self.partitions_key(day))
+        await self.rd.delete(*keys)
+
+
+async def run_bitmap_analytics(rd, users=100000, active=0.3):
+    """
+    Example: DAU for 3 days, users active every day and any day of them.
+
+    :return: None
+    """
+    analytics = BitmapAnalytics(rd, prefix='exp_dau', partition_size=1 << 16)
+    today = dt.date.today()
+    days = BitmapAnalytics.days(today - dt.timedelta(days=2), today)
+    for day in days:
+        await analytics.mark(day, random.sample(range(users), int(users * active)))
+
+    dau = [await analytics.count(day) for day in days]
+    local_dau = [await analytics.fetch_count(day) for day in days]
+    retained = await analytics.intersect_count(days)
+    active_any = await analytics.union_count(days)
+    await analytics.delete(days)
+    frm = "BITMAP_ANALYTICS: DAYS - {0}, DAU - {1}, LOCAL_DAU - {2}, RETAINED - {3}, ACTIVE - {4}\n"
+    logger.debug(frm.format(days, dau, local_dau, retained, active_any))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_bitmap_analytics(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
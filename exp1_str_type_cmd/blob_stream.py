@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+    Streaming of large string values by fixed-size chunks:
+    SETRANGE to write and GETRANGE to read, pipeline_depth chunks are
+    sent in one pipeline, so client memory is bounded by
+    chunk_size * pipeline_depth instead of the whole value.
+    Blob is written to a temporary key and renamed at close, so readers
+    never see a partially written value.
+    For commands details see: http://redis.io/commands/#string
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config
+
+CHUNK_SIZE = 512 * 1024  # bytes
+PIPELINE_DEPTH = 8  # chunks in one pipeline
+
+
+class BlobWriter:
+    """ File-like async writer, use 'async with' or call close() """
+
+    def __init__(self, rd, key, chunk_size=CHUNK_SIZE, pipeline_depth=PIPELINE_DEPTH, ttl=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str key: blob key
+        :param int chunk_size: bytes in one SETRANGE
+        :param int pipeline_depth: SETRANGE in one pipeline
+        :param int ttl: blob time to live (sec)
+
+        :return: None
+        """
+        self.rd = rd
+        self.key = key
+        self.tmp_key = '%s:uploading:%s' % (key, uuid.uuid4().hex)
+        self.chunk_size = chunk_size
+        self.pipeline_depth = pipeline_depth
+        self.ttl = ttl
+        self.offset = 0
+        self._buffer = bytearray()
+        self._chunks = []
+        self.closed = False
+
+    async def write(self, data):
+        """
+        Buffers data, full chunks are sent by pipeline_depth.
+
+        :param bytes data: next part of the blob
+
+        :return: number of written bytes
+        :rtype: int
+        """
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._chunks.append(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+            if len(self._chunks) >= self.pipeline_depth:
+                await self._send()
+        return len(data)
+
+    async def _send(self):
+        pipe = self.rd.pipeline()
+        for chunk in self._chunks:
+            pipe.setrange(self.tmp_key, self.offset, chunk)
+            self.offset += len(chunk)
+        # Temporary key of broken upload expires
+        pipe.expire(self.tmp_key, 3600)
+        await pipe.execute()
+        self._chunks = []
+
+    async def close(self):
+        """
+        Sends the rest and renames temporary key to the blob key.
+
+        :return: blob size
+        :rtype: int
+        """
+        if self.closed:
+            return self.offset
+        if self._buffer:
+            self._chunks.append(bytes(self._buffer))
+            self._buffer = bytearray()
+        if self._chunks:
+            await self._send()
+        pipe = self.rd.multi_exec()
+        if self.offset:
+            pipe.rename(self.tmp_key, self.key)
+            if self.ttl:
+                pipe.expire(self.key, self.ttl)
+            else:
+                pipe.persist(self.key)
+        else:
+            # Empty blob: SETRANGE was never called
+            pipe.set(self.key, b'', expire=self.ttl or 0)
+        await pipe.execute()
+        self.closed = True
+        return self.offset
+
+    async def abort(self):
+        self.closed = True
+        await self.rd.delete(self.tmp_key)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
+
+
+class BlobReader:
+    """
+    File-like async reader of the byte range of the blob, also an
+      async iterator of chunks. Chunks are read ahead by pipeline.
+    """
+    def __init__(self, rd, key, size, start=0, end=None,
+                 chunk_size=CHUNK_SIZE, pipeline_depth=PIPELINE_DEPTH):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str key: blob key
+        :param int size: blob size (STRLEN)
+        :param int start: first byte of the range
+        :param int end: last byte of the range (included), None - end of blob
+        :param int chunk_size: bytes in one GETRANGE
+        :param int pipeline_depth: GETRANGE in one pipeline
+
+        :return: None
+        """
+        self.rd = rd
+        self.key = key
+        self.size = size
+        self.start = start
+        self.end = size - 1 if end is None else min(end, size - 1)
+        self.chunk_size = chunk_size
+        self.pipeline_depth = pipeline_depth
+        self.position = start
+        self._fetched = start  # next byte to request
+        self._chunks = []
+
+    def tell(self):
+        return self.position - self.start
+
+    def seek(self, offset):
+        """
+        Moves position inside the range, read ahead chunks are dropped.
+
+        :param int offset: offset from range start
+
+        :return: new offset
+        :rtype: int
+        """
+        self.position = self._fetched = self.start + offset
+        self._chunks = []
+        return offset
+
+    async def _read_ahead(self):
+        pipe = self.rd.pipeline()
+        futures = []
+        while len(futures) < self.pipeline_depth and self._fetched <= self.end:
+            last = min(self._fetched + self.chunk_size, self.end + 1) - 1
+            futures.append(pipe.getrange(self.key, self._fetched, last, encoding=None))
+            self._fetched = last + 1
+        await pipe.execute()
+        self._chunks.extend(f.result() for f in futures)
+
+    async def read_chunk(self):
+        """
+        Returns next chunk, empty bytes at the end of range.
+
+        :return: chunk
+        :rtype: bytes
+        """
+        if not self._chunks:
+            if self._fetched > self.end:
+                return b''
+            await self._read_ahead()
+        chunk = self._chunks.pop(0)
+        self.position += len(chunk)
+        return chunk
+
+    async def read(self, n=-1):
+        """
+        Reads up to n bytes, all the rest of the range if n < 0.
+
+        :param int n: number of bytes
+
+        :return: data
+        :rtype: bytes
+        """
+        data = bytearray()
+        while n < 0 or len(data) < n:
+            chunk = await self.read_chunk()
+            if not chunk:
+                break
+            if 0 <= n < len(data) + len(chunk):
+                keep = n - len(data)
+                self._chunks.insert(0, chunk[keep:])
+                self.position -= len(chunk) - keep
+                chunk = chunk[:keep]
+            data += chunk
+        return bytes(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read_chunk()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+
+class BlobStore:
+    """ Opens streaming readers and writers of blobs """
+
+    def __init__(self, rd, chunk_size=CHUNK_SIZE, pipeline_depth=PIPELINE_DEPTH):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param int chunk_size: bytes in one SETRANGE/GETRANGE
+        :param int pipeline_depth: chunks in one pipeline
+
+        :return: None
+        """
+        self.rd = rd
+        self.chunk_size = chunk_size
+        self.pipeline_depth = pipeline_depth
+
+    def open_writer(self, key, ttl=None):
+        return BlobWriter(self.rd, key, self.chunk_size, self.pipeline_depth, ttl)
+
+    async def open_reader(self, key, start=0, end=None):
+        """
+        Opens reader of the blob or its byte range (like HTTP Range).
+
+        :param str key: blob key
+        :param int start: first byte
+        :param int end: last byte (included), None - end of blob
+
+        :return: reader
+        :rtype: BlobReader
+        """
+        size = await self.rd.strlen(key)
+        return BlobReader(self.rd, key, size, start, end, self.chunk_size, self.pipeline_depth)
+
+    async def upload_file(self, key, path, ttl=None):
+        """
+        Streams file into the blob, reads the file by chunk_size.
+
+        :param str key: blob key
+        :param str path: file path
+        :param int ttl: blob time to live (sec)
+
+        :return: blob size
+        :rtype: int
+        """
+        async with self.open_writer(key, ttl) as writer:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    await writer.write(chunk)
+        return writer.offset
+
+    async def download_file(self, key, path, start=0, end=None):
+        """
+        Streams the blob or its range into the file.
+
+        :param str key: blob key
+        :param str path: file path
+        :param int start: first byte
+        :param int end: last byte (included), None - end of blob
+
+        :return: number of written bytes
+        :rtype: int
+        """
+        written = 0
+        with open(path, 'wb') as f:
+            async for chunk in await self.open_reader(key, start, end):
+                written += f.write(chunk)
+        return written
+
+
+async def run_blob_stream(rd, size=20 * 1024 * 1024):
+    """
+    Example: streams 20 MB blob in and reads it back in full and by range.
+
+    :return: None
+    """
+    store = BlobStore(rd)
+    key = 'exp_blob'
+    blob = os.urandom(size)
+    async with store.open_writer(key) as writer:
+        for i in range(0, size, 100000):
+            await writer.write(blob[i:i + 100000])
+
+    digest = hashlib.sha1()
+    async for chunk in await store.open_reader(key):
+        digest.update(chunk)
+    reader = await store.open_reader(key, start=1000, end=1999)
+    head = await reader.read(10)
+    rest = await reader.read()
+    await rd.delete(key)
+    assert digest.hexdigest() == hashlib.sha1(blob).hexdigest()
+    assert head + rest == blob[1000:2000]
+    frm = "BLOB_STREAM: KEY - {0}, SIZE - {1}, SHA1 - {2}, RANGE 1000-1999 - {3} bytes\n"
+    logger.debug(frm.format(key, size, digest.hexdigest(), len(head + rest)))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_blob_stream(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+    Bulk import/export of string keys from/to a dump file.
+    Formats:
+      'tsv' - one 'key<TAB>value' record per line (no TAB/LF in keys and values)
+      'bin' - records of '>II' header (key length, value length), key, value
+    Import maps the file with mmap and finds records in place, batches
+    are sent by MSET (or pipelined SET EX with ttl) with a bounded number
+    of batches in flight. Export scans keys and streams MGET replies
+    into the buffered file in order.
+
+    Usage: PYTHONPATH=. python exp1_str_type_cmd/bulk_load.py load|export <file> [tsv|bin] [pattern]
+"""
+import asyncio
+import collections
+import mmap
+import os
+import resource
+import struct
+import sys
+import time
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config
+
+BATCH_SIZE = 1000  # keys in one MSET/MGET
+MAX_IN_FLIGHT = 4  # batches sent and not replied
+BIN_HEADER = struct.Struct('>II')
+FORMATS = ('tsv', 'bin')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def iter_records(mm, fmt='tsv'):
+    """
+    Yields (key, value) records of the mapped dump file.
+
+    :param mm: mapped file
+    :type mm: mmap.mmap
+    :param str fmt: 'tsv' or 'bin'
+
+    :return: generator of (key, value)
+    :rtype: generator
+    """
+    size, pos = len(mm), 0
+    if fmt == 'bin':
+        while pos < size:
+            key_len, value_len = BIN_HEADER.unpack_from(mm, pos)
+            pos += BIN_HEADER.size
+            yield mm[pos:pos + key_len], mm[pos + key_len:pos + key_len + value_len]
+            pos += key_len + value_len
+        return
+    while pos < size:
+        end = mm.find(b'\n', pos)
+        if end < 0:
+            end = size
+        tab = mm.find(b'\t', pos, end)
+        if tab >= 0:
+            yield mm[pos:tab], mm[tab + 1:end]
+        pos = end + 1
+
+
+def format_record(key, value, fmt='tsv'):
+    if fmt == 'bin':
+        return BIN_HEADER.pack(len(key), len(value)) + key + value
+    return key + b'\t' + value + b'\n'
+
+
+class BulkLoader:
+    """ Imports and exports string keyspace by batches """
+
+    def __init__(self, rd, batch_size=BATCH_SIZE, max_in_flight=MAX_IN_FLIGHT):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param int batch_size: keys in one batch
+        :param int max_in_flight: batches sent at once
+
+        :return: None
+        """
+        self.rd = rd
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+
+    async def _send(self, batch, ttl):
+        if ttl is None:
+            await self.rd.mset(*(item for pair in batch for item in pair))
+            return
+        pipe = self.rd.pipeline()
+        for key, value in batch:
+            pipe.set(key, value, expire=ttl)
+        await pipe.execute()
+
+    async def load(self, path, fmt='tsv', ttl=None):
+        """
+        Imports keys of the dump file.
+
+        :param str path: dump file path
+        :param str fmt: 'tsv' or 'bin'
+        :param int ttl: keys time to live (sec)
+
+        :return: number of keys
+        :rtype: int
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Dump format must be one of %s' % (FORMATS,))
+        if not os.path.getsize(path):
+            return 0
+        in_flight = set()
+        loaded = 0
+        start = time.perf_counter()
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                batch = []
+                for record in iter_records(mm, fmt):
+                    batch.append(record)
+                    if len(batch) < self.batch_size:
+                        continue
+                    if len(in_flight) >= self.max_in_flight:
+                        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()
+                    in_flight.add(asyncio.ensure_future(self._send(batch, ttl)))
+                    loaded += len(batch)
+                    batch = []
+                if batch:
+                    in_flight.add(asyncio.ensure_future(self._send(batch, ttl)))
+                    loaded += len(batch)
+                if in_flight:
+                    await asyncio.gather(*in_flight)
+            finally:
+                # On a batch error other batches must not outlive the load
+                for task in in_flight:
+                    task.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        self._report('Bulk load', loaded, start)
+        return loaded
+
+    async def scan_keys(self, pattern='*'):
+        """
+        Yields batches of keys matched by pattern, SCAN by batch_size.
+
+        :param str pattern: keys pattern
+
+        :return: async generator of lists of keys
+        :rtype: async_generator
+        """
+        cursor = b'0'
+        while True:
+            cursor, batch = await self.rd.execute(
+                b'SCAN', cursor, b'MATCH', pattern, b'COUNT', self.batch_size, encoding=None)
+            if batch:
+                yield batch
+            if cursor == b'0':
+                return
+
+    async def _key_batches(self, keys):
+        for i in range(0, len(keys), self.batch_size):
+            yield [key.encode() if isinstance(key, str) else key for key in keys[i:i + self.batch_size]]
+
+    async def export(self, path, keys=None, pattern='*', fmt='tsv'):
+        """
+        Exports keys (matched by pattern if keys is None) into the dump
+          file. Every SCAN batch is sent by MGET at once, MGET batches
+          are in flight while replies are written, so memory does not
+          grow with the keyspace.
+
+        :param str path: dump file path
+        :param list keys: keys to export
+        :param str pattern: keys pattern
+        :param str fmt: 'tsv' or 'bin'
+
+        :return: number of exported keys
+        :rtype: int
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Dump format must be one of %s' % (FORMATS,))
+        batches = self.scan_keys(pattern) if keys is None else self._key_batches(keys)
+        exported = 0
+        start = time.perf_counter()
+        in_flight = collections.deque()
+        with open(path, 'wb', buffering=1024 * 1024) as f:
+
+            async def write_oldest():
+                # Replies are written in order of batches
+                batch, future = in_flight.popleft()
+                written = 0
+                for key, value in zip(batch, await future):
+                    if value is not None:
+                        f.write(format_record(key, value, fmt))
+                        written += 1
+                return written
+
+            try:
+                async for batch in batches:
+                    if len(in_flight) >= self.max_in_flight:
+                        exported += await write_oldest()
+                    in_flight.append((batch, asyncio.ensure_future(self.rd.mget(*batch, encoding=None))))
+                while in_flight:
+                    exported += await write_oldest()
+            finally:
+                # On a write error pending MGETs are cancelled, not left behind
+                futures = [future for _, future in in_flight]
+                for future in futures:
+                    future.cancel()
+                await asyncio.gather(*futures, return_exceptions=True)
+        self._report('Bulk export', exported, start)
+        return exported
+
+    @staticmethod
+    def _report(name, keys, start):
+        elapsed = time.perf_counter() - start
+        logger.info('%s: %s keys in %.1f s, %.0f keys/s, peak RSS %.1f MB',
+                    name, keys, elapsed, keys / elapsed if elapsed else 0, peak_rss_mb())
+
+
+def main():
+    command, path = sys.argv[1], sys.argv[2]
+    fmt = sys.argv[3] if len(sys.argv) > 3 else 'tsv'
+    pattern = sys.argv[4] if len(sys.argv) > 4 else '*'
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    loader = BulkLoader(rd_conn.rd)
+    try:
+        if command == 'load':
+            loop.run_until_complete(loader.load(path, fmt))
+        else:
+            loop.run_until_complete(loader.export(path, pattern=pattern, fmt=fmt))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
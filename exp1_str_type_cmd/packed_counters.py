@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+    Packed counter arrays: fixed-width integer counters stored in one
+    string and updated by BITFIELD INCRBY, so millions of small counters
+    cost width bits each instead of a key per counter.
+    Counter N occupies bits N * width ... (N + 1) * width - 1 ('#N' offset).
+    For commands details see: http://redis.io/commands/bitfield
+"""
+import asyncio
+import os
+import random
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, pipeline_command
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, counters are decoded to list
+    np = None
+
+OVERFLOW_POLICIES = ('WRAP', 'SAT', 'FAIL')
+BITFIELD_BATCH = 1000  # INCRBY/GET subcommands in one BITFIELD
+
+
+def decode_counters(buf, width, signed=False, size=None):
+    """
+    Decodes packed big-endian counters as BITFIELD stores them.
+
+    :param bytes buf: string value, missing tail is read as zeros
+    :param int width: counter width (bits)
+    :param bool signed: if True - counters are two's complement
+    :param int size: number of counters, by default - all in buf
+
+    :return: counters, numpy.ndarray if numpy is installed
+    :rtype: numpy.ndarray or list
+    """
+    if size is None:
+        size = len(buf) * 8 // width
+    buf = buf[:(size * width + 7) // 8].ljust((size * width + 7) // 8, b'\0')
+
+    if np is not None:
+        if width in (8, 16, 32, 64):
+            dtype = np.dtype('>%s%s' % ('i' if signed else 'u', width // 8))
+            return np.frombuffer(buf, dtype=dtype, count=size).astype(dtype.newbyteorder('='))
+        bits = np.unpackbits(np.frombuffer(buf, dtype=np.uint8))[:size * width]
+        weights = np.left_shift(np.uint64(1), np.arange(width - 1, -1, -1, dtype=np.uint64))
+        values = bits.reshape(size, width).astype(np.uint64) @ weights
+        if not signed:
+            return values
+        # two's complement in uint64 arithmetic, then reinterpret as int64
+        sign = values >> np.uint64(width - 1)
+        return (values - (sign << np.uint64(width))).view(np.int64)
+
+    packed, total, mask = int.from_bytes(buf, 'big'), len(buf) * 8, (1 << width) - 1
+    values = [(packed >> (total - (i + 1) * width)) & mask for i in range(size)]
+    if signed:
+        values = [v - (1 << width) if v >> (width - 1) else v for v in values]
+    return values
+
+
+class PackedCounters:
+    """ Array of fixed-width counters in one string """
+
+    def __init__(self, rd, key, width=16, signed=False, overflow='SAT'):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str key: string key
+        :param int width: counter width, up to 64 bits signed or 63 unsigned
+        :param bool signed: if True - counters are signed
+        :param str overflow: 'WRAP', 'SAT' (clamp to min/max) or
+          'FAIL' (increment is not applied, None is returned)
+
+        :return: None
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Overflow policy must be one of %s' % (OVERFLOW_POLICIES,))
+        if not 0 < width <= (64 if signed else 63):
+            raise ValueError('Invalid counter width: %s' % width)
+        self.rd = rd
+        self.key = key
+        self.width = width
+        self.signed = signed
+        self.overflow = overflow
+        self.type = ('i%s' if signed else 'u%s') % width
+
+    async def _bitfield(self, subcommands, per_command, prefix=()):
+        """
+        Runs subcommands by BITFIELD_BATCH in one BITFIELD each,
+          more than one BITFIELD are sent in one pipeline.
+
+        :param list subcommands: flat subcommands arguments
+        :param int per_command: arguments in one subcommand
+        :param tuple prefix: arguments to start every BITFIELD with
+
+        :return: replies of all subcommands
+        :rtype: list
+        """
+        step = BITFIELD_BATCH * per_command
+        if len(subcommands) <= step:
+            return await self.rd.execute(b'BITFIELD', self.key, *prefix, *subcommands)
+        pipe = self.rd.pipeline()
+        futures = [pipeline_command(pipe, b'BITFIELD', self.key, *prefix, *subcommands[i:i + step])
+                   for i in range(0, len(subcommands), step)]
+        await pipe.execute()
+        return [value for f in futures for value in f.result()]
+
+    async def incrby(self, index, amount=1):
+        """
+        Increments one counter.
+
+        :param int index: counter index
+        :param int amount: increment, may be negative
+
+        :return: new value, None if FAIL policy rejected increment
+        :rtype: int
+        """
+        return (await self.incr_many([(index, amount)]))[0]
+
+    async def incr_many(self, increments):
+        """
+        Increments many counters in one BITFIELD command
+          (one pipeline for more than BITFIELD_BATCH counters).
+
+        :param increments: {index: amount} or list of (index, amount)
+        :type increments: dict or list
+
+        :return: new values in order of increments
+        :rtype: list
+        """
+        if isinstance(increments, dict):
+            increments = increments.items()
+        args = []
+        for index, amount in increments:
+            args.extend((b'INCRBY', self.type, '#%d' % index, amount))
+        if not args:
+            return []
+        # OVERFLOW applies to following INCRBY of the same BITFIELD only
+        return await self._bitfield(args, 4, prefix=(b'OVERFLOW', self.overflow))
+
+    async def get_many(self, indexes):
+        """
+        Reads counters by BITFIELD GET.
+
+        :param list indexes: counter indexes
+
+        :return: values
+        :rtype: list
+        """
+        args = []
+        for index in indexes:
+            args.extend((b'GET', self.type, '#%d' % index))
+        return await self._bitfield(args, 3) if args else []
+
+    async def read_all(self, size=None):
+        """
+        Reads the whole string by one GET and decodes it locally.
+
+        :param int size: number of counters, by default - all stored
+
+        :return: counters, numpy.ndarray if numpy is installed
+        :rtype: numpy.ndarray or list
+        """
+        buf = await self.rd.get(self.key, encoding=None)
+        return decode_counters(buf or b'', self.width, self.signed, size)
+
+    async def memory_usage(self):
+        return await self.rd.execute(b'MEMORY', b'USAGE', self.key)
+
+    async def reset(self):
+        await self.rd.delete(self.key)
+
+
+async def run_packed_counters(rd, size=10000, increments=100000):
+    """
+    Example: page views per page id in u16 saturating counters.
+
+    :return: None
+    """
+    counters = PackedCounters(rd, 'exp_packed:views', width=16, overflow='SAT')
+    await counters.reset()
+    ids = [random.randrange(size) for _ in range(increments)]
+    await counters.incr_many([(index, 1) for index in ids])
+
+    values = await counters.read_all(size)
+    expected = [0] * size
+    for index in ids:
+        expected[index] += 1
+    assert list(values) == [min(v, 0xffff) for v in expected]
+    frm = "PACKED_COUNTERS: COUNTERS - {0}, TOTAL - {1}, FIRST - {2}, MEMORY - {3} bytes\n"
+    logger.debug(frm.format(size, sum(expected), await counters.get_many(range(5)),
+                            await counters.memory_usage()))
+    await counters.reset()
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_packed_counters(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
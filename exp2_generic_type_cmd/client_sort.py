@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+    Client side replacement of SORT ... BY ... GET ... STORE.
+    Elements of the list, set or sorted set are fetched by chunks
+    (LRANGE/SSCAN/ZRANGE), BY keys of every chunk are resolved by one
+    pipeline and sorted locally: with LIMIT only offset + count best
+    elements are kept in a heap. GET keys are resolved for the result
+    only and STORE writes the result by RPUSH chunks into a temporary
+    key renamed to destination.
+    The planner runs server SORT for small collections, SORT blocks
+    the server for big ones, so client sort is used then. BY/GET keys
+    are resolved by pipelines of one node, in Redis Cluster they must
+    be in the slot of the sorted key (hash tags) for both sorts.
+    For commands details see: http://redis.io/commands/sort
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import uuid
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config
+
+CHUNK_SIZE = 1000  # elements in one fetch/resolve pipeline
+SERVER_SORT_MAX = 1000  # max cardinality sorted by server SORT
+CARDINALITY_COMMANDS = {'list': b'LLEN', 'set': b'SCARD', 'zset': b'ZCARD'}
+
+
+def _encode(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+class ClientSort:
+    """ SORT executed on the client side """
+
+    def __init__(self, rd, chunk_size=CHUNK_SIZE, server_sort_max=SERVER_SORT_MAX):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param int chunk_size: elements in one pipeline
+        :param int server_sort_max: max cardinality for server SORT,
+          0 - always sort on client
+
+        :return: None
+        """
+        self.rd = rd
+        self.chunk_size = chunk_size
+        self.server_sort_max = server_sort_max
+
+    async def _elements(self, key, key_type):
+        """
+        Yields chunks of collection elements.
+
+        :param str key: list, set or sorted set key
+        :param str key_type: TYPE of the key
+
+        :return: async generator of lists of elements
+        :rtype: async_generator
+        """
+        if key_type == 'set':
+            # SSCAN may return a member more than once
+            cursor, seen = b'0', set()
+            while True:
+                cursor, chunk = await self.rd.execute(
+                    b'SSCAN', key, cursor, b'COUNT', self.chunk_size, encoding=None)
+                chunk = [member for member in dict.fromkeys(chunk) if member not in seen]
+                seen.update(chunk)
+                if chunk:
+                    yield chunk
+                if cursor == b'0':
+                    return
+        command = b'LRANGE' if key_type == 'list' else b'ZRANGE'
+        for start in itertools.count(0, self.chunk_size):
+            chunk = await self.rd.execute(command, key, start, start + self.chunk_size - 1,
+                                          encoding=None)
+            if chunk:
+                yield chunk
+            if len(chunk) < self.chunk_size:
+                return
+
+    async def _resolve(self, pattern, elements):
+        """
+        Resolves pattern for elements by one pipeline like SORT does:
+          '#' - element itself, 'key_*' - GET, 'hash_*->field' - HGET.
+
+        :param str pattern: BY or GET pattern
+        :param list elements: elements
+
+        :return: resolved values, None for missing keys
+        :rtype: list
+        """
+        pattern = _encode(pattern)
+        if pattern == b'#':
+            return list(elements)
+        key_pattern, _, field = pattern.partition(b'->')
+        pipe = self.rd.pipeline()
+        for element in elements:
+            key = key_pattern.replace(b'*', element, 1)
+            if field:
+                pipe.hget(key, field, encoding=None)
+            else:
+                pipe.get(key, encoding=None)
+        return await pipe.execute()
+
+    @staticmethod
+    def _sort_key(value, element, alpha):
+        if alpha:
+            return value if value is not None else b'', element
+        try:
+            return float(value) if value is not None else 0.0, element
+        except ValueError:
+            raise ValueError('One or more scores can not be converted into double: %r' % value)
+
+    async def _sorted_elements(self, key, key_type, by, offset, count, desc, alpha):
+        if by == 'nosort':
+            elements = [element async for chunk in self._elements(key, key_type) for element in chunk]
+            return elements[offset:None if count is None else offset + count]
+
+        best = heapq.nlargest if desc else heapq.nsmallest
+        limit = None if count is None else offset + count
+        candidates = []
+        async for chunk in self._elements(key, key_type):
+            values = await self._resolve(by or '#', chunk)
+            sort_keys = [self._sort_key(v, e, alpha) for v, e in zip(values, chunk)]
+            if limit is None:
+                candidates.extend(sort_keys)
+            else:
+                # Top-k heap: at most offset + count candidates are kept
+                candidates = best(limit, itertools.chain(candidates, sort_keys))
+        if limit is None:
+            candidates.sort(reverse=desc)
+        return [element for _, element in candidates[offset:limit]]
+
+    async def client_sort(self, key, by=None, get=(), offset=0, count=None,
+                          desc=False, alpha=False, store=None):
+        """
+        Sorts on the client side, arguments are the same as of SORT.
+
+        :param str key: list, set or sorted set key
+        :param str by: BY pattern, 'nosort' - keep fetch order
+        :param list get: GET patterns
+        :param int offset: LIMIT offset
+        :param int count: LIMIT count, None - all elements
+        :param bool desc: if True - descending order
+        :param bool alpha: if True - sort lexicographically
+        :param str store: destination list key
+
+        :return: sorted elements (or GET values), length of result if store
+        :rtype: list or int
+        """
+        key_type = await self.rd.execute(b'TYPE', key, encoding='utf-8')
+        if key_type == 'none':
+            elements = []
+        elif key_type not in CARDINALITY_COMMANDS:
+            raise ValueError('Only list, set and sorted set can be sorted: %s is %s' % (key, key_type))
+        else:
+            elements = await self._sorted_elements(key, key_type, by, offset, count, desc, alpha)
+
+        if get:
+            resolved = []
+            for i in range(0, len(elements), self.chunk_size):
+                chunk = elements[i:i + self.chunk_size]
+                columns = [await self._resolve(pattern, chunk) for pattern in get]
+                resolved.extend(value for row in zip(*columns) for value in row)
+            elements = resolved
+        if store is None:
+            return elements
+        return await self._store(store, elements)
+
+    async def _store(self, dest, values):
+        """
+        Writes the result into the list by RPUSH chunks, the list is
+          replaced at once by RENAME of the temporary key.
+
+        :param str dest: destination key
+        :param list values: values, None is stored as empty string
+
+        :return: length of the list
+        :rtype: int
+        """
+        if not values:
+            await self.rd.delete(dest)
+            return 0
+        tmp_key = '%s:sorting:%s' % (dest, uuid.uuid4().hex)
+        for i in range(0, len(values), self.chunk_size):
+            pipe = self.rd.pipeline()
+            pipe.rpush(tmp_key, *(b'' if v is None else v for v in values[i:i + self.chunk_size]))
+            pipe.expire(tmp_key, 3600)
+            await pipe.execute()
+        pipe = self.rd.multi_exec()
+        pipe.rename(tmp_key, dest)
+        pipe.persist(dest)
+        await pipe.execute()
+        return len(values)
+
+    async def server_sort(self, key, by=None, get=(), offset=0, count=None,
+                          desc=False, alpha=False, store=None):
+        args = []
+        if by:
+            args.extend((b'BY', by))
+        if count is not None or offset:
+            args.extend((b'LIMIT', offset, -1 if count is None else count))
+        for pattern in get:
+            args.extend((b'GET', pattern))
+        if desc:
+            args.append(b'DESC')
+        if alpha:
+            args.append(b'ALPHA')
+        if store:
+            args.extend((b'STORE', store))
+        return await self.rd.execute(b'SORT', key, *args, encoding=None)
+
+    async def sort(self, key, **options):
+        """
+        Planner: server SORT for collections up to server_sort_max
+          elements, client sort for bigger ones.
+
+        :param str key: list, set or sorted set key
+        :param options: SORT options of client_sort()
+
+        :return: sorted elements (or GET values), length of result if store
+        :rtype: list or int
+        """
+        if self.server_sort_max:
+            key_type = await self.rd.execute(b'TYPE', key, encoding='utf-8')
+            command = CARDINALITY_COMMANDS.get(key_type)
+            if command is None or await self.rd.execute(command, key) <= self.server_sort_max:
+                return await self.server_sort(key, **options)
+        return await self.client_sort(key, **options)
+
+
+async def run_client_sort(rd, size=5000):
+    """
+    Example: top 10 users by score from hashes, client sort vs server SORT.
+
+    :return: None
+    """
+    sorter = ClientSort(rd)
+    key = 'exp_sort:users'
+    pipe = rd.pipeline()
+    for i in range(size):
+        pipe.rpush(key, i)
+        pipe.hset('exp_sort:user:%s' % i, 'score', (i * 7919) % size)
+    await pipe.execute()
+    options = dict(by='exp_sort:user:*->score', get=('#', 'exp_sort:user:*->score'),
+                   offset=0, count=10, desc=True)
+    client = await sorter.client_sort(key, **options)
+    server = await sorter.server_sort(key, **options)
+    assert client == server, (client, server)
+    await rd.delete(key, *('exp_sort:user:%s' % i for i in range(size)))
+    frm = "CLIENT_SORT: KEY - {0}, SIZE - {1}, TOP - {2}\n"
+    logger.debug(frm.format(key, size, client))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_client_sort(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
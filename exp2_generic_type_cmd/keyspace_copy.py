@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+    Keyspace copier between Redis instances or databases:
+      1. source: SCAN MATCH <pattern> - batches of keys go to a bounded queue
+      2. source: pipelined DUMP + PTTL of the batch
+      3. target: pipelined RESTORE <key> <ttl> <value> REPLACE
+    Batches are copied by concurrent workers, keys rate is capped and
+    SCAN cursor below which all batches are copied is saved to checkpoint
+    file, so interrupted copy is resumed from that cursor.
+    For commands details see: http://redis.io/commands/dump
+
+    Usage: PYTHONPATH=. python exp2_generic_type_cmd/keyspace_copy.py [pattern]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import deserialize_json, load_config, pipeline_command, serialize_json
+
+
+class KeyspaceCopier:
+    """
+    Copies keys matched by pattern from source to target by DUMP/RESTORE.
+      Memory is bounded by (workers + queue_size) batches.
+    """
+    def __init__(self, source, target, pattern='*', batch_size=500, workers=4,
+                 queue_size=None, max_keys_per_sec=None, replace=True, checkpoint_file=None):
+        """
+        :param source: source connection pool
+        :type source: aioredis.Redis
+        :param target: target connection pool
+        :type target: aioredis.Redis
+        :param str pattern: keys pattern
+        :param int batch_size: SCAN COUNT and keys in one DUMP/RESTORE pipeline
+        :param int workers: concurrent copy workers
+        :param int queue_size: scanned batches waiting for workers, workers * 2 by default
+        :param int max_keys_per_sec: keys rate cap, None - no cap
+        :param bool replace: if True - replace existing keys on target
+        :param str checkpoint_file: path to file with SCAN cursor
+
+        :return: None
+        """
+        self.source = source
+        self.target = target
+        self.pattern = pattern
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size or workers * 2
+        self.max_keys_per_sec = max_keys_per_sec
+        self.replace = replace
+        self.checkpoint_file = checkpoint_file
+
+        self.cursor = 0
+        self.keys_copied = 0
+        self.keys_skipped = 0
+        self._resumed_keys = 0
+        self._started = None
+        self._rate_lock = asyncio.Lock()
+        self._scan_cursors = {}  # batch number: cursor after the batch
+        self._copied_batches = set()
+        self._next_batch = 0  # first batch which is not copied
+
+    def _load_checkpoint(self):
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'rt') as f:
+                checkpoint = deserialize_json(f.read())
+            self.cursor, self.keys_copied = checkpoint['cursor'], checkpoint['keys_copied']
+            logger.info('Keyspace copy resumed from cursor %s: %s keys already copied',
+                        self.cursor, self.keys_copied)
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_file:
+            return
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'wt') as f:
+            f.write(serialize_json({'cursor': self.cursor, 'keys_copied': self.keys_copied}))
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _batch_copied(self, number):
+        """
+        Moves checkpoint cursor over all batches copied in order,
+          batches are finished by workers out of order.
+
+        :param int number: batch number
+
+        :return: None
+        """
+        self._copied_batches.add(number)
+        moved = False
+        while self._next_batch in self._copied_batches:
+            self._copied_batches.remove(self._next_batch)
+            self.cursor = self._scan_cursors.pop(self._next_batch)
+            self._next_batch += 1
+            moved = True
+        if moved:
+            self._save_checkpoint()
+
+    async def _throttle(self, keys):
+        async with self._rate_lock:
+            self.keys_copied += keys
+            if self.max_keys_per_sec:
+                ahead = (self.keys_copied - self._resumed_keys) / self.max_keys_per_sec - (
+                    time.monotonic() - self._started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+
+    async def _scan(self, queue):
+        cursor, number = self.cursor, 0
+        while True:
+            cursor, keys = await self.source.execute(
+                b'SCAN', cursor, b'MATCH', self.pattern, b'COUNT', self.batch_size, encoding=None)
+            cursor = int(cursor)
+            self._scan_cursors[number] = cursor
+            # Empty batches go through the queue too, checkpoint cursor moves over them
+            await queue.put((number, keys))
+            number += 1
+            if cursor == 0:
+                break
+        for _ in range(self.workers):
+            await queue.put(None)
+
+    async def copy_batch(self, keys):
+        """
+        Copies keys by one DUMP + PTTL pipeline and one RESTORE pipeline.
+          Keys which expired or were deleted after SCAN are skipped.
+
+        :param list keys: keys to copy
+
+        :return: number of copied keys
+        :rtype: int
+        """
+        if not keys:
+            return 0
+        pipe = self.source.pipeline()
+        for key in keys:
+            pipeline_command(pipe, b'DUMP', key, encoding=None)
+            pipe.pttl(key)
+        replies = await pipe.execute()
+
+        options = (b'REPLACE',) if self.replace else ()
+        pipe = self.target.pipeline()
+        copied = 0
+        for key, value, ttl in zip(keys, replies[::2], replies[1::2]):
+            if value is None or ttl == -2:
+                continue
+            pipeline_command(pipe, b'RESTORE', key, max(ttl, 0), value, *options)
+            copied += 1
+        self.keys_skipped += len(keys) - copied
+        if copied:
+            await pipe.execute()
+        return copied
+
+    async def _worker(self, queue):
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            number, keys = batch
+            await self._throttle(await self.copy_batch(keys))
+            self._batch_copied(number)
+
+    async def _report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - self._started
+            logger.info('Keyspace copy: cursor %s, %s keys, %.0f keys/s', self.cursor,
+                        self.keys_copied, (self.keys_copied - self._resumed_keys) / elapsed)
+
+    async def copy(self, report_interval=5):
+        """
+        Copies the keyspace, starts from checkpoint cursor if any.
+
+        :param float report_interval: progress report interval (sec)
+
+        :return: number of copied keys
+        :rtype: int
+        """
+        self._load_checkpoint()
+        self._resumed_keys = self.keys_copied
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._started = time.monotonic()
+        reporter = asyncio.ensure_future(self._report(report_interval))
+        tasks = [asyncio.ensure_future(self._scan(queue))]
+        tasks.extend(asyncio.ensure_future(self._worker(queue)) for _ in range(self.workers))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On a worker error scanner and other workers must not outlive the copy
+            for task in tasks + [reporter]:
+                task.cancel()
+            await asyncio.gather(*tasks, reporter, return_exceptions=True)
+        # Copy is finished, next run starts from the beginning
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        elapsed = time.monotonic() - self._started
+        copied = self.keys_copied - self._resumed_keys
+        logger.info('Keyspace copy finished: %s keys (%s skipped) in %.1f s, %.0f keys/s',
+                    copied, self.keys_skipped, elapsed, copied / elapsed if elapsed else 0)
+        return self.keys_copied
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else '*'
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    source = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    target = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis2']))
+    copier = KeyspaceCopier(
+        source.rd, target.rd, pattern, max_keys_per_sec=50000,
+        checkpoint_file=os.path.join(BASE_DIR, 'keyspace_copy.json'))
+    try:
+        loop.run_until_complete(copier.copy())
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(source.close_connection())
+        loop.run_until_complete(target.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
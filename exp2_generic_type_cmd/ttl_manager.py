@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+    TTL manager for large key sets. TTLs are applied by pipelined
+    PEXPIRE/PEXPIREAT batches with random jitter, so keys loaded at
+    once do not expire at the same moment (expiry storms and cache
+    miss stampedes). Keyspace audit finds keys without TTL by SCAN
+    and pipelined PTTL.
+    For commands details see: http://redis.io/commands/pexpire
+
+    Usage: PYTHONPATH=. python exp2_generic_type_cmd/ttl_manager.py [pattern to audit] [fix_ttl]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config
+
+BATCH_SIZE = 1000  # commands in one pipeline
+
+
+class TTLManager:
+    """ Bulk jittered expiry and TTL audit """
+
+    def __init__(self, rd, batch_size=BATCH_SIZE):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param int batch_size: keys in one pipeline
+
+        :return: None
+        """
+        self.rd = rd
+        self.batch_size = batch_size
+
+    async def _pipelined(self, command, pairs):
+        """
+        Runs command for (key, argument) pairs by batch_size pipelines.
+
+        :param str command: pipeline method, 'pexpire' or 'pexpireat'
+        :param list pairs: list of (key, milliseconds)
+
+        :return: number of keys the timeout was set for
+        :rtype: int
+        """
+        applied = 0
+        for i in range(0, len(pairs), self.batch_size):
+            pipe = self.rd.pipeline()
+            for key, ms in pairs[i:i + self.batch_size]:
+                getattr(pipe, command)(key, ms)
+            applied += sum(await pipe.execute())
+        return applied
+
+    async def expire_many(self, keys, ttl, jitter=0.1):
+        """
+        Sets TTL of keys, every key gets random ttl ... ttl * (1 + jitter).
+
+        :param list keys: keys
+        :param float ttl: time to live (sec)
+        :param float jitter: max relative addition to ttl
+
+        :return: number of keys the timeout was set for
+        :rtype: int
+        """
+        return await self._pipelined('pexpire', [
+            (key, int(ttl * (1 + random.uniform(0, jitter)) * 1000)) for key in keys])
+
+    async def expireat_window(self, keys, start, window):
+        """
+        Spreads expiry moments of keys evenly across the window:
+          window is split into len(keys) slots, every key expires
+          at random moment of its slot, slots are shuffled.
+
+        :param list keys: keys
+        :param float start: unix timestamp of window start
+        :param float window: window length (sec)
+
+        :return: number of keys the timeout was set for
+        :rtype: int
+        """
+        slots = list(range(len(keys)))
+        random.shuffle(slots)
+        step = window / len(keys) if keys else 0
+        return await self._pipelined('pexpireat', [
+            (key, int((start + (slot + random.random()) * step) * 1000))
+            for key, slot in zip(keys, slots)])
+
+    async def audit(self, pattern='*', fix_ttl=None, jitter=0.1, max_keys=1000):
+        """
+        Finds keys without TTL by SCAN and pipelined PTTL,
+          optionally sets jittered TTL of them.
+
+        :param str pattern: keys pattern
+        :param float fix_ttl: TTL for found keys (sec), None - only report
+        :param float jitter: max relative addition to fix_ttl
+        :param int max_keys: max number of returned keys without TTL
+
+        :return: (number of scanned keys, number of keys without TTL, keys without TTL)
+        :rtype: tuple
+        """
+        scanned, no_ttl, found = 0, 0, []
+        cursor = b'0'
+        while True:
+            cursor, keys = await self.rd.execute(
+                b'SCAN', cursor, b'MATCH', pattern, b'COUNT', self.batch_size, encoding=None)
+            if keys:
+                pipe = self.rd.pipeline()
+                for key in keys:
+                    pipe.pttl(key)
+                persistent = [key for key, ttl in zip(keys, await pipe.execute()) if ttl == -1]
+                scanned += len(keys)
+                no_ttl += len(persistent)
+                found.extend(persistent[:max_keys - len(found)])
+                if fix_ttl is not None and persistent:
+                    await self.expire_many(persistent, fix_ttl, jitter)
+            if cursor == b'0':
+                break
+        logger.info('TTL audit: %s keys scanned, %s without TTL%s', scanned, no_ttl,
+                    ', TTL is set' if fix_ttl is not None else '')
+        return scanned, no_ttl, found
+
+
+async def run_ttl_manager(rd, num_keys=10000):
+    """
+    Example: sets keys, spreads their expiry and audits TTL.
+
+    :return: None
+    """
+    manager = TTLManager(rd)
+    keys = ['exp_ttl:%s' % i for i in range(num_keys)]
+    await rd.mset(*(item for key in keys for item in (key, 1)))
+    await manager.expire_many(keys[:num_keys // 2], 3600, jitter=0.2)
+    await manager.expireat_window(keys[num_keys // 2:num_keys - 10], time.time() + 3600, 600)
+    scanned, no_ttl, found = await manager.audit('exp_ttl:*')
+    await rd.delete(*keys)
+    frm = "TTL_MANAGER: KEYS - {0}, SCANNED - {1}, NO_TTL - {2}, EXAMPLES - {3}\n"
+    logger.debug(frm.format(num_keys, scanned, no_ttl, found[:3]))
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else None
+    fix_ttl = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        if pattern is None:
+            loop.run_until_complete(run_ttl_manager(rd_conn.rd))
+        else:
+            loop.run_until_complete(TTLManager(rd_conn.rd).audit(pattern, fix_ttl))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
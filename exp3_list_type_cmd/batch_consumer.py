@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    Batch consumer of a list: up to N elements are popped by one round
+    trip instead of one LPOP per element.
+      - Redis >= 6.2: LPOP key count,
+      - older servers: MULTI LRANGE key 0 N-1, LTRIM key N -1, EXEC.
+    LLEN is sent in the same round trip, batch size follows the
+    remaining backlog: small backlog - small batches (elements are
+    shared among consumers, low latency), big backlog - big batches
+    (fewer round trips). When the list is empty consumer blocks on
+    BLPOP instead of polling.
+    For commands details see: http://redis.io/commands/lpop
+"""
+import asyncio
+import os
+import time
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config, parse_info, pipeline_command
+
+MIN_BATCH = 10
+MAX_BATCH = 1000
+BLOCK_TIMEOUT = 1  # sec, BLPOP timeout, consumer checks stop flag between calls
+
+
+async def lpop_count_supported(rd):
+    """
+    Checks if the server supports LPOP with count (Redis >= 6.2).
+
+    :param rd: Redis connection pool
+    :type rd: aioredis.Redis
+
+    :return: True if supported
+    :rtype: bool
+    """
+    info = parse_info(await rd.execute(b'INFO', b'server', encoding='utf-8'))
+    version = tuple(int(part) for part in info['redis_version'].split('.')[:2])
+    return version >= (6, 2)
+
+
+class BatchConsumer:
+    """ Pops list elements by batches, blocks when the list is empty """
+
+    def __init__(self, rd, key, min_batch=MIN_BATCH, max_batch=MAX_BATCH,
+                 block_timeout=BLOCK_TIMEOUT, blocking=None, lpop_count=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str key: list key, elements are popped from the head
+        :param int min_batch: min batch size
+        :param int max_batch: max batch size
+        :param int block_timeout: BLPOP timeout (sec)
+        :param blocking: pool for BLPOP, by default blocked consumer
+          holds a connection of rd pool
+        :type blocking: redis_blocking.BlockingPool
+        :param bool lpop_count: use LPOP with count, None - check server version
+
+        :return: None
+        """
+        self.rd = rd
+        self.key = key
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.block_timeout = block_timeout
+        self.blocking = blocking
+        self.lpop_count = lpop_count
+        self.batch_size = min_batch
+        self.depth = 0
+
+    def _adapt(self, depth):
+        self.depth = depth
+        self.batch_size = max(self.min_batch, min(self.max_batch, depth))
+
+    async def pop(self, count=None):
+        """
+        Pops up to count elements by one round trip, atomically.
+
+        :param int count: max number of elements, adaptive batch size by default
+
+        :return: popped elements, empty list if the list is empty
+        :rtype: list
+        """
+        count = self.batch_size if count is None else count
+        if self.lpop_count is None:
+            self.lpop_count = await lpop_count_supported(self.rd)
+        if self.lpop_count:
+            pipe = self.rd.pipeline()
+            items = pipeline_command(pipe, b'LPOP', self.key, count)
+            depth = pipe.llen(self.key)
+            await pipe.execute()
+            items = await items or []
+        else:
+            tr = self.rd.multi_exec()
+            items = tr.lrange(self.key, 0, count - 1)
+            tr.ltrim(self.key, count, -1)
+            depth = tr.llen(self.key)
+            await tr.execute()
+            items = await items
+        self._adapt(await depth)
+        return items
+
+    async def _blocking_pop(self, timeout):
+        if self.blocking is not None:
+            return await self.blocking.blpop([self.key], timeout)
+        with await self.rd as conn:
+            return await conn.blpop(self.key, timeout=timeout)
+
+    async def get(self, timeout=None):
+        """
+        Returns the next batch: pops a batch, if the list is empty
+          blocks on BLPOP and tops up the popped element with a batch.
+
+        :param int timeout: block timeout (sec), block_timeout by default
+
+        :return: popped elements, empty list on timeout
+        :rtype: list
+        """
+        items = await self.pop()
+        if items:
+            return items
+        timeout = self.block_timeout if timeout is None else timeout
+        popped = await self._blocking_pop(timeout)
+        if popped is None:
+            return []
+        # Woken up by a push, the rest of the burst is popped by batch
+        return [popped[1]] + await self.pop(self.batch_size)
+
+    async def consume(self, handler, stop):
+        """
+        Calls handler with every batch until stop event is set.
+
+        :param handler: coroutine function called with list of elements
+        :param asyncio.Event stop: stop event, checked between batches
+
+        :return: number of consumed elements
+        :rtype: int
+        """
+        consumed = 0
+        while not stop.is_set():
+            items = await self.get()
+            if items:
+                await handler(items)
+                consumed += len(items)
+        return consumed
+
+
+async def run_batch_consumer(rd, num_items=10000):
+    """
+    Example: batch consumer drains the backlog, then waits on BLPOP
+      for items pushed later; elements per round trip is reported.
+
+    :return: None
+    """
+    key = 'exp_batch:list'
+    consumer = BatchConsumer(rd, key)
+    stop = asyncio.Event()
+    received, batches = [], []
+
+    async def handler(items):
+        received.extend(items)
+        batches.append(len(items))
+        if len(received) >= num_items + 10:
+            stop.set()
+
+    await rd.rpush(key, *range(num_items))
+    start = time.perf_counter()
+    task = asyncio.ensure_future(consumer.consume(handler, stop))
+    await asyncio.sleep(0.1)
+    for i in range(10):
+        await rd.rpush(key, num_items + i)
+    await task
+    elapsed = time.perf_counter() - start
+    await rd.delete(key)
+    frm = "BATCH_CONSUMER: KEY - {0}, ITEMS - {1}, BATCHES - {2}, MAX_BATCH - {3}, " \
+          "LPOP_COUNT - {4}, TIME - {5:.3f} s\n"
+    logger.debug(frm.format(key, len(received), len(batches), max(batches),
+                            consumer.lpop_count, elapsed))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_batch_consumer(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
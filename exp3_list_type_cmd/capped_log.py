@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+    Capped "last N events" logs on lists, one list per entity, newest
+    event at the head. Appends of many entities are sent by one
+    pipeline: events of an entity are grouped into one LPUSH followed
+    by one LTRIM 0 N-1, so a batch costs one round trip and two
+    commands per entity instead of LPUSH + LTRIM per event.
+    Reads are LRANGE windows (pages), logs of many entities are read
+    by one pipeline.
+    For commands details see: http://redis.io/commands/ltrim
+"""
+import asyncio
+import os
+import random
+from collections import OrderedDict
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import deserialize_json, load_config, serialize_json
+
+MAX_LEN = 100  # events kept per entity
+PAGE_SIZE = 20  # events in one LRANGE window
+
+
+class CappedLog:
+    """ Last max_len events per entity """
+
+    def __init__(self, rd, prefix, max_len=MAX_LEN, ttl=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str prefix: keys prefix, key of entity log is prefix:entity
+        :param int max_len: events kept per entity
+        :param int ttl: log TTL (sec) refreshed on append, None - no TTL
+
+        :return: None
+        """
+        self.rd = rd
+        self.prefix = prefix
+        self.max_len = max_len
+        self.ttl = ttl
+        self.round_trips = 0
+        self.commands = 0
+
+    def key(self, entity):
+        return '%s:%s' % (self.prefix, entity)
+
+    async def append_many(self, events):
+        """
+        Appends events of many entities by one pipeline: one LPUSH
+          and one LTRIM (and EXPIRE if ttl) per entity.
+
+        :param events: iterable of (entity, event), event is JSON serializable
+
+        :return: number of appended events
+        :rtype: int
+        """
+        grouped = OrderedDict()
+        for entity, event in events:
+            grouped.setdefault(entity, []).append(serialize_json(event))
+        if not grouped:
+            return 0
+        pipe = self.rd.pipeline()
+        for entity, values in grouped.items():
+            key = self.key(entity)
+            # Only the newest max_len events survive LTRIM, older are not sent
+            pipe.lpush(key, *values[-self.max_len:])
+            pipe.ltrim(key, 0, self.max_len - 1)
+            if self.ttl:
+                pipe.expire(key, self.ttl)
+        await pipe.execute()
+        self.round_trips += 1
+        self.commands += len(grouped) * (3 if self.ttl else 2)
+        return sum(len(values) for values in grouped.values())
+
+    async def append(self, entity, event):
+        return await self.append_many([(entity, event)])
+
+    async def read(self, entity, offset=0, count=PAGE_SIZE):
+        """
+        Reads the window of the entity log, newest first.
+
+        :param str entity: entity id
+        :param int offset: events to skip
+        :param int count: max events in the window
+
+        :return: events
+        :rtype: list
+        """
+        values = await self.rd.lrange(self.key(entity), offset, offset + count - 1)
+        self.round_trips += 1
+        self.commands += 1
+        return [deserialize_json(value) for value in values]
+
+    async def pages(self, entity, page_size=PAGE_SIZE):
+        """
+        Yields pages of the entity log. Events appended during the
+          iteration shift the windows, so an event may be repeated.
+
+        :param str entity: entity id
+        :param int page_size: events in one page
+
+        :return: async generator of lists of events
+        :rtype: async_generator
+        """
+        for offset in range(0, self.max_len, page_size):
+            page = await self.read(entity, offset, page_size)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+
+    async def read_many(self, entities, count=PAGE_SIZE):
+        """
+        Reads the newest count events of many entities by one pipeline.
+
+        :param list entities: entity ids
+        :param int count: max events per entity
+
+        :return: entity: events, newest first
+        :rtype: dict
+        """
+        entities = list(entities)
+        if not entities:
+            return {}
+        pipe = self.rd.pipeline()
+        for entity in entities:
+            pipe.lrange(self.key(entity), 0, count - 1)
+        replies = await pipe.execute()
+        self.round_trips += 1
+        self.commands += len(entities)
+        return {entity: [deserialize_json(value) for value in values]
+                for entity, values in zip(entities, replies)}
+
+    async def delete(self, entities):
+        entities = list(entities)
+        if entities:
+            await self.rd.delete(*(self.key(entity) for entity in entities))
+
+
+async def run_capped_log(rd, num_events=10000, num_entities=100):
+    """
+    Example: events of many users are appended by batches,
+      then the last events are read by pages and for many users at once.
+
+    :return: None
+    """
+    log = CappedLog(rd, 'exp_capped_log', max_len=50)
+    events = [('user%s' % random.randrange(num_entities), {'seq': i}) for i in range(num_events)]
+    for i in range(0, num_events, 500):
+        await log.append_many(events[i:i + 500])
+    pages = [page async for page in log.pages('user0', page_size=20)]
+    latest = await log.read_many(['user%s' % i for i in range(num_entities)], count=5)
+    await log.delete('user%s' % i for i in range(num_entities))
+    frm = "CAPPED_LOG: EVENTS - {0}, ROUND_TRIPS - {1}, COMMANDS - {2}, " \
+          "USER0_PAGES - {3}, USER0_LATEST - {4}\n"
+    logger.debug(frm.format(num_events, log.round_trips, log.commands,
+                            [len(page) for page in pages], latest['user0']))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_capped_log(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    Priority queue on several lists (lanes) with weighted fair dequeue.
+    BLPOP over many keys always serves the first non-empty key and
+    starves lower priorities, so lanes are polled by weights: every
+    lane has a virtual time which grows by popped / weight, the lane
+    with the lowest virtual time is popped next. When all lanes are
+    backlogged they are served in proportion to their weights, an
+    empty lane gives its share to the others. Elements are popped by
+    batches (batch_consumer.BatchConsumer per lane), only when all
+    lanes are empty the consumer blocks on BLPOP over all of them.
+    For commands details see: http://redis.io/commands/blpop
+"""
+import asyncio
+import os
+from collections import Counter, OrderedDict
+
+from exp3_list_type_cmd.batch_consumer import BLOCK_TIMEOUT, MAX_BATCH, MIN_BATCH, BatchConsumer
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import load_config
+
+LANES = (('high', 6), ('normal', 3), ('low', 1))  # (lane, weight), highest priority first
+
+
+class PriorityQueue:
+    """ Weighted fair queue over list lanes """
+
+    def __init__(self, rd, name, lanes=LANES, min_batch=MIN_BATCH, max_batch=MAX_BATCH,
+                 block_timeout=BLOCK_TIMEOUT, blocking=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str name: queue name
+        :param lanes: (lane, weight) pairs, highest priority first
+        :param int min_batch: min batch popped from a lane
+        :param int max_batch: max batch popped from a lane
+        :param int block_timeout: BLPOP timeout (sec)
+        :param blocking: pool for BLPOP, by default blocked consumer
+          holds a connection of rd pool
+        :type blocking: redis_blocking.BlockingPool
+
+        :return: None
+        """
+        self.rd = rd
+        self.name = name
+        self.weights = OrderedDict(lanes)
+        if not self.weights or min(self.weights.values()) <= 0:
+            raise ValueError('Lanes with positive weights are required: %s' % (lanes,))
+        self.block_timeout = block_timeout
+        self.blocking = blocking
+        self.consumers = OrderedDict(
+            (lane, BatchConsumer(rd, self.key(lane), min_batch, max_batch, block_timeout))
+            for lane in self.weights)
+        self._lanes_by_key = {}
+        for lane in self.weights:
+            self._lanes_by_key[self.key(lane)] = self._lanes_by_key[self.key(lane).encode()] = lane
+        self._vtime = dict.fromkeys(self.weights, 0.0)
+        self._idle = set()
+        self.popped = Counter()
+
+    def key(self, lane):
+        return 'pqueue:%s:%s' % (self.name, lane)
+
+    async def put_many(self, lane, items):
+        """
+        Appends items to the tail of the lane.
+
+        :param str lane: lane name
+        :param list items: items
+
+        :return: lane length
+        :rtype: int
+        """
+        if lane not in self.weights:
+            raise ValueError('Unknown lane %r of queue %s' % (lane, self.name))
+        return await self.rd.rpush(self.key(lane), *items)
+
+    async def put(self, lane, item):
+        return await self.put_many(lane, [item])
+
+    def _charge(self, lane, popped):
+        if lane in self._idle:
+            # A lane back from idle starts from the busy lanes time, not with saved up credit
+            self._idle.discard(lane)
+            busy = [vtime for other, vtime in self._vtime.items()
+                    if other != lane and other not in self._idle]
+            if busy:
+                self._vtime[lane] = max(self._vtime[lane], min(busy))
+        self._vtime[lane] += popped / self.weights[lane]
+        self.popped[lane] += popped
+
+    async def pop(self):
+        """
+        Pops a batch from the lane chosen by weights, lanes found empty
+          are skipped, never blocks.
+
+        :return: (lane, items), (None, []) if all lanes are empty
+        :rtype: tuple
+        """
+        candidates = sorted(self.weights, key=lambda lane: (self._vtime[lane], -self.weights[lane]))
+        for lane in candidates:
+            items = await self.consumers[lane].pop()
+            if items:
+                self._charge(lane, len(items))
+                return lane, items
+            self._idle.add(lane)
+        return None, []
+
+    async def _blocking_pop(self, timeout):
+        keys = [self.key(lane) for lane in self.weights]
+        if self.blocking is not None:
+            return await self.blocking.blpop(keys, timeout)
+        with await self.rd as conn:
+            return await conn.blpop(*keys, timeout=timeout)
+
+    async def get(self, timeout=None):
+        """
+        Returns the next batch, blocks on BLPOP over all lanes
+          if all of them are empty.
+
+        :param int timeout: block timeout (sec), block_timeout by default
+
+        :return: (lane, items), (None, []) on timeout
+        :rtype: tuple
+        """
+        lane, items = await self.pop()
+        if items:
+            return lane, items
+        timeout = self.block_timeout if timeout is None else timeout
+        popped = await self._blocking_pop(timeout)
+        if popped is None:
+            return None, []
+        key, item = popped
+        lane = self._lanes_by_key[key]
+        items = [item] + await self.consumers[lane].pop()
+        self._charge(lane, len(items))
+        return lane, items
+
+    async def depth(self):
+        """
+        Lengths of lanes by one pipeline, e.g. for autoscaling.
+
+        :return: lane: length
+        :rtype: collections.OrderedDict
+        """
+        pipe = self.rd.pipeline()
+        for lane in self.weights:
+            pipe.llen(self.key(lane))
+        return OrderedDict(zip(self.weights, await pipe.execute()))
+
+    async def consume(self, handler, stop):
+        """
+        Calls handler with every batch until stop event is set.
+
+        :param handler: coroutine function called with lane and list of items
+        :param asyncio.Event stop: stop event, checked between batches
+
+        :return: number of consumed items
+        :rtype: int
+        """
+        consumed = 0
+        while not stop.is_set():
+            lane, items = await self.get()
+            if items:
+                await handler(lane, items)
+                consumed += len(items)
+        return consumed
+
+    async def delete(self):
+        await self.rd.delete(*(self.key(lane) for lane in self.weights))
+
+
+async def run_priority_queue(rd, num_items=3000):
+    """
+    Example: all lanes are backlogged, the first popped items are
+      shared by lanes weights 6:3:1, not drained by priority.
+
+    :return: None
+    """
+    queue = PriorityQueue(rd, 'exp_jobs', max_batch=50)
+    for lane in queue.weights:
+        await queue.put_many(lane, ['%s:%s' % (lane, i) for i in range(num_items)])
+    depth_before = await queue.depth()
+    served = Counter()
+    while sum(served.values()) < num_items:
+        lane, items = await queue.get()
+        served[lane] += len(items)
+    depth_after = await queue.depth()
+
+    # High lane goes idle while the others are served, then comes back:
+    # it must start from the lowest busy lane time, not burst with old credit
+    await rd.delete(queue.key('high'))
+    for _ in range(20):
+        await queue.get()
+    floor = min(queue._vtime['normal'], queue._vtime['low'])
+    await queue.put('high', 'high:back')
+    lane, items = await queue.get()
+    assert lane == 'high' and queue._vtime['high'] == floor + len(items) / queue.weights['high'], \
+        (queue._vtime, floor)
+    await queue.delete()
+    frm = "PRIORITY_QUEUE: WEIGHTS - {0}, DEPTH_BEFORE - {1}, SERVED - {2}, DEPTH_AFTER - {3}\n"
+    logger.debug(frm.format(dict(queue.weights), dict(depth_before), dict(served), dict(depth_after)))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_priority_queue(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
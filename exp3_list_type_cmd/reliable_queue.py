@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+    Reliable work queue on lists:
+      - producers LPUSH batches of jobs, many jobs per command,
+      - consumer claims a job by BRPOPLPUSH into its own processing
+        list and sets the job deadline in its deadlines sorted set,
+      - consumer acknowledges the job by LREM + ZREM (MULTI),
+      - reaper moves jobs whose visibility timeout passed (consumer
+        crashed or hung) from processing lists back to the queue.
+    Jobs are wrapped into JSON envelopes with unique id, so LREM
+    removes exactly the claimed job. Delivery is at least once.
+    For commands details see: http://redis.io/commands/rpoplpush#pattern-reliable-queue
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import deserialize_json, load_config, serialize_json
+
+VISIBILITY_TIMEOUT = 30  # sec
+BLOCK_TIMEOUT = 1  # sec, BRPOPLPUSH timeout, consumers check stop flag between calls
+PRODUCER_BATCH = 500  # jobs in one LPUSH
+REAPER_INTERVAL = 5  # sec
+
+# KEYS[1] - processing list, KEYS[2] - queue, KEYS[3] - deadlines; ARGV[1] - job
+# Job is pushed to the tail which is popped first, so it is retried at once
+REQUEUE_SCRIPT = """
+redis.call('ZREM', KEYS[3], ARGV[1])
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+class ReliableQueue:
+    """ Queue with per consumer processing lists and visibility timeout """
+
+    def __init__(self, rd, name, visibility_timeout=VISIBILITY_TIMEOUT,
+                 block_timeout=BLOCK_TIMEOUT, blocking=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str name: queue name
+        :param float visibility_timeout: time to process a job (sec),
+          then the job is returned to the queue by reaper
+        :param int block_timeout: BRPOPLPUSH timeout (sec)
+        :param blocking: pool for BRPOPLPUSH, by default blocked
+          consumers hold connections of rd pool
+        :type blocking: redis_blocking.BlockingPool
+
+        :return: None
+        """
+        self.rd = rd
+        self.blocking = blocking
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.block_timeout = block_timeout
+        self.queue_key = 'queue:%s' % name
+        self.workers_key = 'queue:%s:workers' % name
+
+    def processing_key(self, worker):
+        return 'queue:%s:processing:%s' % (self.name, worker)
+
+    def deadlines_key(self, worker):
+        return 'queue:%s:deadlines:%s' % (self.name, worker)
+
+    async def put_many(self, bodies, batch_size=PRODUCER_BATCH):
+        """
+        Enqueues jobs by LPUSH of batch_size jobs, all in one pipeline.
+
+        :param list bodies: JSON serializable job bodies
+
+        :return: ids of jobs
+        :rtype: list
+        """
+        jobs = [{'id': uuid.uuid4().hex, 'body': body} for body in bodies]
+        pipe = self.rd.pipeline()
+        for i in range(0, len(jobs), batch_size):
+            pipe.lpush(self.queue_key, *(serialize_json(job) for job in jobs[i:i + batch_size]))
+        await pipe.execute()
+        return [job['id'] for job in jobs]
+
+    async def put(self, body):
+        return (await self.put_many([body]))[0]
+
+    async def claim(self, worker, timeout=None):
+        """
+        Claims the next job: BRPOPLPUSH into the worker processing
+          list and deadline in the worker deadlines set.
+
+        :param str worker: worker id
+        :param int timeout: block timeout (sec), block_timeout by default
+
+        :return: (raw job, job body), None if no job until timeout
+        :rtype: tuple
+        """
+        timeout = self.block_timeout if timeout is None else timeout
+        if self.blocking is not None:
+            raw = await self.blocking.brpoplpush(self.queue_key, self.processing_key(worker), timeout)
+        else:
+            with await self.rd as conn:
+                raw = await conn.brpoplpush(self.queue_key, self.processing_key(worker), timeout=timeout)
+        if raw is None:
+            return None
+        pipe = self.rd.pipeline()
+        pipe.zadd(self.deadlines_key(worker), time.time() + self.visibility_timeout, raw)
+        pipe.sadd(self.workers_key, worker)
+        await pipe.execute()
+        return raw, deserialize_json(raw)['body']
+
+    async def ack(self, worker, raw):
+        """
+        Acknowledges processed job.
+
+        :param str worker: worker id
+        :param str raw: raw job returned by claim()
+
+        :return: True if the job was still claimed by the worker
+        :rtype: bool
+        """
+        tr = self.rd.multi_exec()
+        removed = tr.lrem(self.processing_key(worker), 1, raw)
+        tr.zrem(self.deadlines_key(worker), raw)
+        await tr.execute()
+        return await removed == 1
+
+    async def nack(self, worker, raw):
+        """
+        Returns the job to the queue at once, e.g. on handler error.
+
+        :return: True if the job was returned
+        :rtype: bool
+        """
+        return await self._requeue(worker, raw)
+
+    async def _requeue(self, worker, raw):
+        keys = [self.processing_key(worker), self.queue_key, self.deadlines_key(worker)]
+        return await self.rd.eval(REQUEUE_SCRIPT, keys=keys, args=[raw]) == 1
+
+    async def reap(self):
+        """
+        Returns to the queue jobs whose deadline passed. Jobs in
+          processing lists without deadline (consumer died right
+          after BRPOPLPUSH) get the deadline now.
+
+        :return: number of returned jobs
+        :rtype: int
+        """
+        now = time.time()
+        requeued = 0
+        for worker in await self.rd.smembers(self.workers_key):
+            processing, deadlines = self.processing_key(worker), self.deadlines_key(worker)
+            pipe = self.rd.pipeline()
+            jobs = pipe.lrange(processing, 0, -1)
+            expired = pipe.zrangebyscore(deadlines, float('-inf'), now)
+            claimed = pipe.zrange(deadlines, 0, -1)
+            await pipe.execute()
+            jobs, expired, claimed = jobs.result(), expired.result(), set(claimed.result())
+
+            orphans = [raw for raw in jobs if raw not in claimed]
+            if orphans:
+                await self.rd.zadd(deadlines, *(
+                    item for raw in orphans for item in (now + self.visibility_timeout, raw)))
+            for raw in expired:
+                requeued += await self._requeue(worker, raw)
+            if not jobs and not claimed:
+                await self.rd.srem(self.workers_key, worker)
+        if requeued:
+            logger.warning('Queue %s: %s jobs returned after visibility timeout', self.name, requeued)
+        return requeued
+
+    async def depth(self):
+        return await self.rd.llen(self.queue_key)
+
+
+class QueueConsumers:
+    """ Runs concurrency consumers of the queue in this process """
+
+    def __init__(self, queue, handler, concurrency=4, reaper_interval=REAPER_INTERVAL):
+        """
+        :param ReliableQueue queue: queue
+        :param handler: coroutine function called with job body,
+          the job is returned to the queue if it raises
+        :param int concurrency: number of consumers
+        :param float reaper_interval: reaper run interval (sec), None - no reaper
+
+        :return: None
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.reaper_interval = reaper_interval
+        self.processed = 0
+        self.failed = 0
+        self._stopping = False
+        self._tasks = []
+        self._worker_prefix = '%s:%s:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+
+    async def _consume(self, worker):
+        while not self._stopping:
+            claimed = await self.queue.claim(worker)
+            if claimed is None:
+                continue
+            raw, body = claimed
+            try:
+                await self.handler(body)
+            except Exception as e:
+                self.failed += 1
+                logger.error('Queue %s: job failed: %s', self.queue.name, e)
+                await self.queue.nack(worker, raw)
+            else:
+                self.processed += 1
+                await self.queue.ack(worker, raw)
+
+    async def _reap_periodically(self):
+        while True:
+            await asyncio.sleep(self.reaper_interval)
+            try:
+                await self.queue.reap()
+            except Exception as e:
+                logger.error('Queue %s: reaper failed: %s', self.queue.name, e)
+
+    def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.ensure_future(self._consume('%s:%s' % (self._worker_prefix, i)))
+                       for i in range(self.concurrency)]
+        if self.reaper_interval:
+            self._tasks.append(asyncio.ensure_future(self._reap_periodically()))
+
+    async def stop(self):
+        """
+        Stops consumers after their current job and BRPOPLPUSH call.
+
+        :return: None
+        """
+        self._stopping = True
+        consumers, reaper = self._tasks[:self.concurrency], self._tasks[self.concurrency:]
+        for task in reaper:
+            task.cancel()
+        await asyncio.gather(*consumers, *reaper, return_exceptions=True)
+        self._tasks = []
+
+
+async def run_reliable_queue(rd, num_jobs=1000):
+    """
+    Example: jobs are processed by 4 consumers, a claimed and not
+      acknowledged job is returned by reaper.
+
+    :return: None
+    """
+    queue = ReliableQueue(rd, 'exp_jobs', visibility_timeout=1)
+    done = []
+
+    async def handler(body):
+        done.append(body)
+
+    await queue.put_many(range(num_jobs))
+    # This job is lost by a "crashed" consumer
+    await queue.claim('crashed-worker')
+    consumers = QueueConsumers(queue, handler, concurrency=4, reaper_interval=0.5)
+    consumers.start()
+    while len(done) < num_jobs:
+        await asyncio.sleep(0.1)
+    await consumers.stop()
+    await rd.delete(queue.queue_key, queue.workers_key)
+    frm = "RELIABLE_QUEUE: JOBS - {0}, PROCESSED - {1}, UNIQUE - {2}\n"
+    logger.debug(frm.format(num_jobs, len(done), len(set(done))))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_reliable_queue(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
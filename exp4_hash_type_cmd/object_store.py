@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+    Object store on hashes with partial reads and writes: an object
+    is a hash, only requested fields are read by HMGET (more fields
+    are loaded later on demand), assigned fields are tracked and save
+    writes only them by one HMSET (HDEL for fields set to None, they
+    are reset to the field default). Every field has its own encoder,
+    numbers and strings are stored as is, only JSON fields are
+    serialized, so large records are not rewritten and re-serialized
+    as a whole like by hmset()/hgetall().
+    For commands details see: http://redis.io/commands/hmget
+"""
+import asyncio
+import os
+from collections import Counter
+
+from redis_client import rd_client_factory
+from settings import BASE_DIR, logger
+from utils import deserialize_json, load_config, serialize_json
+
+
+class Field:
+    """ String field, base of field encoders """
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def encode(self, value):
+        return value if isinstance(value, (bytes, str)) else str(value)
+
+    def decode(self, raw):
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    def load(self, raw):
+        return self.default if raw is None else self.decode(raw)
+
+
+class IntField(Field):
+    def encode(self, value):
+        return str(int(value))
+
+    def decode(self, raw):
+        return int(raw)
+
+
+class FloatField(Field):
+    def encode(self, value):
+        return repr(float(value))
+
+    def decode(self, raw):
+        return float(raw)
+
+
+class BoolField(Field):
+    def encode(self, value):
+        return '1' if value else '0'
+
+    def decode(self, raw):
+        return raw in (b'1', '1')
+
+
+class JsonField(Field):
+    def encode(self, value):
+        return serialize_json(value)
+
+    def decode(self, raw):
+        return deserialize_json(raw)
+
+
+class HashObject:
+    """ Object of the store, fields are attributes """
+
+    def __init__(self, store, obj_id, values=None, dirty=()):
+        """
+        :param ObjectStore store: store of the object
+        :param str obj_id: object id
+        :param dict values: loaded fields
+        :param dirty: names of changed fields
+
+        :return: None
+        """
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, 'id', obj_id)
+        object.__setattr__(self, '_values', dict(values or {}))
+        object.__setattr__(self, '_dirty', set(dirty))
+
+    def __getattr__(self, name):
+        if name not in self._store.fields:
+            raise AttributeError('%r object has no field %r' % (self._store.prefix, name))
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError('Field %r of %s:%s is not loaded, use load()' % (
+                name, self._store.prefix, self.id))
+
+    def __setattr__(self, name, value):
+        if name not in self._store.fields:
+            raise AttributeError('%r object has no field %r' % (self._store.prefix, name))
+        self._values[name] = value
+        self._dirty.add(name)
+
+    @property
+    def loaded(self):
+        return set(self._values)
+
+    @property
+    def dirty(self):
+        return set(self._dirty)
+
+    async def load(self, *fields):
+        await self._store.load(self, fields)
+        return self
+
+    async def save(self):
+        return await self._store.save(self)
+
+    def __repr__(self):
+        return '<%s:%s %r>' % (self._store.prefix, self.id, self._values)
+
+
+class ObjectStore:
+    """ Objects on hashes with lazy field loading and dirty field saving """
+
+    def __init__(self, rd, prefix, fields, ttl=None):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param str prefix: keys prefix, key of object is prefix:id
+        :param dict fields: field name: Field encoder
+        :param int ttl: object TTL (sec) refreshed on save, None - no TTL
+
+        :return: None
+        """
+        # Underscore names would shadow the internal attributes of objects
+        reserved = [name for name in fields
+                    if name == 'id' or name.startswith('_') or hasattr(HashObject, name)]
+        if reserved:
+            raise ValueError('Reserved field names of %s: %s' % (prefix, ', '.join(reserved)))
+        self.rd = rd
+        self.prefix = prefix
+        self.fields = dict(fields)
+        self.ttl = ttl
+        self.stats = Counter()
+
+    def key(self, obj_id):
+        return '%s:%s' % (self.prefix, obj_id)
+
+    def _check_fields(self, fields):
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise ValueError('Unknown fields of %s: %s' % (self.prefix, ', '.join(unknown)))
+
+    def new(self, obj_id, **values):
+        """
+        Creates an object, all given fields are dirty.
+
+        :param str obj_id: object id
+        :param values: fields
+
+        :return: object
+        :rtype: HashObject
+        """
+        self._check_fields(values)
+        return HashObject(self, obj_id, values, dirty=values)
+
+    def _decode(self, fields, raw_values):
+        self.stats['fields_read'] += len(fields)
+        self.stats['bytes_read'] += sum(len(raw) for raw in raw_values if raw is not None)
+        return {name: self.fields[name].load(raw) for name, raw in zip(fields, raw_values)}
+
+    async def get_many(self, obj_ids, fields=None):
+        """
+        Reads requested fields of objects by one pipeline of HMGET.
+          Missing fields (and objects) get field defaults.
+
+        :param list obj_ids: object ids
+        :param list fields: field names, all fields by default
+
+        :return: objects
+        :rtype: list
+        """
+        fields = list(self.fields if fields is None else fields)
+        self._check_fields(fields)
+        obj_ids = list(obj_ids)
+        if not fields or not obj_ids:
+            return [HashObject(self, obj_id) for obj_id in obj_ids]
+        pipe = self.rd.pipeline()
+        for obj_id in obj_ids:
+            pipe.hmget(self.key(obj_id), *fields)
+        replies = await pipe.execute()
+        return [HashObject(self, obj_id, self._decode(fields, raw_values))
+                for obj_id, raw_values in zip(obj_ids, replies)]
+
+    async def get(self, obj_id, fields=None):
+        return (await self.get_many([obj_id], fields))[0]
+
+    async def load(self, obj, fields):
+        """
+        Loads not loaded fields of the object by one HMGET,
+          dirty values are not overwritten.
+
+        :param HashObject obj: object
+        :param list fields: field names, all fields by default
+
+        :return: None
+        """
+        fields = [name for name in (fields or self.fields) if name not in obj.loaded]
+        self._check_fields(fields)
+        if fields:
+            raw_values = await self.rd.hmget(self.key(obj.id), *fields)
+            obj._values.update(self._decode(fields, raw_values))
+
+    async def save_many(self, objects):
+        """
+        Writes dirty fields of objects by one pipeline: one HMSET
+          per object, HDEL of fields set to None, which means reset:
+          after save the field value is the field default.
+
+        :param list objects: objects
+
+        :return: number of written fields
+        :rtype: int
+        """
+        pipe = self.rd.pipeline()
+        saved, written = [], 0
+        for obj in objects:
+            if not obj._dirty:
+                continue
+            key = self.key(obj.id)
+            pairs, deleted = [], []
+            for name in obj._dirty:
+                value = obj._values[name]
+                if value is None:
+                    deleted.append(name)
+                else:
+                    pairs.extend((name, self.fields[name].encode(value)))
+            if pairs:
+                pipe.hmset(key, *pairs)
+                self.stats['bytes_written'] += sum(
+                    len(item if isinstance(item, bytes) else item.encode()) for item in pairs[1::2])
+            if deleted:
+                pipe.hdel(key, *deleted)
+            if self.ttl:
+                pipe.expire(key, self.ttl)
+            saved.append((obj, deleted))
+            written += len(obj._dirty)
+        if saved:
+            await pipe.execute()
+            for obj, deleted in saved:
+                for name in deleted:
+                    # Same value as loaded from Redis after HDEL
+                    obj._values[name] = self.fields[name].default
+                obj._dirty.clear()
+            self.stats['fields_written'] += written
+        return written
+
+    async def save(self, obj):
+        return await self.save_many([obj])
+
+    async def delete(self, obj_ids):
+        obj_ids = list(obj_ids)
+        if obj_ids:
+            await self.rd.delete(*(self.key(obj_id) for obj_id in obj_ids))
+
+
+USER_FIELDS = {
+    'name': Field(),
+    'email': Field(),
+    'visits': IntField(default=0),
+    'balance': FloatField(default=0.0),
+    'active': BoolField(default=False),
+    'profile': JsonField(),
+}
+
+
+async def run_object_store(rd, num_users=100):
+    """
+    Example: users with a large JSON profile, a request updates
+      visits and active only, the profile is neither read nor written.
+
+    :return: None
+    """
+    store = ObjectStore(rd, 'exp_user', USER_FIELDS)
+    profile = {'about': 'x' * 2000, 'tags': list(range(100))}
+    await store.save_many(store.new(i, name='user%s' % i, email='user%s@example.com' % i,
+                                    profile=profile) for i in range(num_users))
+    full_write = store.stats['bytes_written']
+    store.stats.clear()
+
+    users = await store.get_many(range(num_users), fields=('visits', 'active'))
+    for user in users:
+        user.visits += 1
+        user.active = True
+    await store.save_many(users)
+    user = await users[0].load('name')
+    frm = "OBJECT_STORE: USERS - {0}, FULL_WRITE - {1} bytes, PARTIAL_UPDATE - {2}, USER - {3}\n"
+    logger.debug(frm.format(num_users, full_write, dict(store.stats), user))
+    await store.delete(range(num_users))
+
+
+def main():
+    # load config from yaml file
+    conf = load_config(os.path.join(BASE_DIR, "config_files/dev.yml"))
+    # create event loop
+    loop = asyncio.get_event_loop()
+    rd_conn = loop.run_until_complete(rd_client_factory(loop=loop, conf=conf['redis1']))
+    try:
+        loop.run_until_complete(run_object_store(rd_conn.rd))
+    except KeyboardInterrupt as e:
+        logger.error("Caught keyboard interrupt {0}\nCanceling tasks...".format(e))
+    finally:
+        loop.run_until_complete(rd_conn.close_connection())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
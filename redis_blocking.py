@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    Dedicated connection pool for blocking list commands (BLPOP,
+    BRPOP, BRPOPLPUSH). A blocked command holds its connection until
+    an element arrives or timeout expires, so blocked consumers use
+    this pool and do not take connections of the main client pool.
+
+    Cancellation: a cancelled blocking command closes its connection,
+    Redis unblocks the disconnected client, so an element is not
+    popped for a consumer which is gone. If the reply was already on
+    the wire it is lost, use BRPOPLPUSH when elements must not be lost.
+"""
+import asyncio
+import itertools
+
+import aioredis
+
+from settings import logger
+
+
+class BlockingPool:
+    """ Separately sized pool for blocking commands """
+
+    def __init__(self, loop, conf):
+        """
+        :param loop: asyncio EventLoop
+        :type loop: asyncio.unix_events._UnixSelectorEventLoop
+        :param dict conf: validated pool params, pool size is 'blocking_maxsize'
+
+        :return: None
+        """
+        self.loop = loop
+        self.conf = conf
+        self.pool = None
+        self._create_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        # Pool is created on the first blocking command
+        async with self._create_lock:
+            if self.pool is None:
+                self.pool = await aioredis.create_pool(
+                    (self.conf['host'], self.conf['port']),
+                    db=self.conf['db'],
+                    password=self.conf['password'],
+                    encoding=self.conf['encoding'],
+                    minsize=0,
+                    maxsize=self.conf['blocking_maxsize'],
+                    create_connection_timeout=self.conf['timeout'],
+                    loop=self.loop)
+                logger.debug('Redis blocking pool created, size %s', self.conf['blocking_maxsize'])
+        return self.pool
+
+    async def execute(self, command, *args, **kwargs):
+        """
+        Runs blocking command on own connection of the pool.
+
+        :param bytes command: command name
+        :param args: command arguments
+
+        :return: command reply
+        """
+        pool = await self._get_pool()
+        conn = await pool.acquire()
+        try:
+            return await conn.execute(command, *args, **kwargs)
+        except asyncio.CancelledError:
+            # The connection is blocked on the server, it can not be reused
+            conn.close()
+            raise
+        finally:
+            pool.release(conn)
+
+    async def blpop(self, keys, timeout=0):
+        """
+        Pops from the first non-empty list of keys, one connection
+          waits on all of them.
+
+        :param list keys: list keys
+        :param int timeout: block timeout (sec), 0 - forever
+
+        :return: (key, element) or None on timeout
+        :rtype: list
+        """
+        return await self.execute(b'BLPOP', *keys, timeout)
+
+    async def brpop(self, keys, timeout=0):
+        return await self.execute(b'BRPOP', *keys, timeout)
+
+    async def brpoplpush(self, source, destination, timeout=0):
+        return await self.execute(b'BRPOPLPUSH', source, destination, timeout)
+
+    async def fan_in(self, keys, timeout=0, pop=b'BLPOP'):
+        """
+        Yields (key, element) from many lists by one connection.
+          BLPOP serves the first non-empty key, so keys are rotated
+          after every pop and a busy list does not starve the others.
+
+        :param list keys: list keys
+        :param int timeout: block timeout (sec), None is yielded on timeout
+        :param bytes pop: BLPOP or BRPOP
+
+        :return: async generator of (key, element)
+        :rtype: async_generator
+        """
+        keys = list(keys)
+        for start in itertools.cycle(range(len(keys))):
+            yield await self.execute(pop, *keys[start:], *keys[:start], timeout)
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
@@ -5,7 +5,11 @@ from functools import wraps
 import aioredis
 
 from custom_errors import RedisConnectionLost
-from settings import logger, REDIS_RECONNECT_DELAY, REDIS_RECONNECT_RETRIES
+from redis_blocking import BlockingPool
+from redis_config import blocking_pool_changed, pool_changed, validate_pool_config
+from redis_replicas import mark_scope_write, ReplicaSet, scope_has_writes
+from redis_sentinel import SentinelResolver
+from settings import logger, REDIS_POOL_DRAIN_TIMEOUT, REDIS_RECONFIGURE_RETRIES
 from utils import deserialize_json, serialize_json
 
 
@@ -71,13 +75,17 @@ def serializer(value, encode=True, native_type=str, full=False):
     return converter(value)
 
 
-def acquire_connection(retry_delay=REDIS_RECONNECT_DELAY,
-                       num_retries=REDIS_RECONNECT_RETRIES):
+def acquire_connection(retry_delay=None, num_retries=None, readonly=False):
     """
-    Gets connection from pool and do reconnect if ConnectionClosedError raise.
+    Gets connection from pool and do reconnect if connection is lost or refused.
+      Read-only commands are served by a replica if there is a healthy one
+      and no write was done in the current read_your_writes() scope.
 
-    :param int retry_delay: delay between retries
-    :param int num_retries: number of retries
+    :param int retry_delay: delay between retries,
+      'retry_delay' from client config by default
+    :param int num_retries: number of retries,
+      'retry_count' from client config by default
+    :param bool readonly: if True - command may be served by replica
 
     :return: function to decorate
     :rtype: object
@@ -86,14 +94,32 @@ def acquire_connection(retry_delay=REDIS_RECONNECT_DELAY,
 
         @wraps(coro)
         async def release(self, *args, **kwargs):
-            for _ in range(num_retries):
+            delay = self.conf['retry_delay'] if retry_delay is None else retry_delay
+            retries = self.conf['retry_count'] if num_retries is None else num_retries
+            if not readonly:
+                mark_scope_write()
+            for _ in range(retries):
+                node = None
+                if readonly and self.replicas and not scope_has_writes():
+                    node = self.replicas.choose()
                 try:
-                    async with self.pool.get() as connection:
-                        self._connection = connection
-                        return await coro(self, *args, **kwargs)
-                except aioredis.errors.ConnectionClosedError:
-                    logger.error('Connection to redis lost. Retry after %s s.', retry_delay)
-                    await asyncio.sleep(retry_delay)
+                    if node is None:
+                        async with self.pool.get() as connection:
+                            self._connection = aioredis.Redis(connection)
+                            return await coro(self, *args, **kwargs)
+                    async with node.pool.get() as connection:
+                        self._connection = aioredis.Redis(connection)
+                        with node.track():
+                            return await coro(self, *args, **kwargs)
+                except (aioredis.errors.ConnectionClosedError, ConnectionError):
+                    if node is not None:
+                        # Retry at once, next attempt goes to another node
+                        node.mark_down('connection lost')
+                        continue
+                    if self.sentinel is not None and await self._failover():
+                        continue
+                    logger.error('Connection to redis lost. Retry after %s s.', delay)
+                    await asyncio.sleep(delay)
                 finally:
                     self._connection = None
 
@@ -119,9 +145,13 @@ class RedisClient:
         :return: None
         """
         self.loop = loop
-        self.conf = conf
+        self.conf = validate_pool_config(conf)
         self.pool = None
+        self.replicas = None
+        self.sentinel = None
+        self.blocking = None
         self._connection = None
+        self._failover_lock = asyncio.Lock()
 
     @classmethod
     async def connect(cls, **options):
@@ -134,32 +164,198 @@ class RedisClient:
         await self._init_connect()
         return self
 
-    async def _init_connect(self, retry_delay=REDIS_RECONNECT_DELAY,
-                            num_retries=REDIS_RECONNECT_RETRIES):
+    async def _create_pool(self, conf):
         """
-        This method create Redis client by config params.
+        This method create Redis connection pool by config params.
           If Redis server refused connection do retries.
 
-        :param int retry_delay: delay between retries
-        :param int num_retries: number of retries
+        :param dict conf: validated pool params
 
-        :return: None
+        :return: connection pool
+        :rtype: aioredis.ConnectionsPool
         """
-        for _ in range(num_retries):
+        for _ in range(conf['retry_count']):
             try:
-                self.pool = await aioredis.create_pool(
-                    (self.conf['host'], self.conf['port']),
-                    db=self.conf['db'],
-                    password=self.conf['password'],
-                    encoding=self.conf['encoding'],
-                    minsize=self.conf['minsize'],
-                    maxsize=self.conf['maxsize'],
+                return await aioredis.create_pool(
+                    (conf['host'], conf['port']),
+                    db=conf['db'],
+                    password=conf['password'],
+                    encoding=conf['encoding'],
+                    minsize=conf['minsize'],
+                    maxsize=conf['maxsize'],
+                    create_connection_timeout=conf['timeout'],
                     loop=self.loop)
-                break
-            except ConnectionRefusedError:
+            except (ConnectionRefusedError, asyncio.TimeoutError):
                 logger.error(
-                    'Cant establish connection to redis. Retry after %s s.', retry_delay)
-            await asyncio.sleep(retry_delay)
+                    'Cant establish connection to redis. Retry after %s s.', conf['retry_delay'])
+            await asyncio.sleep(conf['retry_delay'])
+
+        raise RedisConnectionLost
+
+    async def _create_replicas(self, conf):
+        """
+        This method creates set of read replicas and checks
+          their health. Unreachable replicas are not retried
+          here, the health check reconnects them later.
+
+        :param dict conf: validated pool params
+
+        :return: replica set
+        :rtype: redis_replicas.ReplicaSet
+        """
+        async def create_pool(replica_conf):
+            return await self._create_pool(dict(replica_conf, retry_count=1))
+
+        replicas = ReplicaSet(self.loop, conf['replicas'], create_pool, conf['max_replica_lag'])
+        await replicas.start()
+        return replicas
+
+    def _create_sentinel(self, conf):
+        """
+        This method creates Sentinel resolver if sentinels are
+          set in config and subscribes it to master switch events.
+
+        :param dict conf: validated pool params
+
+        :return: resolver or None
+        :rtype: redis_sentinel.SentinelResolver
+        """
+        if not conf['sentinels']:
+            return None
+        sentinel = SentinelResolver(
+            self.loop, [(s['host'], s['port']) for s in conf['sentinels']], conf['service_name'])
+        sentinel.watch(self._on_master_switch)
+        return sentinel
+
+    async def _resolve_master(self, conf):
+        """
+        This method replaces master address and replicas in
+          params by the ones discovered through Sentinel.
+
+        :param dict conf: validated pool params
+
+        :return: validated pool params
+        :rtype: dict
+        """
+        if self.sentinel is None:
+            return conf
+        (host, port), replicas = await self.sentinel.discover()
+        return validate_pool_config(dict(
+            conf, host=host, port=port,
+            replicas=[{'host': r_host, 'port': r_port} for r_host, r_port in replicas]))
+
+    async def _failover(self):
+        """
+        This method re-resolves master through Sentinel after
+          connection to it was lost, and switches pools if the
+          master was changed.
+
+        :return: True if client uses new master now
+        :rtype: bool
+        """
+        failed = self.conf['host'], self.conf['port']
+        async with self._failover_lock:
+            if (self.conf['host'], self.conf['port']) == failed:
+                try:
+                    await self.reconfigure(self.conf)
+                except RedisConnectionLost:
+                    return False
+            return (self.conf['host'], self.conf['port']) != failed
+
+    async def _on_master_switch(self, address):
+        if (self.conf['host'], self.conf['port']) != address:
+            await self._failover()
+
+    async def _init_connect(self):
+        """
+        This method create Redis client by config params.
+
+        :return: None
+        """
+        self.sentinel = self._create_sentinel(self.conf)
+        self.conf = await self._resolve_master(self.conf)
+        self.pool = await self._create_pool(self.conf)
+        self.replicas = await self._create_replicas(self.conf)
+        self.blocking = BlockingPool(self.loop, self.conf)
+
+    async def reconfigure(self, conf, drain_timeout=REDIS_POOL_DRAIN_TIMEOUT):
+        """
+        This method applies new config params without restart.
+          If pool params changed, new pool is created and the
+          old one is drained in background: commands in flight
+          finish on their connections, then the pool is closed.
+
+        :param dict conf: params from config file
+        :param int drain_timeout: max time to wait busy connections
+
+        :return: None
+        """
+        conf = validate_pool_config(conf)
+        if (conf['sentinels'], conf['service_name']) != \
+                (self.conf['sentinels'], self.conf['service_name']):
+            if self.sentinel is not None:
+                await self.sentinel.close()
+            self.sentinel = self._create_sentinel(conf)
+        conf = await self._resolve_master(conf)
+        # New pools are created first and swapped only if all of them succeed
+        new_blocking = BlockingPool(self.loop, conf) if blocking_pool_changed(self.conf, conf) else None
+        if pool_changed(self.conf, conf):
+            # Unreachable server must not block the reload for retry_count * retry_delay,
+            # RedisConnectionLost leaves the current pool in use
+            new_pool = await self._create_pool(
+                dict(conf, retry_count=min(conf['retry_count'], REDIS_RECONFIGURE_RETRIES)))
+            try:
+                new_replicas = await self._create_replicas(conf)
+            except Exception:
+                new_pool.close()
+                await new_pool.wait_closed()
+                raise
+        else:
+            new_pool = None
+
+        if new_blocking is not None:
+            # Blocked consumers finish their calls on the old pool
+            old_blocking, self.blocking = self.blocking, new_blocking
+            if old_blocking.pool is not None:
+                asyncio.ensure_future(self._drain_pool(old_blocking.pool, drain_timeout), loop=self.loop)
+        if new_pool is None:
+            self.conf = conf
+            return
+
+        old_pool, self.pool = self.pool, new_pool
+        old_replicas, self.replicas = self.replicas, new_replicas
+        self.conf = conf
+        logger.info('Redis pool reconfigured: %s:%s/%s, size %s..%s, replicas %s',
+                    conf['host'], conf['port'], conf['db'],
+                    conf['minsize'], conf['maxsize'], len(conf['replicas']))
+        if old_pool is not None:
+            asyncio.ensure_future(self._drain_pool(old_pool, drain_timeout), loop=self.loop)
+        if old_replicas is not None:
+            await old_replicas.stop()
+            for node in old_replicas.nodes:
+                if node.pool is not None:
+                    asyncio.ensure_future(self._drain_pool(node.pool, drain_timeout), loop=self.loop)
+
+    async def _drain_pool(self, pool, timeout):
+        """
+        This method waits until all connections of the pool
+          are released (or timeout expires) and closes the pool.
+
+        :param pool: connection pool to close
+        :type pool: aioredis.ConnectionsPool
+        :param int timeout: max time to wait busy connections
+
+        :return: None
+        """
+        deadline = self.loop.time() + timeout
+        while pool.size > pool.freesize and self.loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        busy = pool.size - pool.freesize
+        if busy:
+            logger.warning('Redis pool drain timeout, closing %s busy connections', busy)
+        pool.close()
+        await pool.wait_closed()
+        logger.debug('Redis old connection pool closed')
 
     async def close_connection(self):
         """
@@ -167,6 +363,12 @@ class RedisClient:
 
         :return: None
         """
+        if self.sentinel is not None:
+            await self.sentinel.close()
+        if self.replicas is not None:
+            await self.replicas.close()
+        if self.blocking is not None:
+            await self.blocking.close()
         self.pool.close()
         await self.pool.wait_closed()
         logger.debug("Redis connection pool closing...")
@@ -201,7 +403,7 @@ class RedisClient:
 
     # Commands for STRING type
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def getv(self, key, use_serializer=False):
         """
         Get the value of a key
@@ -264,7 +466,7 @@ class RedisClient:
         value = self._serialize(value, full=True) if use_serializer else value
         return await self._connection.setnx(key, value)
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def mgetv(self, keys, use_serializer=False):
         """
         Get the values of all the given keys.
@@ -304,6 +506,20 @@ class RedisClient:
 
     # Generic commands
 
+    @acquire_connection()
+    async def execute(self, command, *args, **kwargs):
+        """
+        Execute any Redis command on the primary.
+
+        :param str command: command name
+        :param args: command arguments
+        :param kwargs: execute options, e.g. encoding
+
+        :return: command reply
+        """
+        logger.debug('redis.execute: command=%s', command)
+        return await self._connection.execute(command, *args, **kwargs)
+
     @acquire_connection()
     async def expire(self, key, ttl):
         """
@@ -317,7 +533,7 @@ class RedisClient:
         logger.debug('redis.expire: key=%s, ttl=%s', key, ttl)
         return await self._connection.expire(key, ttl)
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def keys(self, pattern):
         """
         Returns all keys matching pattern.
@@ -416,7 +632,7 @@ class RedisClient:
 
         await pipe.execute()
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def hget(self, key, field, use_serializer=True):
         """
         Get the value of a hash field.
@@ -432,7 +648,7 @@ class RedisClient:
         value = await self._connection.hget(key, field)
         return self._deserialize(value) if use_serializer else value
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def hmget(self, key, fields, use_serializer=True):
         """
         Get the values of all the given fields.
@@ -448,7 +664,7 @@ class RedisClient:
         value = await self._connection.hmget(key, *fields)
         return self._deserialize(dict(zip(fields, value)) if use_serializer else value)
 
-    @acquire_connection()
+    @acquire_connection(readonly=True)
     async def hgetall(self, key, use_serializer=True):
         """
         Get all the fields and values in a hash.
@@ -478,3 +694,44 @@ class RedisClient:
         logger.debug('redis.hdel: key=%s, field=%s', key, fields)
         return await self._connection.hdel(key, fields)
 
+    async def blpop(self, keys, timeout=0):
+        """
+        Pops from the first non-empty list. Runs on the blocking
+          pool, the main pool connections stay free.
+
+        :param list keys: list keys
+        :param int timeout: block timeout (sec), 0 - forever
+
+        :return: (key, element) or None on timeout
+        :rtype: list
+        """
+        logger.debug('redis.blpop: keys=%s', keys)
+        return await self.blocking.blpop(keys, timeout)
+
+    async def brpop(self, keys, timeout=0):
+        """
+        Pops from the tail of the first non-empty list
+          on the blocking pool.
+
+        :param list keys: list keys
+        :param int timeout: block timeout (sec), 0 - forever
+
+        :return: (key, element) or None on timeout
+        :rtype: list
+        """
+        logger.debug('redis.brpop: keys=%s', keys)
+        return await self.blocking.brpop(keys, timeout)
+
+    async def brpoplpush(self, source, destination, timeout=0):
+        """
+        Moves the tail element of source to destination
+          on the blocking pool.
+
+        :param str source: source list key
+        :param str destination: destination list key
+        :param int timeout: block timeout (sec), 0 - forever
+
+        :return: moved element or None on timeout
+        """
+        logger.debug('redis.brpoplpush: source=%s, destination=%s', source, destination)
+        return await self.blocking.brpoplpush(source, destination, timeout)
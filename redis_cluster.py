@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+    Redis Cluster client: hash slots are computed on the client side,
+    slot map is cached and fixed by MOVED redirects, every node has
+    its own connection pool.
+    For details see: https://redis.io/topics/cluster-spec
+"""
+import asyncio
+from collections import OrderedDict
+
+import aioredis
+
+from custom_errors import RedisConnectionLost
+from redis_client import serializer
+from redis_config import validate_pool_config
+from redis_slots import CLUSTER_SLOTS, group_by_slot, key_slot
+from settings import logger, REDIS_CLUSTER_FANOUT_TIMEOUT, REDIS_CLUSTER_MAX_REDIRECTS
+from utils import parse_info
+
+# Nodes with these flags are not used by fan-out commands
+NODE_DOWN_FLAGS = {'fail', 'fail?', 'handshake', 'noaddr'}
+
+
+def parse_redirect(error):
+    """
+    Parses MOVED/ASK error: 'MOVED 3999 127.0.0.1:6381'.
+
+    :param error: reply error
+    :type error: aioredis.errors.ReplyError
+
+    :return: (kind, slot, (host, port)) or None if it is not redirect
+    :rtype: tuple
+    """
+    parts = str(error).split()
+    if len(parts) != 3 or parts[0] not in ('MOVED', 'ASK'):
+        return None
+    host, _, port = parts[2].rpartition(':')
+    return parts[0], int(parts[1]), (host, int(port))
+
+
+def parse_cluster_nodes(reply):
+    """
+    Parses CLUSTER NODES reply:
+      <id> <ip:port@cport> <flags> <master> <ping> <pong> <epoch> <link> <slot> ...
+
+    :param str reply: CLUSTER NODES reply
+
+    :return: list of nodes {'id', 'address', 'flags', 'master', 'slots'}
+    :rtype: list
+    """
+    nodes = []
+    for line in reply.splitlines():
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        host, _, port = fields[1].split('@')[0].rpartition(':')
+        nodes.append({
+            'id': fields[0],
+            'address': (host, int(port)),
+            'flags': set(fields[2].split(',')),
+            'master': None if fields[3] == '-' else fields[3],
+            'slots': fields[8:],
+        })
+    return nodes
+
+
+class RedisClusterClient:
+    """
+    This is a Redis Cluster client. It keeps slot -> node map
+      and connection pool per master node.
+    """
+    def __init__(self, loop, conf, hotkeys=None):
+        """
+        Initialises cluster client by configuration params
+
+        :param loop: asyncio EventLoop
+        :param dict conf: params from config file, 'cluster_nodes'
+          are startup nodes
+        :param hotkeys: detector which samples command keys
+        :type hotkeys: redis_hotkeys.HotKeysDetector
+
+        :return: None
+        """
+        self.loop = loop
+        self.hotkeys = hotkeys
+        self.conf = validate_pool_config(conf)
+        if not self.conf['cluster_nodes']:
+            self.conf['cluster_nodes'] = [{'host': self.conf['host'], 'port': self.conf['port']}]
+        self.slots = [None] * CLUSTER_SLOTS
+        self.pools = {}
+        self._refresh_lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, **options):
+        """
+        This method creates Redis Cluster client.
+
+        :return obj self: RedisClusterClient instance
+        """
+        self = cls(**options)
+        await self.refresh_slots()
+        return self
+
+    async def close_connection(self):
+        """
+        This method close connections to all cluster nodes.
+
+        :return: None
+        """
+        pools, self.pools = list(self.pools.values()), {}
+        for pool in pools:
+            pool.close()
+        for pool in pools:
+            await pool.wait_closed()
+        logger.debug('Redis cluster connection pools closing...')
+
+    async def _get_pool(self, address):
+        pool = self.pools.get(address)
+        if pool is None:
+            pool = await aioredis.create_pool(
+                address,
+                password=self.conf['password'],
+                encoding=self.conf['encoding'],
+                minsize=self.conf['minsize'],
+                maxsize=self.conf['maxsize'],
+                create_connection_timeout=self.conf['timeout'],
+                loop=self.loop)
+            # Other task might create the pool meanwhile
+            if address in self.pools:
+                pool.close()
+            else:
+                self.pools[address] = pool
+        return self.pools[address]
+
+    async def refresh_slots(self):
+        """
+        Loads slot map by CLUSTER SLOTS from the first available
+          node: known masters first, then startup nodes.
+
+        :return: None
+        """
+        async with self._refresh_lock:
+            startup = [(n['host'], n['port']) for n in self.conf['cluster_nodes']]
+            for address in list(OrderedDict.fromkeys(list(self.pools) + startup)):
+                try:
+                    pool = await self._get_pool(address)
+                    reply = await pool.execute(b'CLUSTER', b'SLOTS', encoding='utf-8')
+                except (OSError, asyncio.TimeoutError, aioredis.errors.RedisError) as e:
+                    logger.warning('Cluster node %s:%s is unavailable: %s', *address, e)
+                    continue
+
+                slots = [None] * CLUSTER_SLOTS
+                for start, end, master, *_ in reply:
+                    # Empty ip means the node which replied
+                    node = (master[0] or address[0], int(master[1]))
+                    slots[start:end + 1] = [node] * (end - start + 1)
+                self.slots = slots
+                logger.debug('Cluster slot map loaded from %s:%s', *address)
+                await self._close_gone_pools(set(slots) | {address})
+                return
+
+        raise RedisConnectionLost
+
+    async def _close_gone_pools(self, addresses):
+        """
+        Closes pools of nodes which left the slot map, e.g. removed
+          or failed over masters, so their connections do not leak.
+          Pools of other nodes (replicas) are created again on demand.
+
+        :param set addresses: nodes to keep pools of
+
+        :return: None
+        """
+        gone = [self.pools.pop(address) for address in list(self.pools) if address not in addresses]
+        for pool in gone:
+            pool.close()
+        for pool in gone:
+            await pool.wait_closed()
+        if gone:
+            logger.info('Cluster pools of %s gone nodes closed', len(gone))
+
+    async def topology(self):
+        """
+        Returns snapshot of cluster topology by CLUSTER NODES
+          from the first available master.
+
+        :return: list of nodes {'id', 'address', 'flags', 'master', 'slots'}
+        :rtype: list
+        """
+        addresses = list(OrderedDict.fromkeys(a for a in self.slots if a is not None))
+        for address in addresses or [(n['host'], n['port']) for n in self.conf['cluster_nodes']]:
+            try:
+                pool = await self._get_pool(address)
+                reply = await pool.execute(b'CLUSTER', b'NODES', encoding='utf-8')
+            except (OSError, asyncio.TimeoutError, aioredis.errors.RedisError) as e:
+                logger.warning('Cluster node %s:%s is unavailable: %s', *address, e)
+                continue
+            nodes = parse_cluster_nodes(reply)
+            for node in nodes:
+                if 'myself' in node['flags'] and not node['address'][0]:
+                    node['address'] = address
+            return nodes
+
+        raise RedisConnectionLost
+
+    async def fan_out(self, command, *args, role='masters', timeout=REDIS_CLUSTER_FANOUT_TIMEOUT,
+                      **kwargs):
+        """
+        Executes command on every selected node concurrently.
+          Failed or timed out nodes get the exception as result.
+
+        :param command: command name
+        :param args: command arguments
+        :param str role: 'masters', 'replicas' or 'all'
+        :param float timeout: per node timeout (sec)
+        :param kwargs: execute options, e.g. encoding
+
+        :return: (host, port): reply or exception
+        :rtype: dict
+        """
+        roles = {'masters': {'master'}, 'replicas': {'slave'}, 'all': {'master', 'slave'}}[role]
+        addresses = [node['address'] for node in await self.topology()
+                     if node['flags'] & roles and not node['flags'] & NODE_DOWN_FLAGS]
+
+        async def run(address):
+            pool = await self._get_pool(address)
+            return await pool.execute(command, *args, **kwargs)
+
+        replies = await asyncio.gather(
+            *(asyncio.wait_for(run(address), timeout) for address in addresses),
+            return_exceptions=True)
+        for address, reply in zip(addresses, replies):
+            if isinstance(reply, Exception):
+                logger.error('Cluster fan-out %s failed on %s:%s: %r', command, *address, reply)
+        return dict(zip(addresses, replies))
+
+    async def execute(self, key, command, *args, **kwargs):
+        """
+        Executes command on the node which serves the key slot.
+          MOVED fixes the slot in the map and retries, ASK retries
+          once on the importing node with ASKING.
+
+        :param key: key for routing
+        :type key: str or bytes
+        :param command: command name
+        :param args: command arguments
+        :param kwargs: execute options, e.g. encoding
+
+        :return: command reply
+        """
+        if self.hotkeys is not None:
+            self.hotkeys.record(key)
+        return await self.execute_slot(key_slot(key), command, *args, **kwargs)
+
+    async def execute_slot(self, slot, command, *args, **kwargs):
+        """
+        Executes command on the node which serves the slot.
+
+        :param int slot: hash slot
+        :param command: command name
+        :param args: command arguments
+        :param kwargs: execute options, e.g. encoding
+
+        :return: command reply
+        """
+        asking = None
+        for _ in range(REDIS_CLUSTER_MAX_REDIRECTS):
+            address = asking or self.slots[slot]
+            if address is None:
+                await self.refresh_slots()
+                address = self.slots[slot]
+                if address is None:
+                    raise RedisConnectionLost
+            try:
+                pool = await self._get_pool(address)
+                if asking:
+                    async with pool.get() as conn:
+                        await conn.execute(b'ASKING')
+                        return await conn.execute(command, *args, **kwargs)
+                return await pool.execute(command, *args, **kwargs)
+            except aioredis.errors.ReplyError as e:
+                redirect = parse_redirect(e)
+                if redirect is None:
+                    raise
+                kind, moved_slot, new_address = redirect
+                if kind == 'MOVED':
+                    logger.debug('Cluster slot %s moved to %s:%s', moved_slot, *new_address)
+                    self.slots[moved_slot] = new_address
+                    asking = None
+                else:
+                    asking = new_address
+            except (aioredis.errors.ConnectionClosedError, aioredis.errors.PoolClosedError,
+                    ConnectionError):
+                # Pool is closed when its node leaves the slot map
+                logger.error('Connection to cluster node %s:%s lost.', *address)
+                self.slots[slot] = None
+                await asyncio.sleep(self.conf['retry_delay'])
+
+        raise RedisConnectionLost
+
+    # Commands for STRING type
+
+    async def getv(self, key, use_serializer=False):
+        """
+        Get the value of a key
+
+        :param str key: key name
+        :param bool use_serializer: if True - deserialize result
+
+        :return: result
+        :rtype: str
+        """
+        logger.debug('redis_cluster.getv: key=%s', key)
+        value = await self.execute(key, b'GET', key)
+        return serializer(value, encode=False) if use_serializer and value is not None else value
+
+    async def setv(self, key, value, ttl=None, use_serializer=False):
+        """
+        Set the string value of a key.
+
+        :param str key: key name
+        :param str, dict value: value for save
+        :param int ttl: time to live for key
+        :param bool use_serializer: if True - serialize result
+
+        :return: None
+        """
+        logger.debug('redis_cluster.setv: key=%s, ttl=%s', key, ttl)
+        value = serializer(value, full=True) if use_serializer else value
+        args = (b'EX', ttl) if ttl is not None else ()
+        await self.execute(key, b'SET', key, value, *args)
+
+    async def mgetv(self, keys, use_serializer=False):
+        """
+        Get the values of all the given keys. Keys are split
+          into MGET per hash slot, sub-batches run in parallel,
+          values are returned in order of keys.
+
+        :param list keys: list of keys
+        :param bool use_serializer: if True - deserialize result
+
+        :return: result
+        :rtype: list
+        """
+        logger.debug('redis_cluster.mget: keys=%s', len(keys))
+        if self.hotkeys is not None:
+            self.hotkeys.record_many(keys)
+        groups = group_by_slot(keys)
+        replies = await asyncio.gather(*(
+            self.execute_slot(slot, b'MGET', *(keys[i] for i in indexes))
+            for slot, indexes in groups.items()))
+
+        values = [None] * len(keys)
+        for indexes, reply in zip(groups.values(), replies):
+            for i, value in zip(indexes, reply):
+                values[i] = value
+        if use_serializer:
+            values = [v if v is None else serializer(v, encode=False) for v in values]
+        return values
+
+    async def msetv(self, pairs, ttl=None, use_serializer=False):
+        """
+        Set multiple keys to multiple values. Pairs are split
+          into MSET per hash slot, sub-batches run in parallel.
+
+        :param dict pairs: dict with key-value pairs
+        :param int ttl: time to live for keys
+        :param bool use_serializer: if True - serialize result
+
+        :return: None
+        """
+        logger.debug('redis_cluster.mset: pairs=%s, ttl=%s', len(pairs), ttl)
+        pairs = serializer(pairs) if use_serializer else pairs
+        keys = list(pairs)
+        if self.hotkeys is not None:
+            self.hotkeys.record_many(keys)
+
+        async def set_slot(slot, indexes):
+            args = []
+            for i in indexes:
+                args.extend((keys[i], pairs[keys[i]]))
+            await self.execute_slot(slot, b'MSET', *args)
+            if ttl is not None:
+                await asyncio.gather(*(
+                    self.execute_slot(slot, b'EXPIRE', keys[i], ttl) for i in indexes))
+
+        await asyncio.gather(*(set_slot(slot, indexes)
+                               for slot, indexes in group_by_slot(keys).items()))
+
+    async def delete(self, *keys):
+        """
+        Delete keys, DEL is split per hash slot.
+
+        :param list keys: list of keys
+
+        :return: number of deleted keys
+        :rtype: int
+        """
+        logger.debug('redis_cluster.delete: keys=%s', len(keys))
+        if self.hotkeys is not None:
+            self.hotkeys.record_many(keys)
+        replies = await asyncio.gather(*(
+            self.execute_slot(slot, b'DEL', *(keys[i] for i in indexes))
+            for slot, indexes in group_by_slot(keys).items()))
+        return sum(replies)
+
+    async def expire(self, key, ttl):
+        """
+        Set a timeout on key.
+
+        :param str key: key name
+        :param int ttl: time to live for key
+
+        :return: 1 if the timeout was set
+        :rtype: int
+        """
+        logger.debug('redis_cluster.expire: key=%s, ttl=%s', key, ttl)
+        return await self.execute(key, b'EXPIRE', key, ttl)
+
+    # Fan-out commands
+
+    async def dbsize(self, timeout=REDIS_CLUSTER_FANOUT_TIMEOUT):
+        """
+        Returns the number of keys in the cluster: DBSIZE summed
+          over masters. Failed nodes are reported in the result.
+
+        :param float timeout: per node timeout (sec)
+
+        :return: (total, {(host, port): error})
+        :rtype: tuple
+        """
+        replies = await self.fan_out(b'DBSIZE', timeout=timeout)
+        total = sum(r for r in replies.values() if not isinstance(r, Exception))
+        return total, {a: r for a, r in replies.items() if isinstance(r, Exception)}
+
+    async def slowlog_get(self, length=10, role='all', timeout=REDIS_CLUSTER_FANOUT_TIMEOUT):
+        """
+        Returns slow log entries of all nodes merged and sorted
+          by duration, the slowest first.
+
+        :param int length: number of entries from every node
+        :param str role: 'masters', 'replicas' or 'all'
+        :param float timeout: per node timeout (sec)
+
+        :return: list of (duration us, (host, port), entry)
+        :rtype: list
+        """
+        replies = await self.fan_out(b'SLOWLOG', b'GET', length, role=role, timeout=timeout)
+        entries = [(entry[2], address, entry) for address, reply in replies.items()
+                   if not isinstance(reply, Exception) for entry in reply]
+        return sorted(entries, key=lambda item: item[0], reverse=True)
+
+    async def keyspace(self, role='masters', timeout=REDIS_CLUSTER_FANOUT_TIMEOUT):
+        """
+        Returns INFO keyspace stats summed over nodes by database.
+
+        :param str role: 'masters', 'replicas' or 'all'
+        :param float timeout: per node timeout (sec)
+
+        :return: db: {'keys': int, 'expires': int}
+        :rtype: dict
+        """
+        replies = await self.fan_out(b'INFO', b'keyspace', role=role, timeout=timeout,
+                                     encoding='utf-8')
+        res = {}
+        for reply in replies.values():
+            if isinstance(reply, Exception):
+                continue
+            for db, stats in parse_info(reply).items():
+                stats = dict(item.split('=') for item in stats.split(','))
+                total = res.setdefault(db, {'keys': 0, 'expires': 0})
+                total['keys'] += int(stats['keys'])
+                total['expires'] += int(stats['expires'])
+        return res
+
+    async def flushdb(self, timeout=REDIS_CLUSTER_FANOUT_TIMEOUT):
+        """
+        Remove all keys on every master.
+
+        :param float timeout: per node timeout (sec)
+
+        :return: (host, port): reply or exception
+        :rtype: dict
+        """
+        logger.debug('redis_cluster.flushdb')
+        return await self.fan_out(b'FLUSHDB', timeout=timeout)
+
+
+async def rd_cluster_factory(loop, conf, client=RedisClusterClient):
+    """ Abstract Redis Cluster client factory """
+    return await client.connect(loop=loop, conf=conf)
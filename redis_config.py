@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+    Validated configuration of Redis connection pools.
+    Every profile is a yaml file in config_files/ (dev.yml, prod.yml, ...),
+    the optional 'default' section is merged into every other section.
+"""
+import asyncio
+import os
+
+from custom_errors import RedisConfigError
+from settings import BASE_DIR, CONFIG_PROFILE, CONFIG_RELOAD_INTERVAL, logger
+from utils import load_config
+
+CONFIG_DIR = os.path.join(BASE_DIR, 'config_files')
+DEFAULT_SECTION = 'default'
+CODECS = ('json',)
+
+# field: (allowed types, default value)
+POOL_SCHEMA = {
+    'host': ((str,), 'localhost'),
+    'port': ((int,), 6379),
+    'db': ((int,), 0),
+    'password': ((str, int, type(None)), None),
+    'encoding': ((str, type(None)), 'utf-8'),
+    'minsize': ((int,), 1),
+    'maxsize': ((int,), 10),
+    'blocking_maxsize': ((int,), 10),
+    'timeout': ((int, float, type(None)), None),
+    'retry_delay': ((int, float), 1),
+    'retry_count': ((int,), 10000),
+    'codec': ((str,), 'json'),
+    'replicas': ((list, tuple), ()),
+    'max_replica_lag': ((int, float), 10),
+    'sentinels': ((list, tuple), ()),
+    'service_name': ((str, type(None)), None),
+    'cluster_nodes': ((list, tuple), ()),
+}
+
+# Fields with list of {host, port} mappings
+ADDRESS_LIST_FIELDS = ('sentinels', 'cluster_nodes')
+
+# Fields which require a new connection pool when changed
+POOL_FIELDS = ('host', 'port', 'db', 'password', 'encoding',
+               'minsize', 'maxsize', 'timeout', 'replicas')
+BLOCKING_POOL_FIELDS = ('host', 'port', 'db', 'password', 'encoding',
+                        'blocking_maxsize', 'timeout')
+
+
+def validate_pool_config(conf, name='redis'):
+    """
+    Validates pool params and fills missing fields with defaults.
+
+    :param dict conf: pool params from config file
+    :param str name: section name for error messages
+
+    :return: normalized pool params
+    :rtype: dict
+    """
+    if not isinstance(conf, dict):
+        raise RedisConfigError('%s: section must be a mapping, got %r' % (name, conf))
+
+    errors = ['%s.%s: unknown field' % (name, field) for field in conf if field not in POOL_SCHEMA]
+    res = {}
+    for field, (types, default) in POOL_SCHEMA.items():
+        value = conf.get(field, default)
+        # bool is int subclass, but 'port: yes' is a typo, not a port
+        if isinstance(value, bool) or not isinstance(value, types):
+            errors.append('%s.%s: expected %s, got %r' % (
+                name, field, '/'.join(t.__name__ for t in types), value))
+        res[field] = value
+
+    if not errors:
+        if not 0 < res['port'] < 65536:
+            errors.append('%s.port: must be in 1..65535, got %s' % (name, res['port']))
+        if res['db'] < 0:
+            errors.append('%s.db: must be >= 0, got %s' % (name, res['db']))
+        if res['minsize'] < 0 or res['maxsize'] < 1 or res['minsize'] > res['maxsize']:
+            errors.append('%s: expected 0 <= minsize <= maxsize and maxsize >= 1, got %s/%s' % (
+                name, res['minsize'], res['maxsize']))
+        if res['blocking_maxsize'] < 1:
+            errors.append('%s.blocking_maxsize: must be >= 1, got %s' % (name, res['blocking_maxsize']))
+        if res['timeout'] is not None and res['timeout'] <= 0:
+            errors.append('%s.timeout: must be > 0, got %s' % (name, res['timeout']))
+        if res['retry_delay'] < 0 or res['retry_count'] < 1:
+            errors.append('%s: expected retry_delay >= 0 and retry_count >= 1, got %s/%s' % (
+                name, res['retry_delay'], res['retry_count']))
+        if res['codec'] not in CODECS:
+            errors.append('%s.codec: expected one of %s, got %r' % (
+                name, ', '.join(CODECS), res['codec']))
+        if res['max_replica_lag'] < 0:
+            errors.append('%s.max_replica_lag: must be >= 0, got %s' % (
+                name, res['max_replica_lag']))
+        for field in ADDRESS_LIST_FIELDS:
+            for i, address in enumerate(res[field]):
+                if not (isinstance(address, dict) and isinstance(address.get('host'), str)
+                        and isinstance(address.get('port'), int)):
+                    errors.append('%s.%s[%s]: expected {host: str, port: int}, got %r' % (
+                        name, field, i, address))
+        if res['sentinels'] and not res['service_name']:
+            errors.append('%s.service_name: required when sentinels are set' % name)
+        if res['cluster_nodes'] and res['db'] != 0:
+            errors.append('%s.db: cluster supports only db 0, got %s' % (name, res['db']))
+
+    if errors:
+        raise RedisConfigError('Invalid redis configuration:\n  ' + '\n  '.join(errors))
+
+    if isinstance(res['password'], int):
+        res['password'] = str(res['password'])
+
+    # Replica inherits primary params, except of the overridden ones
+    for field in ADDRESS_LIST_FIELDS:
+        res[field] = [{'host': a['host'], 'port': a['port']} for a in res[field]]
+    primary = dict(res, replicas=(), sentinels=(), service_name=None, cluster_nodes=())
+    res['replicas'] = [
+        validate_pool_config(dict(primary, **replica) if isinstance(replica, dict) else replica,
+                             name='%s.replicas[%s]' % (name, i))
+        for i, replica in enumerate(res['replicas'])]
+    return res
+
+
+def validate_config(conf):
+    """
+    Validates all sections of a profile. The 'default'
+      section is merged into every other section.
+
+    :param dict conf: params loaded from config file
+
+    :return: normalized params by section name
+    :rtype: dict
+    """
+    if not isinstance(conf, dict):
+        raise RedisConfigError('Config must be a mapping, got %r' % (conf,))
+    default = conf.get(DEFAULT_SECTION) or {}
+    for name, section in conf.items():
+        # An empty section ('redis3:') is loaded as None
+        if not isinstance(section, dict) and not (name == DEFAULT_SECTION and section is None):
+            raise RedisConfigError('%s: section must be a mapping, got %r' % (name, section))
+    return {name: validate_pool_config(dict(default, **section), name=name)
+            for name, section in conf.items() if name != DEFAULT_SECTION}
+
+
+def profile_path(profile=None):
+    """
+    Returns path of the profile config file.
+
+    :param str profile: profile name, CONFIG_PROFILE by default
+
+    :return: absolute path to yaml file
+    :rtype: str
+    """
+    return os.path.join(CONFIG_DIR, '%s.yml' % (profile or CONFIG_PROFILE))
+
+
+def load_profile(profile=None):
+    """
+    Loads and validates profile config.
+
+    :param str profile: profile name, CONFIG_PROFILE by default
+
+    :return: normalized params by section name
+    :rtype: dict
+    """
+    return validate_config(load_config(profile_path(profile)))
+
+
+def pool_changed(old_conf, new_conf):
+    """
+    Checks if new params require a new connection pool.
+
+    :param dict old_conf: current pool params
+    :param dict new_conf: new pool params
+
+    :return: True if pool must be recreated
+    :rtype: bool
+    """
+    return any(old_conf.get(field) != new_conf.get(field) for field in POOL_FIELDS)
+
+
+def blocking_pool_changed(old_conf, new_conf):
+    """
+    Checks if new params require a new blocking commands pool.
+
+    :param dict old_conf: current pool params
+    :param dict new_conf: new pool params
+
+    :return: True if blocking pool must be recreated
+    :rtype: bool
+    """
+    return any(old_conf.get(field) != new_conf.get(field) for field in BLOCKING_POOL_FIELDS)
+
+
+class ConfigWatcher:
+    """
+    Polls profile config file and applies changed sections
+      to the registered clients without restart.
+    """
+    def __init__(self, loop, profile=None, interval=CONFIG_RELOAD_INTERVAL):
+        """
+        :param loop: asyncio EventLoop
+        :param str profile: profile name, CONFIG_PROFILE by default
+        :param float interval: poll interval (sec)
+
+        :return: None
+        """
+        self.loop = loop
+        self.file_name = profile_path(profile)
+        self.interval = interval
+        self.conf = load_profile(profile)
+        self._stamp = self._file_stamp()
+        self._clients = {}
+        self._task = None
+
+    def _file_stamp(self):
+        st = os.stat(self.file_name)
+        return st.st_mtime_ns, st.st_size
+
+    def register(self, section, client):
+        """
+        Registers client to be reconfigured when the section changes.
+          Client must implement 'async reconfigure(conf)'.
+
+        :param str section: section name
+        :param client: RedisClient instance
+
+        :return: None
+        """
+        self._clients.setdefault(section, []).append(client)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch(), loop=self.loop)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except (OSError, RuntimeError, RedisConfigError) as e:
+                logger.error('Config reload failed, keep current config: %s', e)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The watcher must survive any bad edit of the config file
+                logger.exception('Config reload failed unexpectedly, keep current config')
+
+    async def reload(self):
+        """
+        Reloads config file if it was modified. Invalid config
+          is rejected as a whole and the current one is kept.
+          A section is taken as current only after all its clients
+          applied it, failed sections are retried on the next reload.
+
+        :return: names of applied sections
+        :rtype: list
+        """
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return []
+
+        new_conf = validate_config(load_config(self.file_name))
+        changed = [name for name, section in new_conf.items()
+                   if self.conf.get(name) != section]
+
+        applied, failed = [], []
+        for name in changed:
+            logger.info('Config section changed: %s', name)
+            try:
+                for client in self._clients.get(name, ()):
+                    await client.reconfigure(new_conf[name])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('Config section %s is not applied, retry on next reload: %s', name, e)
+                failed.append(name)
+            else:
+                self.conf[name] = new_conf[name]
+                applied.append(name)
+
+        if not failed:
+            # File stamp is kept old until every section is applied
+            self.conf = new_conf
+            self._stamp = stamp
+        return applied
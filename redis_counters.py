@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+    Counters aggregator: increments of hot counters are summed in
+    process and flushed as deltas by one pipeline of INCRBY/HINCRBY
+    on interval or when pending increments reach the threshold.
+    Counters in Redis lag behind by up to flush_interval, so the
+    interval and threshold trade staleness for round trips.
+    There is no exit hook: increments which are not flushed are lost
+    if stop() is not awaited on shutdown.
+"""
+import asyncio
+
+from settings import logger, COUNTERS_FLUSH_INTERVAL, COUNTERS_FLUSH_THRESHOLD
+
+
+class CounterAggregator:
+    """ Sums increments locally and flushes them in batches """
+
+    def __init__(self, rd, flush_interval=COUNTERS_FLUSH_INTERVAL,
+                 flush_threshold=COUNTERS_FLUSH_THRESHOLD):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param float flush_interval: max time increments stay local (sec)
+        :param int flush_threshold: pending increments which trigger flush,
+          1 - every increment is sent at once
+
+        :return: None
+        """
+        self.rd = rd
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.deltas = {}  # key: delta
+        self.hash_deltas = {}  # (key, field): delta
+        self.pending = 0
+        self.increments = 0
+        self.commands = 0
+        self.flushes = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_future = None
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    def incr(self, key, amount=1):
+        """
+        Adds increment of the string counter (INCRBY/INCRBYFLOAT).
+
+        :param str key: counter key
+        :param amount: increment
+        :type amount: int or float
+
+        :return: None
+        """
+        self.deltas[key] = self.deltas.get(key, 0) + amount
+        self._added()
+
+    def hincr(self, key, field, amount=1):
+        """
+        Adds increment of the hash field counter (HINCRBY/HINCRBYFLOAT).
+
+        :param str key: hash key
+        :param str field: counter field
+        :param amount: increment
+        :type amount: int or float
+
+        :return: None
+        """
+        self.hash_deltas[key, field] = self.hash_deltas.get((key, field), 0) + amount
+        self._added()
+
+    def _added(self):
+        self.pending += 1
+        self.increments += 1
+        if self.pending >= self.flush_threshold and (
+                self._flush_future is None or self._flush_future.done()):
+            loop = asyncio.get_event_loop()
+            # Without running loop increments wait for periodic flush or stop()
+            if loop.is_running():
+                self._flush_future = loop.create_task(self.flush())
+                self._flush_future.add_done_callback(self._flushed)
+
+    @staticmethod
+    def _flushed(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Counters threshold flush failed: %s', future.exception())
+
+    def local_delta(self, key, field=None):
+        """
+        Returns increments of the counter which are not flushed yet,
+          value in Redis plus local delta is the up to date value.
+
+        :param str key: counter key
+        :param str field: hash field for hash counters
+
+        :return: not flushed delta
+        :rtype: int or float
+        """
+        if field is None:
+            return self.deltas.get(key, 0)
+        return self.hash_deltas.get((key, field), 0)
+
+    async def flush(self):
+        """
+        Sends all local deltas by one pipeline. If the pipeline
+          fails the deltas are merged back and sent by next flush.
+
+        :return: number of sent commands
+        :rtype: int
+        """
+        async with self._flush_lock:
+            deltas, hash_deltas, pending = self.deltas, self.hash_deltas, self.pending
+            self.deltas, self.hash_deltas, self.pending = {}, {}, 0
+            pipe = self.rd.pipeline()
+            sent = 0
+            for key, delta in deltas.items():
+                if delta:
+                    (pipe.incrbyfloat if isinstance(delta, float) else pipe.incrby)(key, delta)
+                    sent += 1
+            for (key, field), delta in hash_deltas.items():
+                if delta:
+                    (pipe.hincrbyfloat if isinstance(delta, float) else pipe.hincrby)(key, field, delta)
+                    sent += 1
+            if not sent:
+                return 0
+            try:
+                await pipe.execute()
+            except BaseException:
+                # Cancelled flush keeps its deltas too, they are sent by the final flush
+                for key, delta in deltas.items():
+                    self.deltas[key] = self.deltas.get(key, 0) + delta
+                for key, delta in hash_deltas.items():
+                    self.hash_deltas[key] = self.hash_deltas.get(key, 0) + delta
+                self.pending += pending
+                raise
+            self.commands += sent
+            self.flushes += 1
+            return sent
+
+    def stats(self):
+        """
+        Returns aggregation stats.
+
+        :return: increments, sent commands, flushes, reduction of Redis ops
+        :rtype: dict
+        """
+        return {
+            'increments': self.increments,
+            'commands': self.commands,
+            'flushes': self.flushes,
+            'reduction': self.increments / self.commands if self.commands else None,
+        }
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error('Counters flush failed: %s', e)
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stops periodic flush and flushes the rest, must be
+          called on shutdown before the pool is closed, otherwise
+          not flushed increments are lost.
+
+        :return: None
+        """
+        if self._task is not None:
+            # Not cancelled: a flush in progress is completed, not interrupted
+            self._stopping.set()
+            await self._task
+            self._task = None
+        if self._flush_future is not None:
+            await asyncio.gather(self._flush_future, return_exceptions=True)
+        await self.flush()
+        logger.info('Counters: %(increments)s increments sent by %(commands)s commands '
+                    'in %(flushes)s flushes, reduction - %(reduction)s', self.stats())
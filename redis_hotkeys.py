@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+    Hot slots and hot keys detector for cluster deployments.
+    Command keys are sampled on the client side: every sampled key
+    increments its slot counter and Space-Saving top-K of keys, so
+    memory is bounded by 16384 slot counters and top_k keys.
+    For Space-Saving see: Metwally et al., "Efficient Computation
+    of Frequent and Top-k Elements in Data Streams".
+"""
+import asyncio
+import random
+from array import array
+
+from redis_slots import CLUSTER_SLOTS, key_slot, key_slots
+from settings import logger, HOTKEYS_REPORT_INTERVAL, HOTKEYS_SAMPLE_RATE, HOTKEYS_TOP_K
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K counter: at most 'capacity' keys are tracked,
+      a new key replaces the key with minimal count and inherits
+      its count as possible overestimation error.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            victim = min(self.counts, key=self.counts.get)
+            error = self.counts.pop(victim)
+            self.errors.pop(victim)
+        self.counts[key] = error + count
+        self.errors[key] = error
+
+    def top(self, n=None):
+        """
+        Returns keys ranked by estimated count.
+
+        :param int n: number of keys, all tracked keys by default
+
+        :return: list of (key, estimated count, max overestimation)
+        :rtype: list
+        """
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+    def clear(self):
+        self.counts.clear()
+        self.errors.clear()
+
+
+class HotKeysDetector:
+    """ Samples command keys and builds ranked hot slots/keys report """
+
+    def __init__(self, sample_rate=HOTKEYS_SAMPLE_RATE, top_k=HOTKEYS_TOP_K):
+        """
+        :param float sample_rate: part of keys to sample, 0..1
+        :param int top_k: number of tracked hot keys
+
+        :return: None
+        """
+        self.sample_rate = sample_rate
+        self.slots = array('L', bytes(array('L').itemsize * CLUSTER_SLOTS))
+        self.keys = SpaceSaving(top_k)
+        self.sampled = 0
+        self._task = None
+
+    def record(self, key):
+        """
+        Samples one command key.
+
+        :param key: key name
+        :type key: str or bytes
+
+        :return: None
+        """
+        if random.random() < self.sample_rate:
+            self.slots[key_slot(key)] += 1
+            self.keys.add(key)
+            self.sampled += 1
+
+    def record_many(self, keys):
+        """
+        Samples keys of multi-key command.
+
+        :param list keys: list of keys
+
+        :return: None
+        """
+        sampled = [key for key in keys if random.random() < self.sample_rate]
+        for key, slot in zip(sampled, key_slots(sampled)):
+            self.slots[slot] += 1
+            self.keys.add(key)
+        self.sampled += len(sampled)
+
+    def reset(self):
+        self.slots = array('L', bytes(array('L').itemsize * CLUSTER_SLOTS))
+        self.keys.clear()
+        self.sampled = 0
+
+    async def report(self, cluster=None, top=10):
+        """
+        Builds ranked report of hot slots and keys per node. Estimated
+          ops are sampled counts scaled by sample rate. With cluster
+          client the slots are grouped by owner node and completed by
+          CLUSTER COUNTKEYSINSLOT, so hot slot with few keys (a hot
+          key) differs from hot slot with many keys (resharding case).
+
+        :param cluster: cluster client with slot map
+        :type cluster: redis_cluster.RedisClusterClient
+        :param int top: number of slots and keys per node
+
+        :return: node: {'slots': [(slot, ops, keys)], 'keys': [(key, ops, error)]}
+        :rtype: dict
+        """
+        scale = 1 / self.sample_rate if self.sample_rate else 0
+
+        def node_of(slot):
+            if cluster is None or cluster.slots[slot] is None:
+                return 'local'
+            return '%s:%s' % cluster.slots[slot]
+
+        res = {}
+        hot_slots = sorted((slot for slot in range(CLUSTER_SLOTS) if self.slots[slot]),
+                           key=self.slots.__getitem__, reverse=True)
+        for slot in hot_slots:
+            node = res.setdefault(node_of(slot), {'slots': [], 'keys': []})
+            if len(node['slots']) < top:
+                node['slots'].append([slot, int(self.slots[slot] * scale), None])
+        for key, count, error in self.keys.top():
+            node = res.setdefault(node_of(key_slot(key)), {'slots': [], 'keys': []})
+            if len(node['keys']) < top:
+                node['keys'].append((key, int(count * scale), int(error * scale)))
+
+        if cluster is not None:
+            entries = [entry for node in res.values() for entry in node['slots']]
+            counts = await asyncio.gather(*(
+                cluster.execute_slot(entry[0], b'CLUSTER', b'COUNTKEYSINSLOT', entry[0])
+                for entry in entries), return_exceptions=True)
+            for entry, count in zip(entries, counts):
+                entry[2] = None if isinstance(count, Exception) else count
+        return res
+
+    async def _report_periodically(self, cluster, interval, top):
+        while True:
+            await asyncio.sleep(interval)
+            report = await self.report(cluster, top)
+            for node, hot in sorted(report.items()):
+                logger.info('HOT_SLOTS: NODE - %s, (SLOT, OPS, KEYS) - %s', node, hot['slots'])
+                logger.info('HOT_KEYS: NODE - %s, (KEY, OPS, ERROR) - %s', node, hot['keys'])
+            self.reset()
+
+    def start(self, cluster=None, interval=HOTKEYS_REPORT_INTERVAL, top=10):
+        """
+        Starts periodic report, counters are reset after each report.
+
+        :param cluster: cluster client with slot map
+        :type cluster: redis_cluster.RedisClusterClient
+        :param float interval: report interval (sec)
+        :param int top: number of slots and keys per node
+
+        :return: None
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(
+                self._report_periodically(cluster, interval, top))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+    Distributed rate limiters: fixed window (INCRBY + PEXPIRE), sliding
+    log (sorted set of request timestamps) and token bucket (hash with
+    tokens and last refill time). Every check is one EVALSHA of the
+    script cached on the server, many keys are checked in one pipeline.
+
+    With local_fraction > 0 a remote check takes a lease of up to
+    local_fraction * limit units at once, following checks of the key
+    are allowed in process until the lease is spent or expires, so
+    the limit may be exceeded by the local part of the budget at most.
+"""
+import hashlib
+import time
+import uuid
+
+import aioredis
+
+from settings import logger
+
+# Common arguments of the scripts:
+#   KEYS[1] - limiter key
+#   ARGV[1] - limit, ARGV[2] - window (ms), ARGV[3] - now (ms),
+#   ARGV[4] - units wanted, ARGV[5] - units needed (at least),
+#   ARGV[6] - unique request id
+# Reply: {granted units (0 - denied), remaining units, retry after (ms)}
+
+FIXED_WINDOW_SCRIPT = """
+local limit, window = tonumber(ARGV[1]), tonumber(ARGV[2])
+local want, need = tonumber(ARGV[4]), tonumber(ARGV[5])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.min(want, limit - current)
+if granted < need then
+    return {0, limit - current, math.max(0, redis.call('PTTL', KEYS[1]))}
+end
+current = redis.call('INCRBY', KEYS[1], granted)
+if current == granted then
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+return {granted, limit - current, 0}
+"""
+
+SLIDING_LOG_SCRIPT = """
+local limit, window, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local want, need = tonumber(ARGV[4]), tonumber(ARGV[5])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local granted = math.min(want, limit - count)
+if granted < need then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local retry = 0
+    if oldest[2] then
+        retry = tonumber(oldest[2]) + window - now
+    end
+    return {0, limit - count, retry}
+end
+for i = 1, granted do
+    redis.call('ZADD', KEYS[1], now, ARGV[6] .. ':' .. i)
+end
+redis.call('PEXPIRE', KEYS[1], window)
+return {granted, limit - count - granted, 0}
+"""
+
+TOKEN_BUCKET_SCRIPT = """
+local limit, window, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local want, need = tonumber(ARGV[4]), tonumber(ARGV[5])
+local rate = limit / window
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(want, math.floor(tokens))
+local retry = 0
+if granted < need then
+    granted = 0
+    retry = math.ceil((need - tokens) / rate)
+end
+tokens = tokens - granted
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+return {granted, math.floor(tokens), retry}
+"""
+
+
+class RateLimiter:
+    """
+    Base limiter: runs SCRIPT by EVALSHA and keeps local leases.
+      Check result is (allowed, remaining units, retry after (ms)).
+    """
+    SCRIPT = None
+
+    def __init__(self, rd, limit, window, local_fraction=0.0, prefix='ratelimit'):
+        """
+        :param rd: Redis connection pool
+        :type rd: aioredis.Redis
+        :param int limit: units allowed per window
+        :param float window: window (sec)
+        :param float local_fraction: part of the limit which may be
+          allowed in process without round trip, 0..1
+        :param str prefix: keys prefix
+
+        :return: None
+        """
+        self.rd = rd
+        self.limit = limit
+        self.window_ms = int(window * 1000)
+        self.lease = max(1, int(limit * local_fraction))
+        self.prefix = prefix
+        self.sha = hashlib.sha1(self.SCRIPT.encode()).hexdigest()
+        self.leases = {}  # key: [units, expires at (monotonic)]
+        self.round_trips = 0
+        self.local_hits = 0
+
+    def _take_local(self, key, cost):
+        lease = self.leases.get(key)
+        if lease is None:
+            return False
+        if lease[1] <= time.monotonic() or lease[0] < cost:
+            del self.leases[key]
+            return False
+        lease[0] -= cost
+        self.local_hits += 1
+        return True
+
+    def _script_args(self, cost):
+        return [self.limit, self.window_ms, int(time.time() * 1000),
+                max(cost, self.lease), cost, uuid.uuid4().hex]
+
+    def _result(self, key, cost, reply):
+        granted, remaining, retry = reply
+        if granted > cost:
+            # Short-lived lease, so unused units do not leak far into later windows
+            self.leases[key] = [granted - cost, time.monotonic() + self.window_ms / 2000]
+        return granted > 0, remaining, retry
+
+    async def _evalsha_many(self, requests):
+        """
+        Runs the script for (key, cost) requests in one pipeline.
+          On NOSCRIPT (script cache was flushed) the script
+          is loaded and failed requests are sent again.
+
+        :param list requests: list of (key, cost)
+
+        :return: script replies
+        :rtype: list
+        """
+        pipe = self.rd.pipeline()
+        for key, cost in requests:
+            pipe.evalsha(self.sha, keys=['%s:%s' % (self.prefix, key)], args=self._script_args(cost))
+        replies = await pipe.execute(return_exceptions=True)
+        self.round_trips += 1
+
+        missing = [i for i, reply in enumerate(replies)
+                   if isinstance(reply, aioredis.errors.ReplyError) and 'NOSCRIPT' in str(reply)]
+        if missing:
+            logger.debug('Rate limiter script %s is loaded', self.sha)
+            await self.rd.script_load(self.SCRIPT)
+            retried = await self._evalsha_many([requests[i] for i in missing])
+            for i, reply in zip(missing, retried):
+                replies[i] = reply
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    async def check(self, key, cost=1):
+        """
+        Checks and consumes cost units of the key.
+
+        :param str key: limited entity, e.g. user id or IP
+        :param int cost: units of the request
+
+        :return: (allowed, remaining units, retry after (ms))
+        :rtype: tuple
+        """
+        return (await self.check_many([key], cost))[0]
+
+    async def check_many(self, keys, cost=1):
+        """
+        Checks many keys, keys without local lease are
+          checked by one pipeline.
+
+        :param list keys: limited entities
+        :param int cost: units of every request
+
+        :return: (allowed, remaining units, retry after (ms)) per key
+        :rtype: list
+        """
+        results = [None] * len(keys)
+        remote = []
+        for i, key in enumerate(keys):
+            if self._take_local(key, cost):
+                results[i] = (True, self.leases[key][0], 0)
+            else:
+                remote.append(i)
+        if remote:
+            replies = await self._evalsha_many([(keys[i], cost) for i in remote])
+            for i, reply in zip(remote, replies):
+                results[i] = self._result(keys[i], cost, reply)
+        return results
+
+    async def reset(self, key):
+        self.leases.pop(key, None)
+        await self.rd.delete('%s:%s' % (self.prefix, key))
+
+
+class FixedWindowLimiter(RateLimiter):
+    """ Counter per window, the window starts with the first request """
+    SCRIPT = FIXED_WINDOW_SCRIPT
+
+
+class SlidingLogLimiter(RateLimiter):
+    """ Exact sliding window over a sorted set of request timestamps """
+    SCRIPT = SLIDING_LOG_SCRIPT
+
+
+class TokenBucketLimiter(RateLimiter):
+    """ Bucket of 'limit' tokens refilled at limit / window per second """
+    SCRIPT = TOKEN_BUCKET_SCRIPT
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    Read replicas routing for RedisClient.
+    Read-only commands go to a replica chosen by power-of-two-choices
+    over EWMA latency, replicas with broken link or big lag are skipped.
+"""
+import asyncio
+import contextvars
+import random
+import time
+
+from contextlib import contextmanager
+
+import aioredis
+
+from custom_errors import RedisConnectionLost
+from settings import logger, REDIS_REPLICA_EWMA_ALPHA, REDIS_REPLICA_HEALTH_INTERVAL
+from utils import parse_info
+
+# Read-your-writes scope of the current task: None or {'written': bool}
+_rw_scope = contextvars.ContextVar('redis_rw_scope', default=None)
+
+
+@contextmanager
+def read_your_writes():
+    """
+    Inside this scope reads go to the primary after the first write,
+      so the task always sees its own writes despite replication lag.
+
+    Example:
+        with read_your_writes():
+            await rd.setv('key', 'value')
+            await rd.getv('key')  # served by primary
+
+    :return: None
+    """
+    token = _rw_scope.set({'written': False})
+    try:
+        yield
+    finally:
+        _rw_scope.reset(token)
+
+
+def scope_has_writes():
+    scope = _rw_scope.get()
+    return scope is not None and scope['written']
+
+
+def mark_scope_write():
+    scope = _rw_scope.get()
+    if scope is not None:
+        scope['written'] = True
+
+
+class ReplicaNode:
+    """ Replica connection pool with observed latency and health state """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.pool = None
+        self.ewma = 0.0
+        self.inflight = 0
+        self.healthy = False
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.conf['host'], self.conf['port'])
+
+    @property
+    def score(self):
+        # Penalize busy nodes, so a slow burst does not pile up on one replica
+        return self.ewma * (self.inflight + 1)
+
+    @contextmanager
+    def track(self, alpha=REDIS_REPLICA_EWMA_ALPHA):
+        """
+        Measures command latency and updates EWMA on success.
+
+        :param float alpha: EWMA smoothing factor
+
+        :return: None
+        """
+        self.inflight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+        elapsed = time.monotonic() - start
+        self.ewma = elapsed if not self.ewma else alpha * elapsed + (1 - alpha) * self.ewma
+
+    def mark_down(self, reason):
+        if self.healthy:
+            logger.warning('Redis replica %s marked unhealthy: %s', self.address, reason)
+        self.healthy = False
+
+
+class ReplicaSet:
+    """ Set of read replicas of one primary """
+
+    def __init__(self, loop, confs, create_pool, max_lag):
+        """
+        :param loop: asyncio EventLoop
+        :param list confs: validated pool params of every replica
+        :param create_pool: coroutine function, creates pool by params
+        :param max_lag: max replication lag (sec) of healthy replica
+
+        :return: None
+        """
+        self.loop = loop
+        self.nodes = [ReplicaNode(conf) for conf in confs]
+        self.max_lag = max_lag
+        self._create_pool = create_pool
+        self._task = None
+
+    def __bool__(self):
+        return bool(self.nodes)
+
+    def choose(self):
+        """
+        Chooses replica by power of two random choices: the one
+          with lower latency score of two random healthy nodes.
+
+        :return: replica or None if there is no healthy replica
+        :rtype: ReplicaNode
+        """
+        healthy = [node for node in self.nodes if node.healthy]
+        if len(healthy) < 2:
+            return healthy[0] if healthy else None
+        first, second = random.sample(healthy, 2)
+        return first if first.score <= second.score else second
+
+    async def check_node(self, node):
+        """
+        Checks replica by INFO replication: node must be a replica
+          with link to master up and lag not greater than max_lag.
+
+        :param ReplicaNode node: replica to check
+
+        :return: None
+        """
+        try:
+            if node.pool is None:
+                node.pool = await self._create_pool(node.conf)
+            async with node.pool.get() as conn:
+                info = parse_info(await conn.execute(b'INFO', b'replication', encoding='utf-8'))
+        except (OSError, RedisConnectionLost, aioredis.errors.RedisError) as e:
+            node.mark_down('check failed: %s' % e)
+            return
+
+        lag = int(info.get('master_last_io_seconds_ago', -1))
+        if info.get('role') != 'slave':
+            node.mark_down('role is %s' % info.get('role'))
+        elif info.get('master_link_status') != 'up':
+            node.mark_down('master link is %s' % info.get('master_link_status'))
+        elif info.get('master_sync_in_progress') == '1':
+            node.mark_down('initial sync in progress')
+        elif lag < 0 or lag > self.max_lag:
+            node.mark_down('replication lag %s s' % lag)
+        else:
+            if not node.healthy:
+                logger.info('Redis replica %s is healthy', node.address)
+            node.healthy = True
+
+    async def check_health(self):
+        await asyncio.gather(*(self.check_node(node) for node in self.nodes))
+
+    async def _watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.check_health()
+
+    async def start(self, interval=REDIS_REPLICA_HEALTH_INTERVAL):
+        """
+        Checks replicas and starts periodic health checks.
+
+        :param float interval: delay between checks (sec)
+
+        :return: None
+        """
+        await self.check_health()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch(interval), loop=self.loop)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def close(self):
+        await self.stop()
+        for node in self.nodes:
+            if node.pool is not None:
+                node.pool.close()
+                await node.pool.wait_closed()
+                node.pool = None
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+    Redis Sentinel discovery for RedisClient.
+    Resolves current master and replicas of the service and
+    listens +switch-master events, so failover is applied at once.
+    For details see: https://redis.io/topics/sentinel-clients
+"""
+import asyncio
+
+import aioredis
+
+from custom_errors import RedisConnectionLost
+from settings import logger, REDIS_SENTINEL_TIMEOUT
+
+# Replica flags which mean that replica must not be used
+REPLICA_DOWN_FLAGS = {'s_down', 'o_down', 'disconnected'}
+
+
+def pairs_to_dict(reply):
+    """
+    Converts flat [key, value, key, value, ...] reply to dict.
+
+    :param list reply: SENTINEL reply
+
+    :return: key: value
+    :rtype: dict
+    """
+    return dict(zip(reply[::2], reply[1::2]))
+
+
+class SentinelResolver:
+    """ Resolves addresses of the service nodes by Sentinel """
+
+    def __init__(self, loop, sentinels, service, timeout=REDIS_SENTINEL_TIMEOUT, password=None):
+        """
+        :param loop: asyncio EventLoop
+        :param list sentinels: list of (host, port) of sentinels
+        :param str service: monitored master name
+        :param float timeout: sentinel connection and reply timeout (sec)
+        :param str password: sentinel password
+
+        :return: None
+        """
+        self.loop = loop
+        self.sentinels = list(sentinels)
+        self.service = service
+        self.timeout = timeout
+        self.password = password
+        self._task = None
+
+    async def _connect(self, address):
+        return await asyncio.wait_for(
+            aioredis.create_connection(address, password=self.password, loop=self.loop),
+            self.timeout)
+
+    async def _query(self, conn, *args):
+        return await asyncio.wait_for(conn.execute(b'SENTINEL', *args, encoding='utf-8'),
+                                      self.timeout)
+
+    async def discover(self):
+        """
+        Asks sentinels one by one for the master and replicas
+          addresses. The first sentinel which replied is moved
+          to the head of the list, as Sentinel clients guide says.
+
+        :return: master (host, port) and list of replicas (host, port)
+        :rtype: tuple
+        """
+        for i, address in enumerate(self.sentinels):
+            try:
+                conn = await self._connect(address)
+            except (OSError, asyncio.TimeoutError, aioredis.errors.RedisError) as e:
+                logger.warning('Sentinel %s:%s is unavailable: %s', address[0], address[1], e)
+                continue
+            try:
+                master = await self._query(conn, b'get-master-addr-by-name', self.service)
+                if not master:
+                    logger.warning('Sentinel %s:%s does not know service %s',
+                                   address[0], address[1], self.service)
+                    continue
+                replicas = await self._query(conn, b'slaves', self.service)
+            except (OSError, asyncio.TimeoutError, aioredis.errors.RedisError) as e:
+                logger.warning('Sentinel %s:%s query failed: %s', address[0], address[1], e)
+                continue
+            finally:
+                conn.close()
+
+            self.sentinels.insert(0, self.sentinels.pop(i))
+            replicas = [pairs_to_dict(replica) for replica in replicas]
+            return (master[0], int(master[1])), [
+                (replica['ip'], int(replica['port'])) for replica in replicas
+                if not REPLICA_DOWN_FLAGS & set(replica['flags'].split(','))
+                and replica.get('master-link-status', 'ok') == 'ok']
+
+        raise RedisConnectionLost
+
+    async def _listen(self, address, on_switch):
+        conn = await self._connect(address)
+        try:
+            channel = aioredis.Channel('+switch-master', is_pattern=False, loop=self.loop)
+            await conn.execute_pubsub(b'SUBSCRIBE', channel)
+            logger.debug('Subscribed to +switch-master on sentinel %s:%s', *address)
+            while await channel.wait_message():
+                # <master name> <old ip> <old port> <new ip> <new port>
+                name, _, _, host, port = (await channel.get(encoding='utf-8')).split()
+                if name == self.service:
+                    logger.info('Sentinel: master of %s switched to %s:%s', name, host, port)
+                    await on_switch((host, int(port)))
+        finally:
+            conn.close()
+
+    async def _watch(self, on_switch, retry_delay):
+        while True:
+            for address in list(self.sentinels):
+                try:
+                    await self._listen(address, on_switch)
+                except (OSError, asyncio.TimeoutError, aioredis.errors.RedisError) as e:
+                    logger.warning('Sentinel %s:%s subscription lost: %s', address[0], address[1], e)
+            await asyncio.sleep(retry_delay)
+
+    def watch(self, on_switch, retry_delay=1):
+        """
+        Starts listening of +switch-master events. Subscription
+          is moved to the next sentinel if the current one fails.
+
+        :param on_switch: coroutine function, called with new master (host, port)
+        :param float retry_delay: delay after all sentinels failed (sec)
+
+        :return: None
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch(on_switch, retry_delay), loop=self.loop)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
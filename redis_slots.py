@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+    Client side computation of Redis Cluster hash slots,
+    same as CLUSTER KEYSLOT: CRC16(key or {hashtag}) mod 16384.
+    For details see: https://redis.io/topics/cluster-spec#keys-distribution-model
+"""
+from array import array
+from binascii import crc_hqx
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, pure python path is used
+    np = None
+
+CLUSTER_SLOTS = 16384
+SLOT_MASK = CLUSTER_SLOTS - 1
+
+# Batches smaller than this are faster without numpy
+NUMPY_MIN_BATCH = 256
+NUMPY_CHUNK = 65536
+
+CRC16_TABLE = [crc_hqx(bytes((byte,)), 0) for byte in range(256)]
+if np is not None:
+    CRC16_TABLE = np.array(CRC16_TABLE, dtype=np.uint16)
+
+
+def crc16(data):
+    """
+    CRC16 XMODEM (poly 0x1021, init 0) used by Redis Cluster.
+      binascii.crc_hqx is the same table-driven CRC-CCITT in C.
+
+    :param bytes data: data to hash
+
+    :return: checksum
+    :rtype: int
+    """
+    return crc_hqx(data, 0)
+
+
+def hash_tag(key, opening=b'{', closing=b'}'):
+    """
+    Returns the part of key which is hashed: the content of the first
+      {...} if it is not empty, else the whole key.
+
+    :param bytes key: key name, str if braces are str too
+    :param bytes opening: opening brace
+    :param bytes closing: closing brace
+
+    :return: hashed part of key
+    :rtype: bytes
+    """
+    start = key.find(opening)
+    if start != -1:
+        end = key.find(closing, start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def key_slot(key):
+    """
+    Returns hash slot of the key, same as CLUSTER KEYSLOT.
+
+    :param key: key name
+    :type key: str or bytes
+
+    :return: hash slot
+    :rtype: int
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return crc_hqx(hash_tag(key), 0) & SLOT_MASK
+
+
+def _key_slots_numpy(keys):
+    """
+    Vectorized CRC16 of a chunk of keys: hashed parts of keys
+      ({hashtag} or the whole key) are packed right-aligned into
+      byte matrix and CRC is updated column by column for all keys
+      at once. Leading zero bytes do not change CRC16 with zero
+      init, so padding needs no masking.
+
+    :param list keys: list of keys (str or bytes)
+
+    :return: hash slot of every key
+    :rtype: numpy.ndarray
+    """
+    try:
+        text = ''.join(keys)
+    except TypeError:
+        text = None
+    if text is not None and text.isascii():
+        # Fast path: ascii str keys are encoded at once, byte length == str length
+        parts = [hash_tag(k, '{', '}') if '{' in k else k for k in keys]
+        joined = ''.join(parts).encode('ascii')
+    else:
+        parts = [k.encode('utf-8') if isinstance(k, str) else k for k in keys]
+        parts = [hash_tag(k) if b'{' in k else k for k in parts]
+        joined = b''.join(parts)
+
+    lengths = np.fromiter(map(len, parts), dtype=np.int64, count=len(parts))
+    width = int(lengths.max())
+    matrix = np.zeros((len(parts), width), dtype=np.uint8)
+    # Row-major order of the mask is the order of bytes in joined parts
+    matrix[np.arange(width) >= width - lengths[:, None]] = np.frombuffer(joined, dtype=np.uint8)
+
+    crc = np.zeros(len(parts), dtype=np.uint16)
+    for column in np.ascontiguousarray(matrix.T):
+        # uint16 shift drops high bits, same as (crc << 8) & 0xFFFF
+        crc = (crc << 8) ^ CRC16_TABLE[(crc >> 8) ^ column]
+    return crc & SLOT_MASK
+
+
+def key_slots(keys):
+    """
+    Returns hash slots of many keys at once. With numpy big
+      batches are hashed by vectorized table-driven CRC16,
+      else CRC16 is computed in C by crc_hqx key by key.
+
+    :param list keys: list of keys (str or bytes)
+
+    :return: hash slot of every key
+    :rtype: numpy.ndarray(uint16) or array.array('H') without numpy
+    """
+    if np is not None and len(keys) >= NUMPY_MIN_BATCH:
+        keys = list(keys)
+        return np.concatenate([_key_slots_numpy(keys[i:i + NUMPY_CHUNK])
+                               for i in range(0, len(keys), NUMPY_CHUNK)])
+    encoded = (k.encode('utf-8') if isinstance(k, str) else k for k in keys)
+    return array('H', [crc_hqx(hash_tag(k) if b'{' in k else k, 0) & SLOT_MASK
+                       for k in encoded])
+
+
+def group_by_slot(keys):
+    """
+    Groups key indexes by hash slot.
+
+    :param list keys: list of keys
+
+    :return: slot: list of key indexes in input order
+    :rtype: dict
+    """
+    slots = key_slots(keys)
+    if np is not None and isinstance(slots, np.ndarray):
+        order = np.argsort(slots, kind='stable')
+        ordered = slots[order]
+        bounds = np.flatnonzero(np.diff(ordered)) + 1
+        return {int(slots[group[0]]): group.tolist()
+                for group in np.split(order, bounds) if len(group)}
+
+    groups = {}
+    for i, slot in enumerate(slots):
+        groups.setdefault(slot, []).append(i)
+    return groups
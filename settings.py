@@ -1,9 +1,6 @@
-import asyncio
 import os
 import logging
 
-from logging import config
-
 __all__ = ['logger', 'BASE_DIR']
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +10,29 @@ DEBUG = False
 
 REDIS_RECONNECT_DELAY = 1  # sec
 REDIS_RECONNECT_RETRIES = 10000
+REDIS_RECONFIGURE_RETRIES = 3  # new pool attempts on config reload
+REDIS_POOL_DRAIN_TIMEOUT = 30  # sec
+REDIS_REPLICA_HEALTH_INTERVAL = 5  # sec
+REDIS_REPLICA_EWMA_ALPHA = 0.3
+REDIS_SENTINEL_TIMEOUT = 0.5  # sec
+REDIS_CLUSTER_MAX_REDIRECTS = 5
+REDIS_CLUSTER_FANOUT_TIMEOUT = 5  # sec
+
+# Hot keys detector settings
+
+HOTKEYS_SAMPLE_RATE = 0.01
+HOTKEYS_TOP_K = 100
+HOTKEYS_REPORT_INTERVAL = 60  # sec
+
+# Counters aggregator settings
+
+COUNTERS_FLUSH_INTERVAL = 1  # sec
+COUNTERS_FLUSH_THRESHOLD = 10000  # pending increments
+
+# Config settings
+
+CONFIG_PROFILE = os.environ.get('REDIS_CONFIG_PROFILE', 'dev')
+CONFIG_RELOAD_INTERVAL = 5  # sec
 
 # Logger settings
 
@@ -64,17 +84,35 @@ LOGGING_LEVEL = int(LOGGING_LEVEL_ENV) if LOGGING_LEVEL_ENV else logging.DEBUG
 
 def setup_logging(base_severity=LOGGING_LEVEL):
     """Logging setup"""
+    from logging import config
+
     config.dictConfig(LOGGING)
     log = logging.getLogger(BASE_LOGGER)
     log.setLevel(base_severity)
 
     # Setup asyncio logging
     if os.environ.get('PYTHONASYNCIODEBUG'):
+        import asyncio
+
         asyncio.get_event_loop().set_debug(True)
         logging.captureWarnings(True)
 
     return log
 
-logger = setup_logging()
+
+class LazyLogger:
+    """
+    Logger proxy which runs setup_logging on the first
+      logger call instead of at import time.
+    """
+    def __init__(self, setup=setup_logging):
+        self._setup = setup
+        self._logger = None
+
+    def __getattr__(self, name):
+        if self._logger is None:
+            self._logger = self._setup()
+        return getattr(self._logger, name)
 
 
+logger = LazyLogger()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import json
-import yaml
+import os
+import pickle
 import uuid
 
 from datetime import datetime, date
@@ -22,23 +23,109 @@ class CustomJsonEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def load_config(file_name):
+def _config_cache_path(file_name):
     """
-    Данный метод предназначен для загрузки конфигурационного
-      файла в формате *.yaml.
+    Данный метод возвращает путь к кэшу разобранного
+      конфигурационного файла (рядом с файлом, в __pycache__).
 
     :param str file_name: абсолютный путь к конфигурационому файлу.
 
-    :return config: ассоциативный массив с конфигурационными параметрами,
-      разделенных по секциям.
+    :return: путь к pickle-файлу кэша
+    :rtype: str
+    """
+    dir_name, base_name = os.path.split(file_name)
+    return os.path.join(dir_name, '__pycache__', base_name + '.pickle')
+
+
+def _read_config_cache(cache_path, stamp):
+    """
+    Данный метод читает кэш конфигурации, если он
+      создан для той же версии (mtime, size) yaml файла.
+
+    :param str cache_path: путь к pickle-файлу кэша
+    :param tuple stamp: (st_mtime_ns, st_size) yaml файла
+
+    :return: конфигурация или None, если кэш устарел
+    :rtype: dict or None
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_stamp, config = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    return config if cached_stamp == stamp else None
+
+
+def _write_config_cache(cache_path, stamp, config):
+    """
+    Данный метод атомарно сохраняет разобранную конфигурацию
+      в кэш. Ошибки записи (например, read-only FS) игнорируются.
+
+    :param str cache_path: путь к pickle-файлу кэша
+    :param tuple stamp: (st_mtime_ns, st_size) yaml файла
+    :param dict config: разобранная конфигурация
+
+    :return: None
+    """
+    tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((stamp, config), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def parse_yaml(file_name):
+    """
+    Данный метод разбирает конфигурационный файл в формате *.yaml.
+      Модуль yaml импортируется только здесь, чтобы не замедлять
+      запуск, когда конфигурация берется из кэша.
+
+    :param str file_name: абсолютный путь к конфигурационому файлу.
+
+    :return config: ассоциативный массив с конфигурационными параметрами
     :rtype: dict
     """
+    import yaml
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(file_name, 'rt') as f:
         try:
-            config = yaml.load(f)
+            return yaml.load(f, Loader=loader)
         except yaml.error.MarkedYAMLError as e:
             raise RuntimeError('Incorrect configuration yaml file format: %s' % e)
-        return config
+
+
+def load_config(file_name, use_cache=True):
+    """
+    Данный метод предназначен для загрузки конфигурационного
+      файла в формате *.yaml. Разобранная конфигурация кэшируется
+      в pickle-файл, ключ кэша - mtime и размер yaml файла.
+
+    :param str file_name: абсолютный путь к конфигурационому файлу.
+    :param bool use_cache: если False - всегда разбирать yaml файл.
+
+    :return config: ассоциативный массив с конфигурационными параметрами,
+      разделенных по секциям.
+    :rtype: dict
+    """
+    if not use_cache:
+        return parse_yaml(file_name)
+
+    st = os.stat(file_name)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cache_path = _config_cache_path(file_name)
+
+    config = _read_config_cache(cache_path, stamp)
+    if config is None:
+        config = parse_yaml(file_name)
+        _write_config_cache(cache_path, stamp, config)
+    return config
 
 
 def serialize_json(data, **options):
@@ -68,3 +155,41 @@ def deserialize_json(data, **options):
     :rtype: dict
     """
     return json.loads(data, **options)
+
+
+def parse_info(info):
+    """
+    Данный метод разбирает ответ команды INFO
+      в ассоциативный массив (секции не разделяются).
+
+    :param str info: ответ команды INFO
+
+    :return: ассоциативный массив поле: значение
+    :rtype: dict
+    """
+    res = {}
+    for line in info.splitlines():
+        if line and not line.startswith('#') and ':' in line:
+            key, value = line.split(':', 1)
+            res[key] = value
+    return res
+
+
+def pipeline_command(pipe, command, *args, **kwargs):
+    """
+    Данный метод добавляет произвольную команду в pipeline
+      или multi_exec aioredis. Pipeline.execute() выполняет
+      сам pipeline, поэтому команда берется у буфера pipeline
+      через Pipeline.__getattr__ - это внутреннее устройство
+      aioredis 1.x (requirements.txt), в aioredis 2 не работает.
+
+    :param pipe: pipeline или multi_exec
+    :type pipe: aioredis.commands.transaction.Pipeline
+    :param bytes command: имя команды
+    :param args: аргументы команды
+    :param kwargs: опции команды (encoding)
+
+    :return: future с ответом команды
+    :rtype: asyncio.Future
+    """
+    return pipe.__getattr__('execute')(command, *args, **kwargs)